@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="snippet-bench-"))
+
+import snippet_engine as se  # noqa: E402
+from datagen import make_corpus  # noqa: E402
+
+
+async def run(count, train_size, seed):
+    corpus = make_corpus(count + train_size, seed)
+    train, held_out = corpus[:train_size], corpus[train_size:]
+    raw_bytes = sum(len(code.encode('utf-8')) for code in held_out)
+    for label, use_dictionary in (("zlib без словаря", False), ("zlib + словарь", True)):
+        blobs = se.CodeBlobStore(f"blobs-{use_dictionary}.bin", dicts_dir=f"dicts-{use_dictionary}")
+        if use_dictionary:
+            await blobs.train(train)
+        refs = await blobs.append_many(held_out)
+        stored = sum(ref[1] for ref in refs)
+        timings = []
+        for ref in refs:
+            blobs._cache.clear()
+            started = time.perf_counter()
+            assert blobs.read(*ref)
+            timings.append((time.perf_counter() - started) * 1e6)
+        timings.sort()
+        print(f"{label:17}: коэффициент {raw_bytes / stored:5.2f}, "
+              f"чтение p50 {statistics.median(timings):6.1f} мкс, "
+              f"p99 {timings[int(len(timings) * 0.99)]:6.1f} мкс")
+        hot = refs[:se.CODE_CACHE_SIZE]
+        for ref in hot:
+            blobs.read(*ref)
+        started = time.perf_counter()
+        for ref in hot:
+            blobs.read(*ref)
+        print(f"{'':17}  чтение из LRU {(time.perf_counter() - started) * 1e6 / len(hot):6.2f} мкс")
+        blobs.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сжатие тел сниппетов: коэффициент и задержка чтения")
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--train", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(run(args.count, args.train, args.seed))
+
+
+if __name__ == "__main__":
+    main()
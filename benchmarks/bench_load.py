@@ -0,0 +1,225 @@
+"""Сквозной нагрузочный прогон через настоящий Application из snippet_bot.build_application().
+
+Бот подключается к локальной заглушке Bot API (fake_bot_api.py), апдейты подаются в
+update_queue, как при polling. Виртуальные пользователи параллельно проходят сценарии
+«просмотр → открыть → в избранное → поиск → inline-поиск → добавить», администраторы модерируют
+присланные сниппеты. Для каждого шага считаются p50/p95/p99 от постановки апдейта
+в очередь до окончания его обработки, для прогона — апдейтов в секунду.
+
+    python benchmarks/bench_load.py --users 50 --rounds 3 --latency 40 --flood-rate 0.01
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.setdefault("TRACING", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="snippet-load-"))
+
+import snippet_bot as sb  # noqa: E402
+from datagen import make_code, make_snippet  # noqa: E402
+from fake_bot_api import FakeBotApi  # noqa: E402
+from telegram import Update  # noqa: E402
+
+UPDATE_IDS = itertools.count(1)
+WAITERS = {}
+
+
+class LoadApplication(sb.TracedApplication):
+    # Сигнализирует драйверу, что апдейт полностью обработан
+    async def process_update(self, update):
+        try:
+            await super().process_update(update)
+        finally:
+            waiter = WAITERS.pop(getattr(update, 'update_id', None), None)
+            if waiter and not waiter.done():
+                waiter.set_result(None)
+
+
+def snippet_id(name):
+    return hashlib.md5(name.encode()).hexdigest()[:16]
+
+
+class VirtualUser:
+    def __init__(self, application, user_id, latencies, rng):
+        self.application = application
+        self.user_id = user_id
+        self.latencies = latencies
+        self.rng = rng
+        self.profile = {"id": user_id, "is_bot": False, "first_name": f"Load {user_id}", "username": f"load{user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+
+    def message(self, text):
+        data = {"message_id": next(UPDATE_IDS), "date": int(time.time()), "chat": self.chat,
+                "from": self.profile, "text": text}
+        if text.startswith("/"):
+            data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": data}
+
+    def callback(self, data):
+        message = {"message_id": 1, "date": int(time.time()), "chat": self.chat, "text": "…"}
+        return {"callback_query": {"id": str(next(UPDATE_IDS)), "chat_instance": "load", "from": self.profile,
+                                   "message": message, "data": data}}
+
+    def inline(self, query, offset=""):
+        return {"inline_query": {"id": str(next(UPDATE_IDS)), "from": self.profile, "query": query, "offset": offset}}
+
+    async def send(self, step, payload):
+        update_id = next(UPDATE_IDS)
+        update = Update.de_json(dict(payload, update_id=update_id), self.application.bot)
+        waiter = WAITERS[update_id] = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        await self.application.update_queue.put(update)
+        await waiter
+        self.latencies[step].append((time.perf_counter() - started) * 1000)
+
+    async def browse_and_open(self):
+        await self.send("browse", self.message("📋 Все"))
+        await self.send("browse_next_page", self.callback("page_show_1"))
+        name = self.rng.choice(list(sb.storage.snippets))
+        await self.send("open", self.callback(f"show_{snippet_id(name)}"))
+        await self.send("favorite", self.callback(f"fav_{snippet_id(name)}"))
+
+    async def search(self):
+        await self.send("search", self.message(f"/search {self.rng.choice(['user', 'form', 'cart', 'menu'])}"))
+
+    async def inline_search(self):
+        # Inline-запрос на каждое нажатие клавиши, затем следующая страница
+        word = self.rng.choice(['user', 'form', 'cart', 'menu'])
+        await self.send("inline_empty", self.inline(""))
+        for length in range(1, len(word) + 1):
+            await self.send("inline_keystroke", self.inline(word[:length]))
+        await self.send("inline_next_page", self.inline(word, str(sb.INLINE_PAGE_SIZE)))
+
+    async def submit(self, round_no):
+        await self.send("submit_start", self.message("📥 Добавить"))
+        await self.send("submit_name", self.message(f"load {self.user_id} {round_no}"))
+        await self.send("submit_language", self.message(f"{sb.LANGUAGES['PHP']} PHP"))
+        await self.send("submit_tags", self.message("⏩ Пропустить"))
+        await self.send("submit_code", self.message(make_code(self.rng, 'PHP')[1]))
+        await self.send("submit_done", self.message("✅ Готово"))
+
+    async def moderate(self):
+        await self.send("moderate_list", self.message("/pending"))
+        # Первая заявка страницы, которую не держит другой администратор
+        queue = sb.storage.moderation_queue
+        name = next((name for name in queue.page(0, sb.ITEMS_PER_PAGE) if queue.claimed_by(name) is None), None)
+        if name is None:
+            return
+        sid = snippet_id(name)
+        await self.send("moderate_review", self.callback(f"review_{sid}"))
+        await self.send("moderate_approve", self.callback(f"approve_{sid}"))
+
+
+def prepare_data(library, admins, seed):
+    # Код внутри JSON — старый формат: при старте бот сам перенесёт его в хранилище блоков
+    rng = random.Random(seed)
+    os.makedirs(sb.DATA_DIR, exist_ok=True)
+    with open(sb.storage.snippets_file, "w", encoding="utf-8") as f:
+        json.dump({f"snippet {i}": make_snippet(rng, i) for i in range(library)}, f, ensure_ascii=False)
+    with open(sb.admin_manager.admins_file, "w", encoding="utf-8") as f:
+        json.dump([str(admin_id) for admin_id in admins], f)
+
+
+async def user_journey(user, rounds):
+    for round_no in range(rounds):
+        await user.browse_and_open()
+        await user.search()
+        await user.inline_search()
+        await user.submit(round_no)
+
+
+async def admin_journey(admin, users_done):
+    while not users_done.is_set() or sb.storage.pending_snippets:
+        await admin.moderate()
+        if not sb.storage.pending_snippets:
+            await asyncio.sleep(0.05)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(args):
+    admins = [10 ** 6 + i for i in range(args.admins)]
+    prepare_data(args.library, admins, args.seed)
+    api = await FakeBotApi(args.latency / 1000, args.jitter / 1000, args.flood_rate, seed=args.seed).start()
+    application = sb.build_application(token="1:load", base_url=api.base_url, application_class=LoadApplication)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    latencies = defaultdict(list)
+    rng = random.Random(args.seed)
+    users = [VirtualUser(application, 1000 + i, latencies, random.Random(rng.random())) for i in range(args.users)]
+    moderators = [VirtualUser(application, admin_id, latencies, random.Random(rng.random())) for admin_id in admins]
+    users_done = asyncio.Event()
+
+    started = time.perf_counter()
+    admin_tasks = [asyncio.ensure_future(admin_journey(admin, users_done)) for admin in moderators]
+    await asyncio.gather(*(user_journey(user, args.rounds) for user in users))
+    users_done.set()
+    await asyncio.gather(*admin_tasks)
+    elapsed = time.perf_counter() - started
+
+    await application.stop()
+    await application.post_shutdown(application)
+    await application.shutdown()
+    await api.stop()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"Пользователей: {args.users}, админов: {args.admins}, раундов: {args.rounds}, "
+          f"библиотека: {args.library}, задержка API: {args.latency:.0f}±{args.jitter:.0f} мс")
+    print(f"{'шаг':<20} {'n':>6} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+    for step, values in latencies.items():
+        print(f"{step:<20} {len(values):>6} {percentile(values, 0.5):>9.1f} "
+              f"{percentile(values, 0.95):>9.1f} {percentile(values, 0.99):>9.1f}")
+    print(f"\nАпдейтов: {total} за {elapsed:.1f} с — {total / elapsed:.1f} апдейтов/с")
+    print(f"Вызовов API: {sum(api.calls.values())} ({', '.join(f'{k}×{v}' for k, v in api.calls.most_common())})")
+    if api.floods:
+        print(f"Ответов 429: {sum(api.floods.values())} ({', '.join(f'{k}×{v}' for k, v in api.floods.most_common())})")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "args": vars(args),
+                "updates_per_second": total / elapsed,
+                "api_calls": dict(api.calls),
+                "floods": dict(api.floods),
+                "steps": {step: {"count": len(values), "p50_ms": percentile(values, 0.5),
+                                 "p95_ms": percentile(values, 0.95), "p99_ms": percentile(values, 0.99)}
+                          for step, values in latencies.items()},
+            }, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="одновременных пользователей")
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--rounds", type=int, default=3, help="повторов сценария на пользователя (не больше 5 — дневной лимит)")
+    parser.add_argument("--library", type=int, default=2000, help="сниппетов в библиотеке")
+    parser.add_argument("--latency", type=float, default=30.0, help="задержка заглушки Bot API, мс")
+    parser.add_argument("--jitter", type=float, default=20.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="записать результаты в JSON")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    sb.logger.setLevel("CRITICAL")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
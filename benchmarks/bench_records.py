@@ -0,0 +1,67 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="snippet-bench-"))
+
+import snippet_engine as se  # noqa: E402
+from datagen import make_snippet, make_user  # noqa: E402
+
+
+def measure(factory):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = factory()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, objects
+
+
+def copy_strings(value):
+    # json.loads создаёт отдельный объект для каждой строки-значения (ключи он переиспользует)
+    if isinstance(value, str):
+        return "".join(list(value))
+    if isinstance(value, list):
+        return [copy_strings(item) for item in value]
+    if isinstance(value, dict):
+        return {k: copy_strings(v) for k, v in value.items()}
+    return value
+
+
+def normalized(item):
+    # Битовые маски не хранят порядок, поэтому флаги сравниваем как множества
+    return {k: set(v) if k in ('achievements', 'seen_memes') else v for k, v in item.items()}
+
+
+def run(kind, count, seed):
+    rng = random.Random(seed)
+    if kind == 'snippets':
+        record_cls = se.SnippetRecord
+        raw = [make_snippet(rng, i) for i in range(count)]
+    else:
+        record_cls = se.UserRecord
+        raw = [make_user(rng, i, se.ACHIEVEMENTS, se.CODE_MEMES) for i in range(count)]
+    dict_bytes, dicts = measure(lambda: [copy_strings(item) for item in raw])
+    record_bytes, records = measure(lambda: [record_cls.from_dict(copy_strings(item)) for item in raw])
+    assert all(normalized(r.to_dict()) == normalized(d) for r, d in zip(records, dicts))
+    print(f"{kind:9} x{count}: dict {dict_bytes / count:7.1f} B/запись, "
+          f"slots {record_bytes / count:7.1f} B/запись, "
+          f"экономия {100 * (1 - record_bytes / dict_bytes):5.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память на запись: dict против __slots__-записей")
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    for kind in ('snippets', 'users'):
+        run(kind, args.count, args.seed)
+
+
+if __name__ == "__main__":
+    main()
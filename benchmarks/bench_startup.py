@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="snippet-bench-"))
+
+import snippet_engine as se  # noqa: E402
+from datagen import make_snippet, make_user  # noqa: E402
+
+
+async def prepare(engine, count, seed):
+    rng = random.Random(seed)
+    snippets = {}
+    for i in range(count):
+        data = make_snippet(rng, i)
+        data.pop('code')
+        data['code_ref'] = [i * 100, 100, 1]
+        snippets[f"snippet {i}"] = se.SnippetRecord.from_dict(data, engine.storage.code_blobs)
+    names = list(snippets)
+    engine.storage.snippets = snippets
+    engine.users.users = {
+        str(i): se.UserRecord.from_dict(make_user(rng, i, se.ACHIEVEMENTS, se.CODE_MEMES, names))
+        for i in range(count)
+    }
+    await engine.storage.save_snippets()
+    await engine.users.save_users()
+
+
+async def timed_load(engine, use_snapshots):
+    se.BINARY_SNAPSHOTS = use_snapshots
+    engine.storage.snippets, engine.users.users = {}, {}
+    started = time.perf_counter()
+    await engine.storage.load_snippets()
+    await engine.users.load_users()
+    elapsed = time.perf_counter() - started
+    se.BINARY_SNAPSHOTS = True
+    return elapsed
+
+
+async def run(sizes, seed):
+    print(f"{'записей':>8} | {'JSON, мс':>9} | {'снимок, мс':>10} | ускорение")
+    for count in sizes:
+        os.chdir(tempfile.mkdtemp(prefix=f"startup-{count}-"))
+        os.makedirs(se.DATA_DIR)
+        engine = se.SnippetEngine(se.DATA_DIR)
+        await prepare(engine, count, seed)
+        json_time = min([await timed_load(engine, False) for _ in range(3)])
+        snapshot_time = min([await timed_load(engine, True) for _ in range(3)])
+        assert len(engine.storage.snippets) == count and len(engine.users.users) == count
+        print(f"{count:>8} | {json_time * 1000:>9.1f} | {snapshot_time * 1000:>10.1f} | x{json_time / snapshot_time:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время загрузки данных при старте: JSON против бинарного снимка")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    se.logger.setLevel("WARNING")
+    asyncio.run(run(args.sizes, args.seed))
+
+
+if __name__ == "__main__":
+    main()
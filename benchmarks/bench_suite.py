@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="snippet-bench-"))
+
+import snippet_bot as sb  # noqa: E402
+import snippet_engine as se  # noqa: E402
+from datagen import make_snippet, make_user  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERIES = ("user", "form", "x9", "snippet 1")
+
+
+class FakeBot:
+    async def send_message(self, **kwargs):
+        return SimpleNamespace(message_id=1)
+
+    async def delete_message(self, **kwargs):
+        return True
+
+
+def fake_update(user_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=user_id), effective_user=SimpleNamespace(id=user_id))
+
+
+def populate(snippet_count, user_count, seed):
+    # Авторы — первые 5% пользователей, как у живой библиотеки с небольшим ядром авторов
+    rng = random.Random(seed)
+    authors = max(1, user_count // 20)
+    snippets = {}
+    for i in range(snippet_count):
+        data = make_snippet(rng, i, authors=authors)
+        data.pop('code')
+        data['code_ref'] = [i * 100, 100, 1]
+        snippets[f"snippet {i}"] = se.SnippetRecord.from_dict(data, sb.storage.code_blobs)
+    pending = {}
+    for i in range(max(1, snippet_count // 50)):
+        data = make_snippet(rng, i, authors=authors)
+        data.pop('code')
+        data['code_ref'] = [i * 100, 100, 1]
+        data['user_id'] = str(rng.randrange(user_count))
+        pending[f"pending {i}"] = se.PendingSnippetRecord.from_dict(data, sb.storage.code_blobs)
+    names = list(snippets)
+    users = {
+        str(i): se.UserRecord.from_dict(make_user(rng, i, sb.ACHIEVEMENTS, sb.CODE_MEMES, names))
+        for i in range(user_count)
+    }
+    sb.storage.snippets = snippets
+    sb.storage.pending_snippets = pending
+    sb.user_manager.users = users
+    sb.admin_manager.admins = [str(i) for i in range(5)]
+    return rng, authors
+
+
+async def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        if asyncio.iscoroutine(result):
+            await result
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+    }
+
+
+async def run_scale(snippet_count, user_count, seed, repeat):
+    os.chdir(tempfile.mkdtemp(prefix=f"suite-{snippet_count}-{user_count}-"))
+    os.makedirs('data')
+    rng, authors = populate(snippet_count, user_count, seed)
+    storage, users = sb.storage, sb.user_manager
+    library = storage.snippets
+    pages = max(1, -(-len(library) // sb.ITEMS_PER_PAGE))
+    sample_users = [str(rng.randrange(authors)) for _ in range(repeat)]
+    context = SimpleNamespace(bot=FakeBot(), user_data={})
+    # Пересчёт достижений медленный на больших базах — сокращаем число повторов
+    slow_repeat = max(1, repeat // 5) if user_count >= 100000 else repeat
+
+    # Индекс имён, рейтинг популярности и очередь модерации строятся при старте бота — не включаем их в замеры
+    await storage.refresh_popularity()
+    storage.prefix_search("", 1)
+    storage.priority = se.ModerationPriority(risk_delay=0)  # тел кода в синтетических записях нет
+    storage.rebuild_moderation_queue()
+
+    benchmarks = {}
+    for query in QUERIES:
+        benchmarks[f"search_snippets[{query}]"] = (lambda q=query: storage.search_snippets(q), repeat)
+    for query in ("",) + QUERIES:
+        benchmarks[f"prefix_search[{query}]"] = (
+            lambda q=query: storage.prefix_search(q, sb.INLINE_MAX_RESULTS), repeat
+        )
+    for language in sb.LANGUAGES:
+        benchmarks[f"filter_by_language[{language}]"] = (lambda lang=language: storage.filter_by_language(lang), repeat)
+    for tag in sb.CATEGORIES:
+        benchmarks[f"filter_by_tag[{tag}]"] = (lambda t=tag: storage.filter_by_tag(t), repeat)
+    benchmarks["get_user_snippets_stats"] = (
+        lambda: storage.get_user_snippets_stats(f"user{rng.choice(sample_users)}"), repeat
+    )
+    benchmarks["update_user_stats"] = (
+        lambda: users.update_user_stats(rng.choice(sample_users), rng.randrange(60), rng.randrange(3000)), slow_repeat
+    )
+    benchmarks["show_statistics"] = (lambda: sb.show_statistics(fake_update(1), context), repeat)
+    for label, page in (("first", 0), ("middle", pages // 2), ("last", pages - 1)):
+        benchmarks[f"create_snippets_keyboard[{label}]"] = (
+            lambda p=page: sb.create_snippets_keyboard(library, p, "show"), repeat
+        )
+    pending_pages = max(1, -(-len(storage.pending_snippets) // sb.ITEMS_PER_PAGE))
+    for label, page in (("first", 0), ("last", pending_pages - 1)):
+        benchmarks[f"get_pending_snippets_keyboard[{label}]"] = (
+            lambda p=page: sb.get_pending_snippets_keyboard(p), repeat
+        )
+    pending_name, pending_record = next(iter(storage.pending_snippets.items()))
+    benchmarks["moderation_queue.requeue"] = (
+        lambda: storage.moderation_queue.add(pending_name, pending_record), repeat
+    )
+    benchmarks["save_snippets"] = (storage.save_snippets, slow_repeat)
+    benchmarks["save_pending_snippets"] = (storage.save_pending_snippets, slow_repeat)
+    benchmarks["save_users"] = (users.save_users, slow_repeat)
+    benchmarks["save_admins"] = (sb.admin_manager.save_admins, repeat)
+
+    results = {}
+    for name, (func, count) in benchmarks.items():
+        results[name] = await timed(func, count)
+        print(f"  {name:<40} {results[name]['median_ms']:>10.2f} мс (медиана из {count})")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nСравнение с {baseline_path} ({baseline.get('revision')}):")
+    for scale, results in current['results'].items():
+        old_results = baseline['results'].get(scale)
+        if not old_results:
+            continue
+        print(f"[{scale}]")
+        for name, result in results.items():
+            old = old_results.get(name)
+            if not old or not old['median_ms']:
+                continue
+            ratio = result['median_ms'] / old['median_ms']
+            mark = "  ⚠️" if ratio > 1.2 else ""
+            print(f"  {name:<40} {old['median_ms']:>10.2f} → {result['median_ms']:>10.2f} мс  x{ratio:.2f}{mark}")
+
+
+def parse_scale(value):
+    snippets, _, users = value.partition(":")
+    return int(snippets), int(users or snippets)
+
+
+async def run(scales, seed, repeat):
+    results = {}
+    for snippet_count, user_count in scales:
+        print(f"Сниппетов: {snippet_count}, пользователей: {user_count}")
+        results[f"{snippet_count}:{user_count}"] = await run_scale(snippet_count, user_count, seed, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Синтетические бенчмарки хранилища, поиска, статистики и достижений"
+    )
+    parser.add_argument("--scale", type=parse_scale, nargs="+", default=[(1000, 10000), (20000, 100000)],
+                        metavar="SNIPPETS:USERS", help="размеры библиотеки и базы пользователей, например 200000:500000")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default=os.path.join(REPO_DIR, "benchmarks", "results.json"),
+                        help="куда записать результаты в JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON с результатами прошлой версии для сравнения")
+    args = parser.parse_args()
+    sb.logger.setLevel("WARNING")
+
+    results = asyncio.run(run(args.scale, args.seed, args.repeat))
+    report = {
+        'revision': git_revision(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты записаны в {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
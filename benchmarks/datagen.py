@@ -0,0 +1,75 @@
+import random
+from datetime import datetime, timedelta
+
+CATEGORIES = ['WordPress', 'Bitrix', 'Общее']
+
+# Шаблоны типового кода, из которых собираются синтетические сниппеты
+CODE_TEMPLATES = {
+    'PHP': [
+        "<?php\nsession_start();\n\nif ($_SERVER['REQUEST_METHOD'] === 'POST') {{\n    ${var} = trim($_POST['{field}'] ?? '');\n    if (${var} === '') {{\n        echo \"Поле {field} обязательно\";\n        exit;\n    }}\n    $_SESSION['{field}'] = ${var};\n    echo \"Сохранено: \" . htmlspecialchars(${var});\n}}\n?>\n",
+        "<?php\n$pdo = new PDO('mysql:host=localhost;dbname={table};charset=utf8mb4', 'root', '');\n$stmt = $pdo->prepare('SELECT * FROM {table} WHERE {field} = ?');\n$stmt->execute([${var}]);\nforeach ($stmt->fetchAll(PDO::FETCH_ASSOC) as $row) {{\n    echo $row['{field}'] . \"<br>\";\n}}\n",
+        "<?php\nadd_action('init', function () {{\n    register_post_type('{table}', [\n        'public' => true,\n        'label' => '{Title}',\n        'supports' => ['title', 'editor', '{field}'],\n    ]);\n}});\n",
+    ],
+    'JavaScript': [
+        "document.addEventListener('DOMContentLoaded', () => {{\n    const {var} = document.querySelector('#{field}');\n    {var}.addEventListener('click', async (event) => {{\n        event.preventDefault();\n        const response = await fetch('/api/{table}');\n        const data = await response.json();\n        console.log(data);\n    }});\n}});\n",
+        "function {var}({field}) {{\n    return new Promise((resolve, reject) => {{\n        setTimeout(() => {{\n            if (!{field}) {{\n                reject(new Error('{Title}'));\n            }}\n            resolve({field});\n        }}, 300);\n    }});\n}}\n",
+    ],
+    'HTML': [
+        "<form method=\"POST\" action=\"/{table}\">\n    <label for=\"{field}\">{Title}</label>\n    <input type=\"text\" id=\"{field}\" name=\"{field}\" required>\n    <button type=\"submit\">Отправить</button>\n</form>\n",
+        "<!DOCTYPE html>\n<html lang=\"ru\">\n<head>\n    <meta charset=\"UTF-8\">\n    <title>{Title}</title>\n</head>\n<body>\n    <div class=\"{field}\">\n        <div class=\"{var}\"></div>\n    </div>\n</body>\n</html>\n",
+    ],
+    'CSS': [
+        ".{field} {{\n    display: flex;\n    justify-content: center;\n    align-items: center;\n    margin: 0 auto;\n    padding: {num}px;\n}}\n\n.{field}__{var} {{\n    color: #{hex};\n    font-size: {num}px;\n}}\n",
+        "@media (max-width: {num}0px) {{\n    .{field} {{\n        flex-direction: column;\n        margin: 0;\n    }}\n}}\n",
+    ],
+}
+
+WORDS = ['user', 'order', 'product', 'login', 'email', 'price', 'cart', 'post', 'comment', 'token',
+         'avatar', 'status', 'profile', 'menu', 'header', 'footer', 'slider', 'modal', 'banner', 'form']
+
+
+def make_code(rng, language=None):
+    language = language or rng.choice(list(CODE_TEMPLATES))
+    parts = []
+    for _ in range(rng.randint(1, 3)):
+        template = rng.choice(CODE_TEMPLATES[language])
+        parts.append(template.format(
+            var=rng.choice(WORDS) + rng.choice(WORDS).title(),
+            field=rng.choice(WORDS),
+            table=rng.choice(WORDS) + 's',
+            Title=rng.choice(WORDS).title(),
+            num=rng.randint(1, 99),
+            hex=f"{rng.randrange(16 ** 6):06x}",
+        ))
+    return language, "\n".join(parts)
+
+
+def make_corpus(count, seed=42):
+    rng = random.Random(seed)
+    return [make_code(rng)[1] for _ in range(count)]
+
+
+def make_snippet(rng, i, authors=500):
+    return {
+        'code': make_code(rng)[1],
+        'language': rng.choice(list(CODE_TEMPLATES)),
+        'author': f"user{rng.randrange(authors)}",
+        'uses': rng.randrange(1000),
+        'tags': rng.sample(CATEGORIES, rng.randrange(len(CATEGORIES) + 1)),
+        'created_date': (datetime(2024, 1, 1) + timedelta(seconds=rng.randrange(10 ** 8))).isoformat(),
+    }
+
+
+def make_user(rng, i, achievements=(), memes=(), snippet_names=()):
+    return {
+        'favorites': rng.sample(snippet_names, min(len(snippet_names), rng.randrange(5))),
+        'achievements': rng.sample(list(achievements), min(len(achievements), rng.randrange(8))),
+        'level': rng.randrange(10),
+        'total_snippets': rng.randrange(100),
+        'total_uses': rng.randrange(5000),
+        'join_date': (datetime(2024, 1, 1) + timedelta(seconds=rng.randrange(10 ** 8))).isoformat(),
+        'seen_memes': rng.sample(list(memes), min(len(memes), rng.randrange(12))),
+        'username': f"user{i}",
+        'last_submission_date': "2025-05-01",
+        'submissions_today': rng.randrange(5),
+    }
@@ -0,0 +1,141 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных прогонов.
+
+Отвечает на sendMessage / editMessageText / deleteMessage / answerCallbackQuery и прочие
+методы правдоподобными ответами с настраиваемой задержкой; с заданной вероятностью
+возвращает 429 Too Many Requests, как при срабатывании flood-контроля.
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency 40 --flood-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Snippet Bot", "username": "snippet_load_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "sendDocument", "sendPhoto", "editMessageReplyMarkup"}
+
+
+class FakeBotApi:
+    def __init__(self, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.floods = Counter()
+        self._rng = random.Random(seed)
+        self._message_id = 1000
+        self._server = None
+        self.port = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._serve, host=host, port=port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        # HTTP/1.1 keep-alive: httpx переиспользует соединения из пула
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                path = request_line.decode("latin-1").split()[1]
+                status, payload = await self.handle(path.rsplit("/", 1)[-1], headers.get("content-type", ""), body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _params(self, content_type, body):
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        if content_type.startswith("application/json") and body:
+            return json.loads(body)
+        return {}  # multipart (файлы) разбирать не нужно
+
+    async def handle(self, method, content_type, body):
+        self.calls[method] += 1
+        delay = self.latency + self._rng.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if method != "getMe" and self._rng.random() < self.flood_rate:
+            self.floods[method] += 1
+            return "429 Too Many Requests", {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        params = self._params(content_type, body)
+        if method == "getMe":
+            return "200 OK", {"ok": True, "result": BOT_USER}
+        if method in MESSAGE_METHODS:
+            self._message_id += 1
+            chat_id = int(params.get("chat_id", 0) or 0)
+            message = {
+                "message_id": int(params.get("message_id", 0) or 0) or self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            if method == "sendDocument":
+                # Переотправка по file_id возвращает тот же file_id, загрузка — новый
+                file_id = params.get("document") if isinstance(params.get("document"), str) else f"doc{self._message_id}"
+                message["document"] = {"file_id": file_id, "file_unique_id": file_id}
+            return "200 OK", {"ok": True, "result": message}
+        return "200 OK", {"ok": True, "result": True}
+
+
+async def serve_forever(args):
+    api = await FakeBotApi(args.latency / 1000, args.jitter / 1000, args.flood_rate, seed=args.seed).start(port=args.port)
+    print(f"Заглушка Bot API: {api.base_url}<token>/<method>")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(dict(api.calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=30.0, help="задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=20.0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
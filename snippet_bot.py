@@ -1,13 +1,36 @@
 import logging
 import os
 import re
-import json
 import hashlib
+import json
+import marshal
 import math
+import sys
+import tempfile
+import time
 from datetime import datetime
 import random
-import aiofiles
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+import asyncio
+import cProfile
+import functools
+import io
+import logging.handlers
+import pstats
+import threading
+import traceback
+import tracemalloc
+from collections import deque
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedDocument,
+    InputTextMessageContent,
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+    MessageEntity,
+)
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -15,509 +38,763 @@ from telegram.ext import (
     CallbackQueryHandler,
     ContextTypes,
     ConversationHandler,
+    InlineQueryHandler,
+    TypeHandler,
     filters,
 )
-from telegram.error import TelegramError
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+from snippet_engine import (
+    ACHIEVEMENTS,
+    CATEGORIES,
+    CODE_MEMES,
+    DATA_DIR,
+    LANGUAGE_EXTENSIONS,
+    LANGUAGES,
+    LARGE_CODE_MAX_BYTES,
+    MAX_CODE_LENGTH,
+    USER_LEVELS,
+    SnippetEngine,
+    detect_file_language,
+    detect_language,
+    metrics,
+    parse_submission,
+    resolve_language,
+    snippet_risks,
+    tracer,
+)
 
 # Constants
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 if not BOT_TOKEN or not re.match(r'^\d+:[A-Za-z0-9_-]+$', BOT_TOKEN):
     raise ValueError("Некорректный формат BOT_TOKEN")
-MAX_CODE_LENGTH = 4000
-MAX_NAME_LENGTH = 100
+TRACING = os.environ.get("TRACING", "1") != "0"
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
 ITEMS_PER_PAGE = 10
 MEME_PROBABILITY = 0.2
-
-if not os.path.exists('data'):
-    os.makedirs('data')
+AUTO_LANGUAGE_BUTTON = "🪄 Определить по коду"
+UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+LARGE_CODE_PREVIEW = 1000
+ARCHIVE_MAX_UPLOAD = 50 * 1024 * 1024  # предел Bot API для загрузки документа
+ARCHIVE_BUTTON = "📦 Скачать архивом"
+DAILY_SUBMISSION_LIMIT = 5
+ADD_USAGE = (
+    "📥 Сниппет одним сообщением:\n"
+    "/add\n"
+    "name: Форма обратной связи\n"
+    "language: PHP\n"
+    "tags: WordPress, Общее\n"
+    "```php\n"
+    "<?php echo 'Привет'; ?>\n"
+    "```\n\n"
+    "Теги можно не указывать, язык — тоже: бот определит его по коду."
+)
+SESSION_SWEEP_INTERVAL = 5 * 60
+ADD_CONVERSATION_TIMEOUT = 30 * 60
+SESSION_COMPACT_AFTER = 60 * 60  # заметно дольше таймаута диалога: к сжатию черновик уже отменён
+SESSION_EVICT_AFTER = 24 * 60 * 60
+SESSION_PERSISTENT_KEYS = ('last_message_id', 'navigation')
+CODE_DICT_RETRAIN_INTERVAL = 6 * 60 * 60
+LOOP_HEARTBEAT_INTERVAL = 0.1
+LOOP_LAG_THRESHOLD = 0.25
+SLOW_HANDLER_THRESHOLD = 1.0
+STACK_SAMPLE_DEPTH = 12
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "8080"))
+PROFILE_MAX_UPDATES = 1000
+PROFILE_MAX_SECONDS = 600
+PROFILE_REPORT_LINES = 40
+TRACEMALLOC_FRAMES = 10
+INLINE_PAGE_SIZE = 20  # Bot API принимает до 50 результатов за ответ
+INLINE_MAX_RESULTS = 200
+INLINE_CACHE_TIME = 60
+POPULARITY_REFRESH_INTERVAL = 60
+BULK_MODERATION_LIMIT = 100
+BULK_NOTICE_NAMES = 20
+ADMIN_DIGEST_INTERVAL = int(os.environ.get("ADMIN_DIGEST_INTERVAL", "300"))  # 0 — уведомлять сразу
+ADMIN_DIGEST_MAX_ITEMS = 20
+MESSAGE_MAX_LENGTH = 4096
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024  # больше Bot API не отдаёт через getFile
 
 # Logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # File paths
-SNIPPETS_FILE = 'data/shared_snippets.json'
-PENDING_SNIPPETS_FILE = 'data/pending_snippets.json'
-USERS_FILE = 'data/users.json'
-ADMINS_FILE = 'data/admins.json'
+TRACE_FILE = os.path.join(DATA_DIR, 'traces', 'spans.jsonl')
+BROADCAST_STATE_FILE = os.path.join(DATA_DIR, 'broadcast.json')
+BROADCAST_RECIPIENTS_FILE = os.path.join(DATA_DIR, 'broadcast_recipients.json')
+BROADCAST_WORKERS = 8
+BROADCAST_RATE = 25  # сообщений в секунду: ниже общего лимита Bot API в ~30/с
+BROADCAST_RETRIES = 3
+BROADCAST_GONE_ERRORS = ('chat not found', 'user not found', 'user is deactivated')  # BadRequest про удалённый чат
+BROADCAST_CHECKPOINT_EVERY = 200
+BROADCAST_PROGRESS_INTERVAL = 15
 
 # States
 GET_NAME, GET_LANGUAGE, GET_TAGS, GET_CODE = range(4)
 
-# Languages and categories
-LANGUAGES = {
-    'JavaScript': '🟨',
-    'PHP': '🐘',
-    'CSS': '🎨',
-    'HTML': '🌐'
-}
-
-CATEGORIES = ['WordPress', 'Bitrix', 'Общее']
-
-USER_LEVELS = {
-    0: {'name': 'Junior', 'emoji': '🌱', 'min_snippets': 0, 'min_uses': 0},
-    1: {'name': 'Junior+', 'emoji': '🌿', 'min_snippets': 3, 'min_uses': 20},
-    2: {'name': 'Middle', 'emoji': '🌳', 'min_snippets': 10, 'min_uses': 100},
-    3: {'name': 'Middle+', 'emoji': '🌲', 'min_snippets': 25, 'min_uses': 300},
-    4: {'name': 'Senior', 'emoji': '🦅', 'min_snippets': 50, 'min_uses': 1000},
-    5: {'name': 'Кодовый маг', 'emoji': '🧙‍♂️', 'min_snippets': 100, 'min_uses': 2500},
-    6: {'name': 'Архитектор кода', 'emoji': '🏛️', 'min_snippets': 200, 'min_uses': 5000},
-    7: {'name': 'Кодовый титан', 'emoji': '💪⚡️', 'min_snippets': 350, 'min_uses': 10000},
-    8: {'name': 'Легенда кода', 'emoji': '🌟👑', 'min_snippets': 500, 'min_uses': 20000},
-    9: {'name': 'Бог кода', 'emoji': '⚜️🔥', 'min_snippets': 1000, 'min_uses': 50000}
-}
-
-ACHIEVEMENTS = {
-    'first_snippet': {'name': 'Первый сниппет', 'emoji': '🎉', 'description': 'Добавил первый сниппет'},
-    'popular_author': {'name': 'Популярный автор', 'emoji': '⭐', 'description': '100+ использований сниппетов'},
-    'code_master': {'name': 'Мастер кода', 'emoji': '🏆', 'description': '500+ использований сниппетов'},
-    'multilang': {'name': 'Полиглот', 'emoji': '🌍', 'description': 'Сниппеты на всех языках'},
-    'helpful': {'name': 'Помощник', 'emoji': '🤝', 'description': '10+ сниппетов в избранном у других'},
-    'active': {'name': 'Активист', 'emoji': '🔥', 'description': '25+ сниппетов'},
-    'code_comedian': {'name': 'Кодовый комик', 'emoji': '😂', 'description': 'Увидел 10 разных мемов от бота'},
-    'reliable_coder': {'name': 'Надёжный кодер', 'emoji': '✅', 'description': 'Сниппет прошёл модерацию и был одобрен'},
-    'snippet_marathon': {'name': 'Марафон сниппетов', 'emoji': '🏃', 'description': 'Добавил 5 сниппетов за один день'},
-    'code_sensei': {'name': 'Кодовый сенсей', 'emoji': '🥋', 'description': '50+ одобренных сниппетов'},
-    'tag_master': {'name': 'Мастер тегов', 'emoji': '🏷️', 'description': 'Использовал все доступные теги'},
-    'speed_coder': {'name': 'Скоростной кодер', 'emoji': '⚡', 'description': 'Добавил сниппет менее чем за 1 минуту'},
-    'community_star': {'name': 'Звезда сообщества', 'emoji': '🌟', 'description': '25+ пользователей добавили сниппет в избранное'},
-    'code_veteran': {'name': 'Ветеран кода', 'emoji': '🛡️', 'description': '100+ сниппетов'},
-    'bug_hunter': {'name': 'Охотник за багами', 'emoji': '🕵️', 'description': '10+ отклонённых сниппетов (для админов)'},
-    'language_guru': {'name': 'Гуру языка', 'emoji': '📚', 'description': '10+ сниппетов на одном языке'},
-    'snippet_savant': {'name': 'Савант сниппетов', 'emoji': '🧠', 'description': '1000+ просмотров всех сниппетов'},
-    'early_bird': {'name': 'Ранняя пташка', 'emoji': '🌅', 'description': 'Добавил сниппет с 5:00 до 7:00'},
-    'night_owl': {'name': 'Ночной кодер', 'emoji': '🦇', 'description': 'Добавил сниппет с 23:00 до 3:00'},
-    'code_crafter': {'name': 'Мастер кода', 'emoji': '🔨', 'description': 'Сниппет длиннее 1000 символов'},
-    'loyal_coder': {'name': 'Верный кодер', 'emoji': '🤗', 'description': 'Использует бота 30+ дней'},
-    'gatekeeper': {'name': 'Страж кода', 'emoji': '🛑', 'description': 'Модерировал 50+ сниппетов (для админов)'},
-    'justice_bringer': {'name': 'Вершитель правосудия', 'emoji': '⚖️', 'description': 'Отклонил 25+ сниппетов с подробными причинами (для админов)'},
-    'admin_mentor': {'name': 'Наставник админов', 'emoji': '👨‍🏫', 'description': 'Добавил 5+ новых администраторов (для админов)'},
-    'swift_moderator': {'name': 'Быстрый модератор', 'emoji': '🏎️', 'description': 'Модерировал 10+ сниппетов за час (для админов)'},
-    'code_inspector': {'name': 'Инспектор кода', 'emoji': '🔍', 'description': 'Одобрил 25+ сниппетов без жалоб (для админов)'}
-}
-
-CODE_MEMES = [
-    "Твой код настолько чистый, что его можно подавать на CodePen! 😎",
-    "Скопировал код? Не забудь убрать console.log! 😉",
-    "PHP? Это же слонячий код! 🐘",
-    "CSS: когда ты хотел быть дизайнером, но стал кодером! 🎨",
-    "JavaScript: потому что var всё ещё живёт в наших сердцах! 🟨",
-    "HTML: тег <br> — лучший способ сказать 'я сдаюсь'! 🌐",
-    "Код без багов? Это миф, как единорог! 🦄",
-    "Ты только что добавил сниппет? Пора за кофе! ☕",
-    "Сниппет готов? Проверяй, не сломал ли ты продакшен! 🚨",
-    "Код работает? Не трогай, оно само! 😅",
-    "Когда твой код работает с первого раза... Подозрительно! 🤔",
-    "CSS: 99% времени — это борьба с margin! 😤",
-    "JavaScript: async/await или как я перестал бояться и полюбил промисы! 🥳",
-    "PHP: echo 'Я всё ещё здесь!'; 🐘",
-    "Код без комментариев? Это как лабиринт без карты! 🗺️",
-    "HTML: <div> внутри <div> внутри <div>... Погружение началось! 🌊",
-    "Твой сниппет настолько хорош, что его лайкнул даже продакшен! 🚀"
-]
-
-class AdminManager:
+def deep_sizeof(obj, skip_ids=frozenset(), seen=None):
+    if seen is None:
+        seen = set()
+    obj_id = id(obj)
+    if obj_id in seen or obj_id in skip_ids:
+        return 0
+    seen.add(obj_id)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, skip_ids, seen) + deep_sizeof(value, skip_ids, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, skip_ids, seen)
+    return size
+
+class SessionSweeper:
     def __init__(self):
-        self.admins = []
-
-    async def initialize(self):
-        await self.load_admins()
+        self.last_activity = {}
+        self.total_reclaimed = 0
+        self.last_report = None
+
+    def touch(self, user_id):
+        self.last_activity[user_id] = time.monotonic()
+
+    def _shared_ids(self):
+        # Ссылки на общие данные хранилища не освобождаются при очистке сессии
+        shared = {id(storage.snippets), id(storage.pending_snippets)}
+        shared.update(id(data) for data in storage.snippets.values())
+        shared.update(id(data) for data in storage.pending_snippets.values())
+        return frozenset(shared)
+
+    async def sweep(self, context: ContextTypes.DEFAULT_TYPE):
+        application = context.application
+        now = time.monotonic()
+        shared = self._shared_ids()
+        evicted, compacted, reclaimed = 0, 0, 0
+        for user_id in list(application.user_data.keys()):
+            last_seen = self.last_activity.setdefault(user_id, now)
+            idle = now - last_seen
+            if idle < SESSION_COMPACT_AFTER:
+                continue
+            user_data = application.user_data[user_id]
+            # Загруженный файл брошенного черновика удаляется с диска, а не только из сессии
+            discard_code_file(user_data)
+            if idle >= SESSION_EVICT_AFTER:
+                reclaimed += deep_sizeof(user_data, shared)
+                application.drop_user_data(user_id)
+                self.last_activity.pop(user_id, None)
+                evicted += 1
+                continue
+            transient = [key for key in user_data if key not in SESSION_PERSISTENT_KEYS]
+            navigation = user_data.get('navigation') or {}
+            results = navigation.get('current_snippets')
+            # От результатов поиска и фильтра остаются только имена — словарь соберётся заново при листании
+            compact_results = results is not None and results is not storage.snippets
+            if not transient and not compact_results:
+                continue
+            for key in transient:
+                reclaimed += deep_sizeof(user_data.pop(key), shared)
+            if compact_results:
+                navigation['current_names'] = list(results)
+                del navigation['current_snippets']
+                reclaimed += deep_sizeof(results, shared) - sys.getsizeof(navigation['current_names'])
+            compacted += 1
+        for user_id in [uid for uid in self.last_activity if uid not in application.user_data]:
+            del self.last_activity[user_id]
+        self.total_reclaimed += reclaimed
+        self.last_report = {
+            'time': datetime.now().isoformat(),
+            'sessions': len(application.user_data),
+            'evicted': evicted,
+            'compacted': compacted,
+            'reclaimed_bytes': reclaimed
+        }
+        if evicted or compacted:
+            logger.info(
+                f"Очистка сессий: удалено {evicted}, сжато {compacted}, "
+                f"освобождено ~{reclaimed / 1024:.1f} КБ (всего ~{self.total_reclaimed / 1024:.1f} КБ)"
+            )
 
-    async def load_admins(self):
-        if os.path.exists(ADMINS_FILE):
-            try:
-                async with aiofiles.open(ADMINS_FILE, 'r', encoding='utf-8') as f:
-                    self.admins = json.loads(await f.read())
-                logger.info(f"Загружено {len(self.admins)} администраторов")
-            except (json.JSONDecodeError, IOError) as e:
-                logger.error(f"Ошибка при загрузке админов: {e}")
-                self.admins = []
-        else:
-            logger.warning(f"Файл {ADMINS_FILE} не найден, список админов пуст")
-            self.admins = []
+HANDLER_SECONDS = metrics.histogram('snippet_bot_handler_seconds', 'Время обработки апдейта', ('handler',))
+API_SECONDS = metrics.histogram('snippet_bot_api_request_seconds', 'Время запроса к Bot API', ('method',))
+API_ERRORS = metrics.counter('snippet_bot_api_errors_total', 'Ошибки запросов к Bot API', ('method', 'error'))
+LOOP_LAG = metrics.histogram('snippet_bot_loop_lag_seconds', 'Задержка цикла событий по heartbeat')
 
-    async def save_admins(self):
+class InstrumentedRequest(HTTPXRequest):
+    # Метод Bot API — последний сегмент URL запроса
+    async def post(self, url, *args, **kwargs):
+        method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
         try:
-            async with aiofiles.open(ADMINS_FILE, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(self.admins, indent=2, ensure_ascii=False))
-        except IOError as e:
-            logger.error(f"Ошибка при сохранении админов: {e}")
-
-    def is_admin(self, user_id):
-        return str(user_id) in self.admins
-
-    async def add_admin(self, user_id):
-        user_id = str(user_id)
-        if user_id not in self.admins:
-            self.admins.append(user_id)
-            await self.save_admins()
-            return True
-        return False
-
-class UserManager:
-    def __init__(self):
-        self.users = {}
-
-    async def initialize(self):
-        await self.load_users()
-
-    async def load_users(self):
-        if not os.path.exists(USERS_FILE):
-            logger.info(f"Файл {USERS_FILE} не найден, создаём пустой")
-            self.users = {}
-            try:
-                await self.save_users()
-            except Exception as e:
-                logger.error(f"Ошибка при создании {USERS_FILE}: {e}", exc_info=True)
+            with tracer.span(f'api.{method}'):
+                return await super().post(url, *args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(method, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method)
+
+class HealthServer:
+    # Минимальный HTTP-сервер на том же цикле событий: если цикл заблокирован,
+    # /healthz не ответит и liveness-проба перезапустит под
+    def __init__(self, port):
+        self.port = port
+        self.ready = False
+        self._server = None
+
+    async def start(self):
+        if not self.port:
             return
         try:
-            async with aiofiles.open(USERS_FILE, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                if content.strip():
-                    self.users = json.loads(content)
-                    logger.info(f"Загружено {len(self.users)} пользователей")
-                else:
-                    logger.warning(f"Файл {USERS_FILE} пуст, инициализируем пустым")
-                    self.users = {}
-        except (json.JSONDecodeError, IOError) as e:
-            logger.error(f"Ошибка при загрузке пользователей: {e}", exc_info=True)
-            backup_file = f"{USERS_FILE}.bak"
-            if os.path.exists(backup_file):
-                logger.info(f"Попытка восстановления из резервной копии {backup_file}")
-                try:
-                    async with aiofiles.open(backup_file, 'r', encoding='utf-8') as f:
-                        self.users = json.loads(await f.read())
-                        await self.save_users()
-                        logger.info("Пользователи восстановлены из резервной копии")
-                except Exception as e:
-                    logger.error(f"Ошибка восстановления пользователей: {e}", exc_info=True)
-                    self.users = {}
-            else:
-                self.users = {}
-
-    async def save_users(self):
+            self._server = await asyncio.start_server(self._handle, host='0.0.0.0', port=self.port)
+            logger.info(f"Метрики и проверки здоровья доступны на порту {self.port}")
+        except OSError as e:
+            logger.error(f"Не удалось запустить HTTP-сервер метрик на порту {self.port}: {e}")
+
+    async def stop(self):
+        self.ready = False
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
         try:
-            os.makedirs(os.path.dirname(USERS_FILE), exist_ok=True)
-            if os.path.exists(USERS_FILE):
-                import shutil
-                shutil.copy(USERS_FILE, f"{USERS_FILE}.bak")
-                logger.info(f"Создана резервная копия {USERS_FILE}.bak")
-            async with aiofiles.open(USERS_FILE, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(self.users, indent=2, ensure_ascii=False))
-            logger.info(f"Сохранено {len(self.users)} пользователей")
-        except (IOError, OSError) as e:
-            logger.error(f"Ошибка при сохранении пользователей: {e}", exc_info=True)
-            raise
-
-    def get_user(self, user_id):
-        user_id = str(user_id)
-        if user_id not in self.users:
-            self.users[user_id] = {
-                'favorites': [],
-                'achievements': [],
-                'level': 0,
-                'total_snippets': 0,
-                'total_uses': 0,
-                'join_date': datetime.now().isoformat(),
-                'seen_memes': [],
-                'username': None,
-                'last_submission_date': None,
-                'submissions_today': 0
-            }
-        return self.users[user_id]
-
-    async def update_user_stats(self, user_id, snippets_count, uses_count):
-        user = self.get_user(user_id)
-        user['total_snippets'] = snippets_count
-        user['total_uses'] = uses_count
-        
-        old_level = user['level']
-        for level, data in USER_LEVELS.items():
-            if snippets_count >= data['min_snippets'] and uses_count >= data['min_uses']:
-                user['level'] = level
-        
-        new_achievements = []
-        
-        if snippets_count >= 1 and 'first_snippet' not in user['achievements']:
-            user['achievements'].append('first_snippet')
-            new_achievements.append('first_snippet')
-            
-        if uses_count >= 100 and 'popular_author' not in user['achievements']:
-            user['achievements'].append('popular_author')
-            new_achievements.append('popular_author')
-            
-        if uses_count >= 500 and 'code_master' not in user['achievements']:
-            user['achievements'].append('code_master')
-            new_achievements.append('code_master')
-            
-        if snippets_count >= 25 and 'active' not in user['achievements']:
-            user['achievements'].append('active')
-            new_achievements.append('active')
-
-        if snippets_count > 0 and 'multilang' not in user['achievements']:
-            user_snippets = [data for data in storage.snippets.values() 
-                            if data['author'] == user.get('username', '')]
-            languages_used = set(snippet['language'] for snippet in user_snippets)
-            if len(languages_used) >= len(LANGUAGES):
-                user['achievements'].append('multilang')
-                new_achievements.append('multilang')
-        
-        if 'helpful' not in user['achievements']:
-            user_snippet_names = [name for name, data in storage.snippets.items() 
-                                 if data['author'] == user.get('username', '')]
-            total_favorites = sum(1 for other_user in self.users.values() 
-                                 for fav in other_user['favorites'] 
-                                 if fav in user_snippet_names)
-            if total_favorites >= 10:
-                user['achievements'].append('helpful')
-                new_achievements.append('helpful')
-        
-        if user.get('submissions_today', 0) >= 5 and 'snippet_marathon' not in user['achievements']:
-            user['achievements'].append('snippet_marathon')
-            new_achievements.append('snippet_marathon')
-
-        if snippets_count >= 50 and 'code_sensei' not in user['achievements']:
-            user['achievements'].append('code_sensei')
-            new_achievements.append('code_sensei')
-
-        if snippets_count > 0 and 'tag_master' not in user['achievements']:
-            user_snippets = [data for data in storage.snippets.values() 
-                            if data['author'] == user.get('username', '')]
-            tags_used = set(tag for snippet in user_snippets for tag in snippet.get('tags', []))
-            if len(tags_used) >= len(CATEGORIES):
-                user['achievements'].append('tag_master')
-                new_achievements.append('tag_master')
-
-        if 'community_star' not in user['achievements']:
-            user_snippet_names = [name for name, data in storage.snippets.items() 
-                                 if data['author'] == user.get('username', '')]
-            favorite_users = set(user_id for user_id, other_user in self.users.items() 
-                                for fav in other_user['favorites'] if fav in user_snippet_names)
-            if len(favorite_users) >= 25:
-                user['achievements'].append('community_star')
-                new_achievements.append('community_star')
-
-        if snippets_count >= 100 and 'code_veteran' not in user['achievements']:
-            user['achievements'].append('code_veteran')
-            new_achievements.append('code_veteran')
-
-        if 'bug_hunter' not in user['achievements'] and admin_manager.is_admin(user_id):
-            rejected_count = user.get('rejected_snippets', 0)
-            if rejected_count >= 10:
-                user['achievements'].append('bug_hunter')
-                new_achievements.append('bug_hunter')
-
-        if snippets_count > 0 and 'language_guru' not in user['achievements']:
-            user_snippets = [data for data in storage.snippets.values() 
-                            if data['author'] == user.get('username', '')]
-            lang_counts = {}
-            for snippet in user_snippets:
-                lang = snippet['language']
-                lang_counts[lang] = lang_counts.get(lang, 0) + 1
-                if lang_counts[lang] >= 10:
-                    user['achievements'].append('language_guru')
-                    new_achievements.append('language_guru')
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b'\r\n', b'\n', b''):
                     break
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?', 1)[0] if len(parts) >= 2 else ''
+            if path == '/metrics':
+                status, body, content_type = '200 OK', metrics.render(), 'text/plain; version=0.0.4'
+            elif path == '/healthz':
+                status, body, content_type = '200 OK', 'ok\n', 'text/plain'
+            elif path == '/readyz':
+                status = '200 OK' if self.ready else '503 Service Unavailable'
+                body, content_type = ('ready\n' if self.ready else 'loading\n'), 'text/plain'
+            else:
+                status, body, content_type = '404 Not Found', 'not found\n', 'text/plain'
+            payload = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+def describe_update(update):
+    if not isinstance(update, Update):
+        return type(update).__name__
+    if update.callback_query:
+        return f"callback_query:{(update.callback_query.data or '').split('_', 1)[0]}"
+    if update.message:
+        return "command" if (update.message.text or '').startswith('/') else "message"
+    for attr in ('edited_message', 'inline_query', 'chosen_inline_result', 'my_chat_member', 'chat_member'):
+        if getattr(update, attr, None):
+            return attr
+    return "other"
+
+def update_attributes(update):
+    attributes = {'update_type': describe_update(update)}
+    if isinstance(update, Update):
+        if update.update_id is not None:
+            attributes['update_id'] = update.update_id
+        if update.callback_query and update.callback_query.data:
+            data = update.callback_query.data
+            attributes['callback_prefix'] = data.split('_', 1)[0]
+            match = re.search(r'([0-9a-f]{16})$', data)
+            if match:
+                attributes['snippet_id'] = match.group(1)
+        elif update.message and (update.message.text or '').startswith('/'):
+            attributes['command'] = update.message.text.split()[0].split('@')[0]
+    return attributes
+
+class TracedApplication(Application):
+    async def process_update(self, update):
+        with tracer.trace('update', **update_attributes(update)):
+            await super().process_update(update)
+
+def _await_stack(task):
+    # Цепочка cr_await приостановленной задачи: от внешней корутины до точки ожидания
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return ''.join(traceback.format_list(traceback.StackSummary.extract(frames[-STACK_SAMPLE_DEPTH:])))
 
-        if uses_count >= 1000 and 'snippet_savant' not in user['achievements']:
-            user['achievements'].append('snippet_savant')
-            new_achievements.append('snippet_savant')
-
-        if 'loyal_coder' not in user['achievements']:
-            join_date = datetime.fromisoformat(user['join_date'])
-            days_active = (datetime.now() - join_date).days
-            if days_active >= 30:
-                user['achievements'].append('loyal_coder')
-                new_achievements.append('loyal_coder')
-
-        if 'gatekeeper' not in user['achievements'] and admin_manager.is_admin(user_id):
-            moderated_count = user.get('approved_snippets', 0) + user.get('rejected_snippets', 0)
-            if moderated_count >= 50:
-                user['achievements'].append('gatekeeper')
-                new_achievements.append('gatekeeper')
-
-        if 'code_inspector' not in user['achievements'] and admin_manager.is_admin(user_id):
-            approved_count = user.get('approved_snippets', 0)
-            complaints = user.get('complaints', 0)
-            if approved_count >= 25 and complaints == 0:
-                user['achievements'].append('code_inspector')
-                new_achievements.append('code_inspector')
-
-        await self.save_users()
-        return old_level != user['level'], new_achievements
-
-    async def add_to_favorites(self, user_id, snippet_name):
-        user = self.get_user(user_id)
-        if snippet_name not in user['favorites']:
-            user['favorites'].append(snippet_name)
-            await self.save_users()
-            return True
-        return False
-
-    async def remove_from_favorites(self, user_id, snippet_name):
-        user = self.get_user(user_id)
-        if snippet_name in user['favorites']:
-            user['favorites'].remove(snippet_name)
-            await self.save_users()
-            return True
-        return False
-
-    def is_favorite(self, user_id, snippet_name):
-        user = self.get_user(user_id)
-        return snippet_name in user['favorites']
-
-class SharedSnippetStorage:
+class LoopMonitor:
+    # Heartbeat-задача меряет задержку цикла событий, сторожевой поток снимает стек,
+    # если цикл заблокирован дольше LOOP_LAG_THRESHOLD
     def __init__(self):
-        self.snippets = {}
-        self.pending_snippets = {}
-
-    async def initialize(self):
-        await self.load_snippets()
-        await self.load_pending_snippets()
+        self.handler_stats = {}
+        self.recent_slow = deque(maxlen=20)
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.beats = 0
+        self._last_beat = time.monotonic()
+        self._stall_samples = deque(maxlen=50)
+        self._loop_thread_id = None
+        self._heartbeat_task = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LOOP_HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            lag = max(0.0, now - started - LOOP_HEARTBEAT_INTERVAL)
+            self._last_beat = now
+            self.beats += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            LOOP_LAG.observe(lag)
+            if lag >= LOOP_LAG_THRESHOLD:
+                logger.warning(f"Цикл событий был заблокирован на {lag * 1000:.0f} мс")
+
+    def _watch(self):
+        sampled_beat = None
+        while not self._stopped.wait(LOOP_HEARTBEAT_INTERVAL):
+            last_beat = self._last_beat
+            if sampled_beat == last_beat or time.monotonic() - last_beat < LOOP_LAG_THRESHOLD:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            sampled_beat = last_beat
+            stack = ''.join(traceback.format_stack(frame, limit=STACK_SAMPLE_DEPTH))
+            self._stall_samples.append((time.monotonic(), stack))
+
+    def _stall_stack(self, started, finished):
+        for sampled_at, stack in reversed(self._stall_samples):
+            if started <= sampled_at <= finished:
+                return stack
+        return None
 
-    async def load_snippets(self):
-        if os.path.exists(SNIPPETS_FILE):
-            try:
-                async with aiofiles.open(SNIPPETS_FILE, 'r', encoding='utf-8') as f:
-                    self.snippets = json.loads(await f.read())
-            except (json.JSONDecodeError, IOError) as e:
-                logger.error(f"Ошибка при загрузке сниппетов: {e}")
-                self.snippets = {}
-
-    async def load_pending_snippets(self):
-        if not os.path.exists(PENDING_SNIPPETS_FILE):
-            logger.info(f"Файл {PENDING_SNIPPETS_FILE} не найден, создаём пустой")
-            self.pending_snippets = {}
+    def track(self, callback):
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            started = time.monotonic()
+            task = asyncio.current_task()
+            suspended = []
+            # Если обработчик долго ждёт I/O, цикл не заблокирован — снимаем стек ожидающей задачи
+            timer = asyncio.get_running_loop().call_later(
+                SLOW_HANDLER_THRESHOLD, lambda: suspended.append(_await_stack(task))
+            )
             try:
-                await self.save_pending_snippets()
-            except Exception as e:
-                logger.error(f"Ошибка при создании {PENDING_SNIPPETS_FILE}: {e}", exc_info=True)
+                return await callback(update, context)
+            finally:
+                timer.cancel()
+                finished = time.monotonic()
+                self._record(name, describe_update(update), started, finished, suspended)
+
+        return wrapper
+
+    def _record(self, name, update_type, started, finished, suspended):
+        elapsed = finished - started
+        HANDLER_SECONDS.observe(elapsed, name)
+        stats = self.handler_stats.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'slow': 0})
+        stats['count'] += 1
+        stats['total'] += elapsed
+        stats['max'] = max(stats['max'], elapsed)
+        if elapsed < SLOW_HANDLER_THRESHOLD:
             return
-        try:
-            async with aiofiles.open(PENDING_SNIPPETS_FILE, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                if content.strip():
-                    self.pending_snippets = json.loads(content)
-                    logger.info(f"Загружено {len(self.pending_snippets)} ожидающих сниппетов")
-                else:
-                    logger.warning(f"Файл {PENDING_SNIPPETS_FILE} пуст, инициализируем пустым")
-                    self.pending_snippets = {}
-        except (json.JSONDecodeError, IOError) as e:
-            logger.error(f"Ошибка при загрузке ожидающих сниппетов: {e}", exc_info=True)
-            backup_file = f"{PENDING_SNIPPETS_FILE}.bak"
-            if os.path.exists(backup_file):
-                logger.info(f"Попытка восстановления из резервной копии {backup_file}")
-                try:
-                    async with aiofiles.open(backup_file, 'r', encoding='utf-8') as f:
-                        self.pending_snippets = json.loads(await f.read())
-                        await self.save_pending_snippets()
-                        logger.info("Ожидающие сниппеты восстановлены из резервной копии")
-                except Exception as e:
-                    logger.error(f"Ошибка восстановления ожидающих сниппетов: {e}", exc_info=True)
-                    self.pending_snippets = {}
+        stats['slow'] += 1
+        stack = self._stall_stack(started, finished)
+        kind = "блокировка цикла"
+        if stack is None:
+            stack = suspended[0] if suspended else "стек недоступен\n"
+            kind = "ожидание"
+        self.recent_slow.append((datetime.now().isoformat(timespec='seconds'), name, update_type, elapsed))
+        logger.warning(
+            f"Медленный обработчик {name} ({update_type}): {elapsed * 1000:.0f} мс, {kind}\n{stack}"
+        )
+
+    def worst_handlers(self, limit=10):
+        return sorted(self.handler_stats.items(), key=lambda item: item[1]['max'], reverse=True)[:limit]
+
+def instrument_handlers(application, wrap):
+    def walk(handlers):
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                walk(handler.entry_points)
+                for state_handlers in handler.states.values():
+                    walk(state_handlers)
+                walk(handler.fallbacks)
             else:
-                self.pending_snippets = {}
+                handler.callback = wrap(handler.callback)
 
-    async def save_pending_snippets(self):
-        try:
-            os.makedirs(os.path.dirname(PENDING_SNIPPETS_FILE), exist_ok=True)
-            if os.path.exists(PENDING_SNIPPETS_FILE):
-                import shutil
-                shutil.copy(PENDING_SNIPPETS_FILE, f"{PENDING_SNIPPETS_FILE}.bak")
-                logger.info(f"Создана резервная копия {PENDING_SNIPPETS_FILE}.bak")
-            async with aiofiles.open(PENDING_SNIPPETS_FILE, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(self.pending_snippets, indent=2, ensure_ascii=False))
-            logger.info(f"Сохранено {len(self.pending_snippets)} ожидающих сниппетов")
-        except (IOError, OSError) as e:
-            logger.error(f"Ошибка при сохранении ожидающих сниппетов: {e}", exc_info=True)
-            raise
+    for group, handlers in application.handlers.items():
+        if group >= 0:
+            walk(handlers)
 
-    async def save_snippets(self):
-        try:
-            async with aiofiles.open(SNIPPETS_FILE, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(self.snippets, indent=2, ensure_ascii=False))
-        except IOError as e:
-            logger.error(f"Ошибка при сохранении сниппетов: {e}")
-
-    async def add_snippet(self, name, code, language, author, tags=None):
-        if name not in self.snippets:
-            self.snippets[name] = {
-                'code': code,
-                'language': language,
-                'author': author,
-                'uses': 0,
-                'tags': tags or [],
-                'created_date': datetime.now().isoformat()
-            }
-            await self.save_snippets()
-            return True
-        return False
-
-    async def add_pending_snippet(self, name, code, language, author, author_id, tags=None):
-        if len(name) > MAX_NAME_LENGTH or len(code) > MAX_CODE_LENGTH:
+class Profiler:
+    # cProfile на следующие N апдейтов или на окно в секундах; tracemalloc со сравнением
+    # текущего снимка с предыдущим. Отчёты отправляются администратору файлами
+    def __init__(self):
+        self.cpu = None
+        self.cpu_chat_id = None
+        self.cpu_remaining = 0
+        self.cpu_started = None
+        self.cpu_skip_update = None
+        self.memory_snapshot = None
+
+    @property
+    def cpu_active(self):
+        return self.cpu is not None
+
+    def start_cpu(self, chat_id, update_id, updates=0):
+        profile = cProfile.Profile()
+        profile.enable()
+        self.cpu = profile
+        self.cpu_chat_id = chat_id
+        self.cpu_remaining = updates
+        self.cpu_started = time.monotonic()
+        self.cpu_skip_update = update_id
+
+    def stop_cpu(self):
+        profile, self.cpu = self.cpu, None
+        profile.disable()
+        elapsed = time.monotonic() - self.cpu_started
+        report = io.StringIO()
+        report.write(f"cProfile: {elapsed:.1f} с, {datetime.now().isoformat(timespec='seconds')}\n\n")
+        stats = pstats.Stats(profile, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_REPORT_LINES)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(PROFILE_REPORT_LINES)
+        dump = marshal.dumps(stats.stats)
+        return report.getvalue(), dump, elapsed
+
+    def update_done(self, update_id):
+        # True, когда профилирование по числу апдейтов набрало нужное количество
+        if not self.cpu_active or not self.cpu_remaining or update_id == self.cpu_skip_update:
             return False
-        if name not in self.pending_snippets:
-            self.pending_snippets[name] = {
-                'code': code,
-                'language': language,
-                'author': author,
-                'tags': tags or [],
-                'created_date': datetime.now().isoformat(),
-                'user_id': str(author_id)
-            }
-            await self.save_pending_snippets()
-            return True
-        return False
-
-    async def approve_snippet(self, name):
-        if name in self.pending_snippets:
-            snippet = self.pending_snippets[name]
-            success = await self.add_snippet(name, snippet['code'], snippet['language'], snippet['author'], snippet['tags'])
-            if success:
-                del self.pending_snippets[name]
-                await self.save_pending_snippets()
-                return True
-        return False
-
-    async def reject_snippet(self, name):
-        if name in self.pending_snippets:
-            del self.pending_snippets[name]
-            await self.save_pending_snippets()
-            return True
-        return False
-
-    async def get_snippet(self, name):
-        if name in self.snippets:
-            self.snippets[name]['uses'] += 1
-            await self.save_snippets()
-            return self.snippets[name]
-        return None
-
-    async def delete_snippet(self, name):
-        if name in self.snippets:
-            del self.snippets[name]
-            await self.save_snippets()
+        self.cpu_remaining -= 1
+        return self.cpu_remaining == 0
+
+    def take_memory_snapshot(self):
+        # Первый вызов включает tracemalloc и запоминает базовый снимок (возвращает None)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.memory_snapshot = tracemalloc.take_snapshot()
+            return None
+        snapshot = tracemalloc.take_snapshot()
+        previous, self.memory_snapshot = self.memory_snapshot, snapshot
+        return snapshot, previous, tracemalloc.get_traced_memory()
+
+    @staticmethod
+    def memory_report(snapshot, previous, traced):
+        # Группировка снимков занимает секунды на большой куче — выполняется в пуле потоков.
+        # Служебные кадры отсеиваются уже после группировки: filter_traces на порядок медленнее
+        def own(stats):
+            return [stat for stat in stats
+                    if stat.traceback[-1].filename not in (tracemalloc.__file__, '<unknown>')][:PROFILE_REPORT_LINES]
+
+        current, peak = traced
+        report = io.StringIO()
+        report.write(
+            f"tracemalloc: {datetime.now().isoformat(timespec='seconds')}\n"
+            f"Отслеживается {current / 1024 / 1024:.1f} МБ, пик {peak / 1024 / 1024:.1f} МБ\n\n"
+            f"Топ-{PROFILE_REPORT_LINES} мест выделения памяти:\n"
+        )
+        for stat in own(snapshot.statistics('lineno')):
+            report.write(f"{stat}\n")
+        report.write(f"\nИзменения с предыдущего снимка (топ-{PROFILE_REPORT_LINES}):\n")
+        for stat in own(snapshot.compare_to(previous, 'lineno')):
+            report.write(f"{stat}\n")
+        top = own(snapshot.statistics('traceback'))[:3]
+        for i, stat in enumerate(top, 1):
+            report.write(f"\n#{i} {stat.size / 1024:.1f} КБ в {stat.count} блоках:\n")
+            report.write('\n'.join(stat.traceback.format()) + '\n')
+        return report.getvalue()
+
+    def stop_memory(self):
+        self.memory_snapshot = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
             return True
         return False
 
-    def search_snippets(self, query):
-        return {name: data for name, data in self.snippets.items() if query.lower() in name.lower()}
-
-    def filter_by_language(self, language):
-        return {name: data for name, data in self.snippets.items() if data['language'] == language}
-
-    def filter_by_tag(self, tag):
-        return {name: data for name, data in self.snippets.items() if tag in data.get('tags', [])}
-
-    def get_user_snippets_stats(self, author):
-        user_snippets = [data for data in self.snippets.values() if data['author'] == author]
-        total_snippets = len(user_snippets)
-        total_uses = sum(snippet['uses'] for snippet in user_snippets)
-        return total_snippets, total_uses
+class AdminDigest:
+    # Новые заявки копятся и раз в ADMIN_DIGEST_INTERVAL уходят каждому администратору одним
+    # сообщением. Заявки с признаками риска отправляются сразу, целиком с кодом.
+    # Отправка идёт отдельной задачей или из JobQueue, а не в обработчике автора
+    def __init__(self, interval=ADMIN_DIGEST_INTERVAL):
+        self.interval = interval
+        self.names = []
+        self.sent_digests = 0
+
+    def add(self, context: ContextTypes.DEFAULT_TYPE, snippet_name, urgent=False):
+        if urgent or not self.interval or not context.job_queue:
+            context.application.create_task(self.send_now(context, snippet_name))
+        else:
+            self.names.append(snippet_name)
+
+    async def send_now(self, context: ContextTypes.DEFAULT_TYPE, snippet_name):
+        snippet = storage.pending_snippets.get(snippet_name)
+        if snippet is not None:
+            await notify_admins(context, snippet_name, snippet)
+
+    async def flush(self, context: ContextTypes.DEFAULT_TYPE):
+        # Заявки, которые уже успели обработать, в дайджест не попадают
+        names, self.names = self.names, []
+        names = [name for name in names if name in storage.pending_snippets]
+        if not names:
+            return
+        lines = []
+        for name in names[:ADMIN_DIGEST_MAX_ITEMS]:
+            data = storage.pending_snippets[name]
+            tags = f" 🗂️{'/'.join(data['tags'])}" if data['tags'] else ""
+            lines.append(f"• {LANGUAGES.get(data['language'], '📜')} {name} — {data['author']}{tags}")
+        if len(names) > ADMIN_DIGEST_MAX_ITEMS:
+            lines.append(f"… и ещё {len(names) - ADMIN_DIGEST_MAX_ITEMS}")
+        text = (f"🖋 Новые сниппеты на модерации: {len(names)}\n" + "\n".join(lines) +
+                f"\n\nВсего в очереди: {len(storage.pending_snippets)}")
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("📋 Открыть очередь", callback_data="admin_pending")]])
+        await send_to_admins(context, text, reply_markup=keyboard)
+        self.sent_digests += 1
+
+class RateLimiter:
+    # Равномерный темп на все воркеры; RetryAfter от Bot API сдвигает следующий слот для всех
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = time.monotonic()
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        self._next = max(self._next, time.monotonic() + seconds)
+
+def write_json_atomic(path, data):
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+def format_size(size):
+    return f"{size / 1024:.1f} КБ" if size >= 1024 else f"{size} Б"
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} ч {minutes} мин" if hours else f"{minutes} мин {seconds} с"
+
+class Broadcaster:
+    # Рассылка всем пользователям через BROADCAST_WORKERS воркеров с общим ограничением темпа.
+    # Список получателей фиксируется при старте и пишется на диск один раз, прогресс — в
+    # небольшой файл состояния каждые BROADCAST_CHECKPOINT_EVERY сообщений. После перезапуска
+    # рассылка продолжается с сохранённой позиции: повторно могут уйти не больше
+    # BROADCAST_WORKERS сообщений, отправленных после последней контрольной точки
+    def __init__(self, state_file=BROADCAST_STATE_FILE, recipients_file=BROADCAST_RECIPIENTS_FILE):
+        self.state_file = state_file
+        self.recipients_file = recipients_file
+        self.state = None
+        self.recipients = []
+        self._task = None
+        self._next_index = 0
+        self._done = {}
+        self._since_checkpoint = 0
+        self._session_started = None
+        self._session_sent = 0
+        self._progress_message_id = None
+        self._progress_at = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot, text, admin_id):
+        self.recipients = [user_id for user_id, user in user_manager.users.items() if not user.get('inactive')]
+        self.state = {
+            'text': text,
+            'admin_id': str(admin_id),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'total': len(self.recipients),
+            'cursor': 0,
+            'sent': 0,
+            'blocked': 0,
+            'failed': 0,
+            'status': 'running',
+        }
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, write_json_atomic, self.recipients_file, self.recipients)
+        await self._checkpoint()
+        self._launch(bot)
+
+    async def resume(self, bot):
+        # Вызывается при старте бота: незавершённая рассылка продолжается с контрольной точки
+        if not os.path.exists(self.state_file):
+            return False
+        with open(self.state_file, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('status') != 'running':
+            return False
+        with open(self.recipients_file, encoding='utf-8') as f:
+            self.recipients = json.load(f)
+        self.state = state
+        logger.info(f"Продолжаем рассылку с {state['cursor']} из {state['total']}")
+        self._launch(bot)
+        return True
+
+    async def cancel(self):
+        if not self.running:
+            return False
+        self.state['status'] = 'cancelled'
+        await self._stop_workers()
+        await self._checkpoint()
+        return True
+
+    async def shutdown(self):
+        # Остановка бота: статус остаётся running, чтобы рассылка продолжилась после перезапуска
+        if self.running:
+            await self._stop_workers()
+            await self._checkpoint()
+
+    async def _stop_workers(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def _launch(self, bot):
+        self._next_index = self.state['cursor']
+        self._done = {}
+        self._since_checkpoint = 0
+        self._session_started = time.monotonic()
+        self._session_sent = 0
+        self._progress_message_id = None
+        self._progress_at = 0.0
+        self._task = asyncio.ensure_future(self._run(bot))
+
+    async def _run(self, bot):
+        limiter = RateLimiter(BROADCAST_RATE)
+        try:
+            await self._report(bot, force=True)
+            await asyncio.gather(*(self._worker(bot, limiter) for _ in range(BROADCAST_WORKERS)))
+            self.state['status'] = 'done'
+            await self._checkpoint()
+            await self._report(bot, force=True)
+            logger.info(f"Рассылка завершена: {self.state}")
+        except (IOError, OSError) as e:
+            logger.error(f"Рассылка прервана: {e}", exc_info=True)
+
+    async def _worker(self, bot, limiter):
+        while self._next_index < len(self.recipients):
+            index = self._next_index
+            self._next_index += 1
+            user_id = self.recipients[index]
+            self._done[index] = await self._deliver(bot, limiter, user_id)
+            self._session_sent += 1
+            # Счётчики растут вместе с позицией, чтобы контрольная точка была согласованной
+            while self.state['cursor'] in self._done:
+                self.state[self._done.pop(self.state['cursor'])] += 1
+                self.state['cursor'] += 1
+            self._since_checkpoint += 1
+            if self._since_checkpoint >= BROADCAST_CHECKPOINT_EVERY:
+                await self._checkpoint()
+            await self._report(bot)
+
+    async def _deliver(self, bot, limiter, user_id):
+        # Возвращает счётчик, в который попадает получатель: sent, blocked или failed
+        for attempt in range(BROADCAST_RETRIES):
+            await limiter.wait()
+            try:
+                await bot.send_message(chat_id=user_id, text=self.state['text'])
+                return 'sent'
+            except RetryAfter as e:
+                limiter.pause(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                # Остальные BadRequest — ошибка запроса, а не пропавший пользователь: повтор не поможет,
+                # но и из будущих рассылок его не исключаем
+                if isinstance(e, BadRequest) and not any(text in e.message.lower() for text in BROADCAST_GONE_ERRORS):
+                    logger.warning(f"Рассылка: ошибка запроса для пользователя {user_id}: {e}")
+                    return 'failed'
+                # Бот заблокирован, аккаунт удалён или чат не найден — больше не пишем этому пользователю
+                logger.info(f"Рассылка: пользователь {user_id} недоступен ({e}), помечаем неактивным")
+                user = user_manager.users.get(user_id)
+                if user is not None:
+                    user['inactive'] = True
+                return 'blocked'
+            except TelegramError as e:
+                logger.warning(f"Рассылка: ошибка отправки пользователю {user_id} (попытка {attempt + 1}): {e}")
+        return 'failed'
+
+    async def _checkpoint(self):
+        self._since_checkpoint = 0
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, write_json_atomic, self.state_file, dict(self.state))
+        if self.state['blocked']:
+            await user_manager.save_users()
 
-storage = SharedSnippetStorage()
-user_manager = UserManager()
-admin_manager = AdminManager()
+    def progress_text(self):
+        state = self.state
+        processed = state['sent'] + state['blocked'] + state['failed']
+        percent = processed * 100 // state['total'] if state['total'] else 100
+        statuses = {'running': '📣 Рассылка идёт', 'done': '✅ Рассылка завершена', 'cancelled': '⛔ Рассылка остановлена'}
+        text = (f"{statuses[state['status']]}: {processed}/{state['total']} ({percent}%)\n"
+                f"📬 Доставлено: {state['sent']}\n🚫 Заблокировали бота: {state['blocked']}\n"
+                f"❌ Ошибок: {state['failed']}")
+        elapsed = time.monotonic() - self._session_started if self._session_started else 0
+        if elapsed > 0 and self._session_sent:
+            rate = self._session_sent / elapsed
+            text += f"\n⚡ Скорость: {rate:.1f} сообщ./с"
+            if state['status'] == 'running':
+                text += f", осталось ~{format_duration((state['total'] - processed) / rate)}"
+        return text
+
+    async def _report(self, bot, force=False):
+        # Отчёт администратору — одно сообщение, которое редактируется не чаще раза в интервал
+        now = time.monotonic()
+        if not force and now - self._progress_at < BROADCAST_PROGRESS_INTERVAL:
+            return
+        self._progress_at = now
+        text = self.progress_text()
+        try:
+            if self._progress_message_id:
+                await bot.edit_message_text(chat_id=self.state['admin_id'], message_id=self._progress_message_id, text=text)
+            else:
+                message = await bot.send_message(chat_id=self.state['admin_id'], text=text)
+                self._progress_message_id = message.message_id
+        except TelegramError as e:
+            logger.warning(f"Не удалось обновить отчёт о рассылке: {e}")
+
+engine = SnippetEngine(DATA_DIR)
+storage = engine.storage
+user_manager = engine.users
+admin_manager = engine.admins
+archives = engine.archives
+session_sweeper = SessionSweeper()
+loop_monitor = LoopMonitor()
+health_server = HealthServer(METRICS_PORT)
+profiler = Profiler()
+admin_digest = AdminDigest()
+broadcaster = Broadcaster()
 
 def get_main_keyboard(is_admin=False):
     keyboard = [
@@ -548,6 +825,7 @@ def get_admin_keyboard():
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("📋 Сниппеты на модерации", callback_data="admin_pending")],
         [InlineKeyboardButton("👥 Пользователи", callback_data="admin_users")],
+        [InlineKeyboardButton("🐢 Медленные обработчики", callback_data="admin_slow")],
         [InlineKeyboardButton("🔙 Главное меню", callback_data="back_to_main")]
     ])
 
@@ -566,34 +844,53 @@ def get_quick_actions_keyboard(snippet_name, user_id, is_author=False):
     keyboard.append(row2)
     return InlineKeyboardMarkup(keyboard)
 
-def get_pending_snippets_keyboard(page=0):
+def get_pending_snippets_keyboard(page=0, selected=None, moderator_id=None):
+    # Страница берётся срезом из очереди по приоритету. selected — множество имён в режиме
+    # массовой модерации, None — обычный просмотр; заявки, захваченные другими, помечены 🔒
     pending_snippets = storage.pending_snippets
-    total_pages = math.ceil(len(pending_snippets) / ITEMS_PER_PAGE)
+    queue = storage.moderation_queue
+    total_pages = math.ceil(len(queue) / ITEMS_PER_PAGE)
     if page >= total_pages:
         page = 0
     elif page < 0:
         page = total_pages - 1 if total_pages > 0 else 0
-    start_idx = page * ITEMS_PER_PAGE
-    end_idx = start_idx + ITEMS_PER_PAGE
-    page_snippets = list(pending_snippets.keys())[start_idx:end_idx]
+    page_snippets = queue.page(page * ITEMS_PER_PAGE, ITEMS_PER_PAGE)
     keyboard = []
     for name in page_snippets:
-        snippet_id = hashlib.md5(name.encode()).hexdigest()[:16]
+        snippet_id = queue.snippet_id(name)
         data = pending_snippets[name]
         language_emoji = LANGUAGES.get(data['language'], '📜')
         btn_text = f"{language_emoji} {name}"
+        if queue.claimed_by(name) not in (None, str(moderator_id)):
+            btn_text = f"🔒 {btn_text}"
         if data.get('tags'):
             btn_text += f" 🗂️{'/'.join(data['tags'])}"
-        keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"review_{snippet_id}")])
+        if selected is None:
+            keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"review_{snippet_id}")])
+        else:
+            mark = "✅" if name in selected else "⬜"
+            keyboard.append([InlineKeyboardButton(f"{mark} {btn_text}", callback_data=f"bulk_toggle_{snippet_id}")])
+    page_prefix = "page_pending" if selected is None else "bulk_page"
     if total_pages > 1:
         nav_buttons = []
         if page > 0:
-            nav_buttons.append(InlineKeyboardButton("⬅️ Пред", callback_data=f"page_pending_{page-1}"))
+            nav_buttons.append(InlineKeyboardButton("⬅️ Пред", callback_data=f"{page_prefix}_{page-1}"))
         nav_buttons.append(InlineKeyboardButton(f"📖 {page+1}/{total_pages}", callback_data="noop"))
         if page < total_pages - 1:
-            nav_buttons.append(InlineKeyboardButton("След ➡️", callback_data=f"page_pending_{page+1}"))
+            nav_buttons.append(InlineKeyboardButton("След ➡️", callback_data=f"{page_prefix}_{page+1}"))
         keyboard.append(nav_buttons)
-    keyboard.append([InlineKeyboardButton("🔙 Админ-меню", callback_data="back_to_admin")])
+    if selected is None:
+        if page_snippets:
+            keyboard.append([InlineKeyboardButton("☑️ Выбрать несколько", callback_data="bulk_start")])
+        keyboard.append([InlineKeyboardButton("🔙 Админ-меню", callback_data="back_to_admin")])
+    else:
+        keyboard.append([InlineKeyboardButton("☑️ Вся страница", callback_data=f"bulk_all_{page}")])
+        if selected:
+            keyboard.append([
+                InlineKeyboardButton(f"✅ Одобрить ({len(selected)})", callback_data="bulk_approve"),
+                InlineKeyboardButton(f"❌ Отклонить ({len(selected)})", callback_data="bulk_reject")
+            ])
+        keyboard.append([InlineKeyboardButton("🔙 Отмена", callback_data="back_to_pending")])
     return InlineKeyboardMarkup(keyboard), total_pages
 
 def get_users_keyboard(page=0):
@@ -641,6 +938,30 @@ async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE, page=0)
         reply_markup=keyboard
     )
 
+async def show_slow_handlers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not admin_manager.is_admin(update.effective_user.id):
+        await update.callback_query.answer("❌ Только администраторы могут просматривать статистику!")
+        return
+    avg_lag = loop_monitor.lag_total / loop_monitor.beats if loop_monitor.beats else 0.0
+    text = (
+        f"🐢 Производительность бота\n\n"
+        f"⏱ Задержка цикла: средняя {avg_lag * 1000:.1f} мс, максимум {loop_monitor.lag_max * 1000:.0f} мс\n"
+        f"🐌 Порог медленного обработчика: {SLOW_HANDLER_THRESHOLD * 1000:.0f} мс\n\n"
+    )
+    worst = loop_monitor.worst_handlers()
+    if worst:
+        text += "📉 Худшие обработчики (макс. / средн., вызовов, медленных):\n"
+        for i, (name, stats) in enumerate(worst, 1):
+            avg = stats['total'] / stats['count']
+            text += f"{i}. {name}: {stats['max'] * 1000:.0f} / {avg * 1000:.0f} мс, ×{stats['count']}, 🐌{stats['slow']}\n"
+    else:
+        text += "📉 Обработчики ещё не вызывались\n"
+    if loop_monitor.recent_slow:
+        text += "\n🕒 Последние медленные вызовы:\n"
+        for at, name, update_type, elapsed in list(loop_monitor.recent_slow)[-5:]:
+            text += f"• {at[11:]} {name} ({update_type}): {elapsed * 1000:.0f} мс\n"
+    await update_or_send_message(update, context, text, reply_markup=get_admin_keyboard())
+
 async def show_user_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
     if not admin_manager.is_admin(update.effective_user.id):
         await update.callback_query.answer("❌ Только администраторы могут просматривать профили!")
@@ -720,6 +1041,13 @@ def create_snippets_keyboard(snippets_dict, page=0, callback_prefix="show", extr
 async def update_or_send_message(update: Update, context: ContextTypes.DEFAULT_TYPE, text, reply_markup=None, parse_mode=None):
     chat_id = update.effective_chat.id
     last_message_id = context.user_data.get('last_message_id')
+    # Накопленные поздравления дописываются к ответу, а не отправляются отдельными сообщениями
+    notices = context.user_data.get('notices')
+    if notices and parse_mode is None:
+        merged = "\n\n".join([text] + notices)
+        if len(merged) <= MESSAGE_MAX_LENGTH:
+            text = merged
+            context.user_data.pop('notices', None)
 
     # Пытаемся удалить предыдущее сообщение, если оно существует
     if last_message_id:
@@ -744,7 +1072,30 @@ async def update_or_send_message(update: Update, context: ContextTypes.DEFAULT_T
         logger.error(f"Ошибка при отправке сообщения: {e}")
         raise
 
-async def send_random_meme(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
+def achievement_notice(achievement):
+    ach_info = ACHIEVEMENTS.get(achievement, {'emoji': '❓', 'name': 'Неизвестно', 'description': ''})
+    return f"🎉 Новое достижение!\n{ach_info['emoji']} {ach_info['name']}\n{ach_info['description']}"
+
+def level_notice(level):
+    level_info = USER_LEVELS[level]
+    return f"🎊 Поздравляем! Вы достигли уровня {level_info['emoji']} {level_info['name']}!"
+
+def add_notice(context: ContextTypes.DEFAULT_TYPE, text):
+    # Поздравления и мемы копятся до основного ответа на апдейт; что не вошло в него,
+    # flush_notices отправит одним сообщением после обработчиков апдейта
+    context.user_data.setdefault('notices', []).append(text)
+
+async def flush_notices(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Группа 2: выполняется после обработчиков апдейта (в группе 1 — профилировщик)
+    notices = context.user_data.pop('notices', None) if context.user_data is not None else None
+    if not notices or not update.effective_chat:
+        return
+    try:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="\n\n".join(notices))
+    except TelegramError as e:
+        logger.warning(f"Не удалось отправить поздравления: {e}")
+
+async def add_random_meme(context: ContextTypes.DEFAULT_TYPE, user_id):
     user = user_manager.get_user(user_id)
     available_memes = [meme for meme in CODE_MEMES if meme not in user.get('seen_memes', [])]
     if not available_memes:
@@ -754,35 +1105,33 @@ async def send_random_meme(update: Update, context: ContextTypes.DEFAULT_TYPE, u
     user['seen_memes'].append(meme)
     if len(user['seen_memes']) >= 10 and 'code_comedian' not in user['achievements']:
         user['achievements'].append('code_comedian')
-        await update_or_send_message(
-            update,
-            context,
-            f"🎉 Новое достижение!\n😂 Кодовый комедиант\nУвидел 10 разных мемов от бота"
-        )
+        add_notice(context, achievement_notice('code_comedian'))
     await user_manager.save_users()
-    await update_or_send_message(
-        update,
-        context,
-        meme
-    )
+    add_notice(context, meme)
 
-async def notify_admins(context: ContextTypes.DEFAULT_TYPE, snippet_name, snippet_data):
-    language_emoji = LANGUAGES.get(snippet_data.get('language', ''), '📜')
-    for admin_id in admin_manager.admins:
+async def send_to_admins(context: ContextTypes.DEFAULT_TYPE, text, **kwargs):
+    async def send(admin_id):
         try:
-            tags = snippet_data.get('tags', [])
-            tags_text = ', '.join(tags) if tags else 'Без тегов'
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"🖋 Новый сниппет на модерацию: '{snippet_name}'\n"
-                     f"{language_emoji} Язык: {snippet_data.get('language', 'Неизвестно')}\n"
-                     f"👨‍🎤 Автор: {snippet_data.get('author', 'Неизвестно')}\n"
-                     f"🗂️ Теги: {tags_text}\n"
-                     f"📜 Код:\n```{snippet_data.get('language', '').lower()}\n{snippet_data.get('code', '')}\n```",
-                parse_mode='Markdown'
-            )
+            await context.bot.send_message(chat_id=admin_id, text=text, **kwargs)
         except TelegramError as e:
             logger.error(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+    await asyncio.gather(*(send(admin_id) for admin_id in admin_manager.admins))
+
+async def notify_admins(context: ContextTypes.DEFAULT_TYPE, snippet_name, snippet_data):
+    language_emoji = LANGUAGES.get(snippet_data.get('language', ''), '📜')
+    tags = snippet_data.get('tags', [])
+    tags_text = ', '.join(tags) if tags else 'Без тегов'
+    risks = snippet_risks(snippet_data)
+    await send_to_admins(
+        context,
+        f"🖋 Новый сниппет на модерацию: '{snippet_name}'\n"
+        f"{language_emoji} Язык: {snippet_data.get('language', 'Неизвестно')}\n"
+        f"👨‍🎤 Автор: {snippet_data.get('author', 'Неизвестно')}\n"
+        f"🗂️ Теги: {tags_text}\n"
+        + (f"⚠️ Обратите внимание: {', '.join(risks)}\n" if risks else "")
+        + f"📜 Код:\n{code_block(snippet_data)}",
+        parse_mode='Markdown'
+    )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
@@ -825,11 +1174,7 @@ async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user['added_admins'] = user.get('added_admins', 0) + 1
             if user['added_admins'] >= 5 and 'admin_mentor' not in user['achievements']:
                 user['achievements'].append('admin_mentor')
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=f"🎉 Новое достижение!\n{ACHIEVEMENTS['admin_mentor']['emoji']} {ACHIEVEMENTS['admin_mentor']['name']}\n"
-                         f"{ACHIEVEMENTS['admin_mentor']['description']}"
-                )
+                add_notice(context, achievement_notice('admin_mentor'))
             await user_manager.save_users()
             await update_or_send_message(update, context, f"✅ Пользователь {new_admin_id} добавлен в администраторы!", reply_markup=get_main_keyboard(True))
         else:
@@ -845,22 +1190,217 @@ async def pending_snippets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not storage.pending_snippets:
         await update_or_send_message(update, context, "🖋 Очередь модерации пустая.", reply_markup=get_admin_keyboard())
         return
-    context.user_data['snippets_map'] = context.user_data.get('snippets_map', {})
-    for name in storage.pending_snippets.keys():
-        snippet_id = hashlib.md5(name.encode()).hexdigest()[:16]
-        context.user_data['snippets_map'][f'pending_snippet_{snippet_id}'] = name
-    keyboard, total_pages = get_pending_snippets_keyboard(page=0)
+    keyboard, total_pages = get_pending_snippets_keyboard(page=0, moderator_id=update.effective_user.id)
     await update_or_send_message(update, context, f"🖋 Сниппеты на модерации (стр. 1/{total_pages}):", reply_markup=keyboard)
 
+async def send_cpu_profile(bot):
+    chat_id = profiler.cpu_chat_id
+    report, dump, elapsed = profiler.stop_cpu()
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    try:
+        await bot.send_document(
+            chat_id=chat_id,
+            document=report.encode('utf-8'),
+            filename=f"profile_{stamp}.txt",
+            caption=f"⏱ Профиль CPU за {elapsed:.1f} с"
+        )
+        await bot.send_document(
+            chat_id=chat_id,
+            document=dump,
+            filename=f"profile_{stamp}.prof",
+            caption="📦 Данные для pstats / snakeviz"
+        )
+    except TelegramError as e:
+        logger.error(f"Не удалось отправить профиль: {e}")
+
+async def finish_cpu_profile_job(context: ContextTypes.DEFAULT_TYPE):
+    if profiler.cpu_active:
+        await send_cpu_profile(context.bot)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not admin_manager.is_admin(update.effective_user.id):
+        await update_or_send_message(update, context, "❌ Эта команда только для администраторов!", reply_markup=get_main_keyboard())
+        return
+    usage = "❌ Используйте: /profile <число апдейтов> или /profile <секунды>s, /profile stop"
+    args = context.args or ['100']
+    if args[0] == 'stop':
+        if not profiler.cpu_active:
+            await update_or_send_message(update, context, "⚠️ Профилирование не запущено.", reply_markup=get_main_keyboard(True))
+            return
+        await send_cpu_profile(context.bot)
+        return
+    if profiler.cpu_active:
+        await update_or_send_message(update, context, "⚠️ Профилирование уже идёт. Остановить: /profile stop", reply_markup=get_main_keyboard(True))
+        return
+    match = re.fullmatch(r'(\d+)(s?)', args[0])
+    if len(args) != 1 or not match or int(match.group(1)) == 0:
+        await update_or_send_message(update, context, usage, reply_markup=get_main_keyboard(True))
+        return
+    amount, by_time = int(match.group(1)), bool(match.group(2))
+    if by_time and not context.job_queue:
+        await update_or_send_message(update, context, "❌ JobQueue недоступна, используйте профилирование по числу апдейтов.", reply_markup=get_main_keyboard(True))
+        return
+    try:
+        if by_time:
+            amount = min(amount, PROFILE_MAX_SECONDS)
+            profiler.start_cpu(update.effective_chat.id, update.update_id)
+            context.job_queue.run_once(finish_cpu_profile_job, amount, name="cpu_profile")
+            text = f"⏱ Профилирование CPU запущено на {amount} с."
+        else:
+            amount = min(amount, PROFILE_MAX_UPDATES)
+            profiler.start_cpu(update.effective_chat.id, update.update_id, updates=amount)
+            text = f"⏱ Профилирование CPU запущено на {amount} апдейтов."
+    except ValueError as e:
+        # Другой профилировщик уже активен в этом потоке (Python 3.12+)
+        logger.error(f"Не удалось запустить cProfile: {e}")
+        await update_or_send_message(update, context, "❌ Не удалось запустить профилировщик.", reply_markup=get_main_keyboard(True))
+        return
+    await update_or_send_message(update, context, text + " Отчёт придёт файлом.", reply_markup=get_main_keyboard(True))
+
+async def profile_update_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Группа 1: выполняется после обработчиков апдейта
+    if profiler.update_done(update.update_id):
+        await send_cpu_profile(context.bot)
+
+async def memprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not admin_manager.is_admin(update.effective_user.id):
+        await update_or_send_message(update, context, "❌ Эта команда только для администраторов!", reply_markup=get_main_keyboard())
+        return
+    if context.args and context.args[0] == 'stop':
+        text = "🧹 tracemalloc остановлен." if profiler.stop_memory() else "⚠️ tracemalloc не запущен."
+        await update_or_send_message(update, context, text, reply_markup=get_main_keyboard(True))
+        return
+    taken = profiler.take_memory_snapshot()
+    if taken is None:
+        await update_or_send_message(
+            update, context,
+            "🧠 tracemalloc запущен, базовый снимок сохранён.\n"
+            "Повторите /memprofile, чтобы получить отчёт и разницу со снимком, /memprofile stop — остановить.",
+            reply_markup=get_main_keyboard(True)
+        )
+        return
+    report = await asyncio.get_running_loop().run_in_executor(None, Profiler.memory_report, *taken)
+    try:
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=report.encode('utf-8'),
+            filename=f"memory_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+            caption="🧠 Топ выделений памяти и разница с предыдущим снимком"
+        )
+    except TelegramError as e:
+        logger.error(f"Не удалось отправить отчёт по памяти: {e}")
+        await update_or_send_message(update, context, "❌ Не удалось отправить отчёт!", reply_markup=get_main_keyboard(True))
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not admin_manager.is_admin(update.effective_user.id):
+        await update_or_send_message(update, context, "❌ Эта команда только для администраторов!", reply_markup=get_main_keyboard())
+        return
+    pending = bool(context.args) and context.args[0] == 'pending'
+    fd, path = tempfile.mkstemp(suffix='.ndjson')
+    os.close(fd)
+    try:
+        count = await storage.export_snippets(path, pending=pending)
+        with open(path, 'rb') as f:
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id,
+                document=f,
+                filename=f"{'pending' if pending else 'snippets'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson",
+                caption=f"📦 Выгружено сниппетов: {count}"
+            )
+    except (TelegramError, IOError) as e:
+        logger.error(f"Ошибка при выгрузке сниппетов: {e}")
+        await update_or_send_message(update, context, "❌ Не удалось выгрузить сниппеты!", reply_markup=get_main_keyboard(True))
+    finally:
+        os.remove(path)
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not admin_manager.is_admin(update.effective_user.id):
+        await update_or_send_message(update, context, "❌ Эта команда только для администраторов!", reply_markup=get_main_keyboard())
+        return
+    if context.args == ['status']:
+        text = broadcaster.progress_text() if broadcaster.state else "📣 Рассылок пока не было."
+        await update_or_send_message(update, context, text, reply_markup=get_main_keyboard(True))
+        return
+    if context.args == ['stop']:
+        text = "⛔ Рассылка остановлена." if await broadcaster.cancel() else "❌ Сейчас рассылка не идёт."
+        await update_or_send_message(update, context, text, reply_markup=get_main_keyboard(True))
+        return
+    # Текст берётся из сообщения целиком, чтобы сохранить переносы строк
+    parts = update.message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await update_or_send_message(update, context, "❌ Используйте: /broadcast <текст> | status | stop", reply_markup=get_main_keyboard(True))
+        return
+    if broadcaster.running:
+        await update_or_send_message(update, context, "❌ Уже идёт рассылка. /broadcast status — прогресс, /broadcast stop — остановить.", reply_markup=get_main_keyboard(True))
+        return
+    await broadcaster.start(context.bot, parts[1], update.effective_user.id)
+    logger.info(f"Администратор {update.effective_user.id} запустил рассылку на {broadcaster.state['total']} пользователей")
+    await update_or_send_message(
+        update,
+        context,
+        f"📣 Рассылка запущена: {broadcaster.state['total']} получателей, "
+        f"~{format_duration(broadcaster.state['total'] / BROADCAST_RATE)} при {BROADCAST_RATE} сообщ./с.",
+        reply_markup=get_main_keyboard(True)
+    )
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not admin_manager.is_admin(update.effective_user.id):
+        await update_or_send_message(update, context, "❌ Эта команда только для администраторов!", reply_markup=get_main_keyboard())
+        return
+    target = context.args[0] if context.args else 'pending'
+    if target not in ('pending', 'library'):
+        await update_or_send_message(update, context, "❌ Используйте: /import [pending|library]", reply_markup=get_main_keyboard(True))
+        return
+    context.user_data['import_target'] = target
+    await update_or_send_message(
+        update, context,
+        "📥 Отправьте файл .ndjson — по JSON-объекту на строку:\n"
+        '{"name": ..., "code": ..., "language": ..., "author": ..., "tags": [...]}\n'
+        f"Сниппеты попадут {'на модерацию' if target == 'pending' else 'сразу в библиотеку'}.",
+        reply_markup=get_main_keyboard(True)
+    )
+
+async def handle_import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    target = context.user_data.pop('import_target', None)
+    if target is None or not admin_manager.is_admin(user_id):
+        return
+    document = update.message.document
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await update_or_send_message(update, context, f"❌ Файл больше {IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ, используйте tools/maintain.py import.", reply_markup=get_main_keyboard(True))
+        return
+    fd, path = tempfile.mkstemp(suffix='.ndjson')
+    os.close(fd)
+    try:
+        file = await document.get_file()
+        await file.download_to_drive(path)
+        with open(path, encoding='utf-8') as f:
+            report = await storage.import_snippets(f, pending=target == 'pending', user_id=user_id)
+    except (TelegramError, IOError, UnicodeDecodeError) as e:
+        logger.error(f"Ошибка при импорте сниппетов: {e}")
+        await update_or_send_message(update, context, "❌ Не удалось импортировать файл!", reply_markup=get_main_keyboard(True))
+        return
+    finally:
+        os.remove(path)
+    text = (
+        f"📥 Импорт завершён:\n"
+        f"✅ Добавлено: {report['imported']}\n"
+        f"♻️ Уже есть: {report['duplicates']}\n"
+        f"❌ С ошибками: {report['errors']}"
+    )
+    if report['error_lines']:
+        text += "\n\n" + "\n".join(report['error_lines'])
+    await update_or_send_message(update, context, text, reply_markup=get_main_keyboard(True))
+
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
         user_data = user_manager.get_user(user.id)
         user_data['username'] = user.username or user.full_name or f"User {user.id}"
         await user_manager.save_users()
-        level_info = USER_LEVELS[user_data['level']]
         snippets_count, uses_count = storage.get_user_snippets_stats(user_data['username'])
         level_up, new_achievements = await user_manager.update_user_stats(user.id, snippets_count, uses_count)
+        level_info = USER_LEVELS[user_data['level']]
         profile_text = (
             f"👨‍🎤 Профиль пользователя {user_data['username']}\n\n"
             f"📖 Уровень: {level_info['emoji']} {level_info['name']}\n"
@@ -883,23 +1423,13 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
             profile_text += f"\n📈 До уровня {next_level['emoji']} {next_level['name']}:\n"
             profile_text += f"   Сниппеты: {snippets_count}/{next_level['min_snippets']}\n"
             profile_text += f"   Просмотры: {uses_count}/{next_level['min_uses']}\n"
-        await update_or_send_message(update, context, profile_text, reply_markup=get_main_keyboard(is_admin))
-        if new_achievements:
-            for achievement in new_achievements:
-                ach_info = ACHIEVEMENTS.get(achievement, {'emoji': '❓', 'name': 'Неизвестно', 'description': ''})
-                await update_or_send_message(
-                    update,
-                    context,
-                    f"🎉 Новое достижение!\n{ach_info['emoji']} {ach_info['name']}\n{ach_info['description']}"
-                )
+        for achievement in new_achievements:
+            add_notice(context, achievement_notice(achievement))
         if level_up:
-            await update_or_send_message(
-                update,
-                context,
-                f"🎊 Поздравляем! Вы достигли уровня {level_info['emoji']} {level_info['name']}!"
-            )
+            add_notice(context, level_notice(user_data['level']))
         if random.random() < MEME_PROBABILITY:
-            await send_random_meme(update, context, user.id)
+            await add_random_meme(context, user.id)
+        await update_or_send_message(update, context, profile_text, reply_markup=get_main_keyboard(is_admin))
     except Exception as e:
         logger.error(f"Ошибка в show_profile: {e}", exc_info=True)
         is_admin = admin_manager.is_admin(update.effective_user.id)
@@ -951,35 +1481,16 @@ async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE, pag
     await update_or_send_message(update, context, text=text, reply_markup=keyboard)
 
 async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    total_snippets = len(storage.snippets)
-    total_uses = sum(snippet.get('uses', 0) for snippet in storage.snippets.values())
-    lang_stats = {}
-    for snippet in storage.snippets.values():
-        lang = snippet.get('language')
-        if lang not in lang_stats:
-            lang_stats[lang] = {'snippets': 0, 'uses': 0}
-        lang_stats[lang]['snippets'] += 1
-        lang_stats[lang]['uses'] += snippet.get('uses', 0)
-    tag_stats = {}
-    for snippet in storage.snippets.values():
-        for tag in snippet.get('tags', []):
-            if tag not in tag_stats:
-                tag_stats[tag] = 0
-            tag_stats[tag] += 1
-    author_stats = {}
-    for snippet in storage.snippets.values():
-        author = snippet['author']
-        if author not in author_stats:
-            author_stats[author] = {'snippets': 0, 'uses': 0}
-        author_stats[author]['snippets'] += 1
-        author_stats[author]['uses'] += snippet.get('uses', 0)
-    top_authors = sorted(author_stats.items(), key=lambda x: x[1]['uses'], reverse=True)[:3]
+    stats = engine.library_stats()
+    lang_stats = stats['languages']
+    tag_stats = stats['tags']
+    top_authors = stats['top_authors']
     stats_text = (
         f"📊 Статистика бота:\n\n"
-        f"📝 Всего сниппетов: {total_snippets}\n"
-        f"🖍️ Ожидают модерации: {len(storage.pending_snippets)}\n"
-        f"👍 Общие просмотры: {total_uses}\n"
-        f"👥 Пользователи: {len(user_manager.users)}\n\n"
+        f"📝 Всего сниппетов: {stats['total_snippets']}\n"
+        f"🖍️ Ожидают модерации: {stats['pending_snippets']}\n"
+        f"👍 Общие просмотры: {stats['total_uses']}\n"
+        f"👥 Пользователи: {stats['total_users']}\n\n"
     )
     if lang_stats:
         stats_text += "📈 По языкам:\n"
@@ -1005,13 +1516,16 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_text = (
         "ℹ Помощь по боту:\n\n"
         "📥 Добавить - Добавить новый сниппет (требуется модерация)\n"
+        "/add - Добавить сниппет одним сообщением: название, язык, теги и код\n"
         "🔍 Поиск - Найти код по названию\n"
         "📖 Все - Просмотреть все сниппеты\n"
         "🗑️ Удалить - Удалить свой сниппет\n"
         "⭐ Избранное - Ваша коллекция\n"
         "🎯 Фильтры - Поиск по языкам и тегам\n"
+        "/archive [язык|тег] - Скачать библиотеку или её часть zip-архивом\n"
         "👤 Профиль - Ваша статистика и достижения\n"
         "📊 Статистика - Общая статистика бота\n"
+        "💬 @бот запрос - Вставить сниппет в любой чат\n"
     )
     is_admin = admin_manager.is_admin(update.effective_user.id)
     if is_admin:
@@ -1020,6 +1534,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "🔧 Кнопка 'Админ-меню' - Открыть админ-меню\n"
             "/pending - Просмотр сниппетов на модерации\n"
             "/addadmin <user_id> - Добавить администратора\n"
+            "/profile <N | Ns | stop> - Профиль CPU следующих N апдейтов или N секунд\n"
+            "/memprofile [stop] - Отчёт tracemalloc и разница с прошлым снимком\n"
+            "/export [pending] - Выгрузить библиотеку или очередь модерации в NDJSON\n"
+            "/import [pending|library] - Загрузить сниппеты из NDJSON-файла\n"
+            "/broadcast <текст> | status | stop - Рассылка всем пользователям\n"
         )
     help_text += (
         f"\n📚 Поддерживаемые языки: {' '.join([f'{emoji} {lang}' for lang, emoji in LANGUAGES.items()])}\n"
@@ -1033,28 +1552,66 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     is_admin = admin_manager.is_admin(update.effective_user.id)
     await update_or_send_message(update, context, "Действие отменено!", reply_markup=get_main_keyboard(is_admin))
+    discard_code_file(context.user_data)
     context.user_data.clear()
     return ConversationHandler.END
 
-async def add_snippet_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = str(update.effective_user.id)
-    user_data = user_manager.get_user(user_id)
+async def count_submission(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    # Дневной лимит заявок; False — лимит исчерпан, пользователь уже получил ответ
+    user_data = user_manager.get_user(str(update.effective_user.id))
     today = datetime.now().date().isoformat()
-    if 'last_submission_date' in user_data and user_data['last_submission_date'] == today:
-        if user_data.get('submissions_today', 0) >= 5:
+    if user_data.get('last_submission_date') == today:
+        if user_data.get('submissions_today', 0) >= DAILY_SUBMISSION_LIMIT:
             is_admin = admin_manager.is_admin(update.effective_user.id)
             await update_or_send_message(
                 update,
                 context,
-                text="❌ Вы достигли лимита отправки сниппетов на сегодня (5)!",
+                text=f"❌ Вы достигли лимита отправки сниппетов на сегодня ({DAILY_SUBMISSION_LIMIT})!",
                 reply_markup=get_main_keyboard(is_admin)
             )
-            return ConversationHandler.END
+            return False
         user_data['submissions_today'] += 1
     else:
         user_data['last_submission_date'] = today
         user_data['submissions_today'] = 1
     await user_manager.save_users()
+    return True
+
+async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    # /add с заголовком и кодом в одном сообщении: разбор и проверка сразу, один ответ вместо диалога из пяти шагов.
+    # Команда — и вход, и запасной выход диалога добавления: начатый диалог завершается, его черновик сбрасывается
+    discard_draft(context.user_data)
+    is_admin = admin_manager.is_admin(update.effective_user.id)
+    parts = update.message.text.split(None, 1)
+    text = parts[1] if len(parts) > 1 else ''
+    code = code_language = None
+    # Блок ``` клиент Telegram превращает в сущность pre — код и язык берём из неё
+    blocks = sorted(update.message.parse_entities([MessageEntity.PRE]).items(), key=lambda item: item[0].offset)
+    if blocks:
+        entity, code = blocks[0]
+        code_language = entity.language
+        start = text.find(code)
+        if start != -1:
+            text = text[:start] + text[start + len(code):]
+    if not text.strip() and code is None:
+        await update_or_send_message(update, context, ADD_USAGE, reply_markup=get_main_keyboard(is_admin))
+        return ConversationHandler.END
+    try:
+        fields = parse_submission(text, code, code_language)
+    except ValueError as e:
+        await update_or_send_message(update, context, f"❌ {e}\n\n{ADD_USAGE}", reply_markup=get_main_keyboard(is_admin))
+        return ConversationHandler.END
+    if not await count_submission(update, context):
+        return ConversationHandler.END
+    context.user_data.update(
+        snippet_name=fields['name'], language=fields['language'], tags=fields['tags'], code=fields['code'],
+        language_detected=fields['language_detected']
+    )
+    return await done_adding_code(update, context)
+
+async def add_snippet_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if not await count_submission(update, context):
+        return ConversationHandler.END
     
     try:
         if update.message:
@@ -1070,6 +1627,16 @@ async def add_snippet_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return GET_NAME
 
+def get_language_keyboard(auto=True):
+    lang_buttons = []
+    for lang, emoji in LANGUAGES.items():
+        lang_buttons.append(KeyboardButton(f"{emoji} {lang}"))
+    keyboard = [lang_buttons[:2], lang_buttons[2:]]
+    if auto:
+        keyboard.append([KeyboardButton(AUTO_LANGUAGE_BUTTON)])
+    keyboard.append([KeyboardButton("↩️ Отмена")])
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
 async def get_snippet_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         if update.message:
@@ -1079,15 +1646,11 @@ async def get_snippet_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     if update.message.text == "↩️ Отмена":
         return await cancel(update, context)
     context.user_data['snippet_name'] = update.message.text
-    lang_buttons = []
-    for lang, emoji in LANGUAGES.items():
-        lang_buttons.append(KeyboardButton(f"{emoji} {lang}"))
-    keyboard = [lang_buttons[:2], lang_buttons[2:], [KeyboardButton("↩️ Отмена")]]
     await update_or_send_message(
         update,
         context,
         "🔍 Выберите язык программирования:",
-        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        reply_markup=get_language_keyboard()
     )
     return GET_LANGUAGE
 
@@ -1104,8 +1667,14 @@ async def get_snippet_language(update: Update, context: ContextTypes.DEFAULT_TYP
         if update.message.text == f"{emoji} {lang}":
             selected_language = lang
             break
-    if selected_language:
+    if selected_language and (context.user_data.get('code') or context.user_data.get('code_file')):
+        # Язык не определился по коду и был выбран вручную уже после ввода кода
         context.user_data['language'] = selected_language
+        return await done_adding_code(update, context)
+    if selected_language or update.message.text == AUTO_LANGUAGE_BUTTON:
+        # При автоопределении язык выбирается по коду, когда он будет введён
+        if selected_language:
+            context.user_data['language'] = selected_language
         tag_buttons = []
         for tag in CATEGORIES:
             tag_buttons.append(KeyboardButton(f"🗂️ {tag}"))
@@ -1122,15 +1691,11 @@ async def get_snippet_language(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return GET_TAGS
     else:
-        lang_buttons = []
-        for lang, emoji in LANGUAGES.items():
-            lang_buttons.append(KeyboardButton(f"{emoji} {lang}"))
-        keyboard = [lang_buttons[:2], lang_buttons[2:], [KeyboardButton("↩️ Отмена")]]
         await update_or_send_message(
             update,
             context,
             text="❌ Пожалуйста, выберите один из поддерживаемых языков.",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+            reply_markup=get_language_keyboard(auto='code' not in context.user_data)
         )
         return GET_LANGUAGE
 
@@ -1158,7 +1723,8 @@ async def get_snippet_tags(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         update,
         context,
         f"💾 Введите код для сниппета '{context.user_data['snippet_name']}':\n"
-        "(Можно отправить несколько сообщений, завершите кнопкой 'Готово')",
+        "(Можно отправить несколько сообщений, завершите кнопкой 'Готово'.\n"
+        f"Большой код — файлом до {LARGE_CODE_MAX_BYTES // 1024} КБ)",
         reply_markup=ReplyKeyboardMarkup([
             [KeyboardButton("✅ Готово")],
             [KeyboardButton("↩️ Отмена")]
@@ -1175,7 +1741,7 @@ async def get_snippet_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     if update.message.text == "↩️ Отмена":
         return await cancel(update, context)
     if update.message.text == "✅ Готово":
-        return await done_adding_code(update, context)
+        return await finish_snippet_code(update, context)
     if 'code' not in context.user_data:
         context.user_data['code'] = update.message.text
     else:
@@ -1193,6 +1759,93 @@ async def get_snippet_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         return GET_CODE
     return GET_CODE
 
+async def get_snippet_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    # Код файлом: документ скачивается прямо на диск, в user_data — только путь и file_id
+    document = update.message.document
+    if document.file_size and document.file_size > LARGE_CODE_MAX_BYTES:
+        await update_or_send_message(
+            update,
+            context,
+            f"❌ Файл больше {LARGE_CODE_MAX_BYTES // 1024} КБ.",
+            reply_markup=ReplyKeyboardMarkup([[KeyboardButton("↩️ Отмена")]], resize_keyboard=True)
+        )
+        return GET_CODE
+    discard_code_file(context.user_data)
+    context.user_data.pop('code', None)
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=UPLOADS_DIR)
+    os.close(fd)
+    context.user_data['code_file'] = path
+    telegram_file = await document.get_file()
+    await telegram_file.download_to_drive(path)
+    if os.path.getsize(path) <= MAX_CODE_LENGTH:
+        # Небольшой файл — обычный сниппет с кодом в сообщении
+        with open(path, 'rb') as f:
+            data = f.read()
+        discard_code_file(context.user_data)
+        try:
+            context.user_data['code'] = data.decode('utf-8')
+        except UnicodeDecodeError:
+            await update_or_send_message(update, context, "❌ Файл не в кодировке UTF-8.")
+            return GET_CODE
+    else:
+        context.user_data['code_file_id'] = document.file_id
+        context.user_data['code_file_name'] = document.file_name
+    return await finish_snippet_code(update, context)
+
+async def finish_snippet_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    # Код получен: если язык не выбран, определяем его по коду, иначе просим выбрать вручную
+    code, code_file = context.user_data.get('code'), context.user_data.get('code_file')
+    if (code or code_file) and not context.user_data.get('language'):
+        language = await detect_file_language(code_file) if code_file else detect_language(code)
+        if language is None:
+            await update_or_send_message(
+                update,
+                context,
+                text="🤔 Не удалось определить язык по коду, выберите его:",
+                reply_markup=get_language_keyboard(auto=False)
+            )
+            return GET_LANGUAGE
+        context.user_data['language'] = language
+        context.user_data['language_detected'] = True
+    return await done_adding_code(update, context)
+
+def discard_code_file(user_data):
+    path = user_data.pop('code_file', None)
+    user_data.pop('code_file_id', None)
+    user_data.pop('code_file_name', None)
+    if path:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Не удалось удалить загруженный файл {path}: {e}")
+
+def discard_draft(user_data):
+    # Черновик заявки; остальная сессия (списки, навигация) не трогается
+    discard_code_file(user_data)
+    for key in ('snippet_name', 'language', 'language_detected', 'tags', 'code', 'snippet_start_time'):
+        user_data.pop(key, None)
+
+def navigation_results(navigation):
+    # Результаты списка; после сжатия сессии в навигации остаются только имена
+    if 'current_snippets' not in navigation and 'current_names' in navigation:
+        names = navigation.pop('current_names')
+        navigation['current_snippets'] = {name: storage.snippets[name] for name in names if name in storage.snippets}
+    return navigation.get('current_snippets', {})
+
+async def add_snippet_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    discard_draft(context.user_data)
+    is_admin = admin_manager.is_admin(update.effective_user.id)
+    try:
+        await update_or_send_message(
+            update,
+            context,
+            "⌛ Добавление сниппета отменено из-за неактивности.",
+            reply_markup=get_main_keyboard(is_admin)
+        )
+    except TelegramError as e:
+        logger.warning(f"Не удалось уведомить о таймауте добавления: {e}")
+
 async def done_adding_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         snippet_name = context.user_data.get('snippet_name')
@@ -1202,8 +1855,9 @@ async def done_adding_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         author = update.effective_user.username or update.effective_user.full_name or f"User {update.effective_user.id}"
         author_id = update.effective_user.id
         start_time = context.user_data.get('snippet_start_time')
+        code_file = context.user_data.get('code_file')
 
-        if not all([snippet_name, code, language, author_id]):
+        if not all([snippet_name, code or code_file, language, author_id]):
             is_admin = admin_manager.is_admin(update.effective_user.id)
             await update_or_send_message(
                 update,
@@ -1211,24 +1865,25 @@ async def done_adding_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 "❌ Ошибка: неполные данные для сниппета!",
                 reply_markup=get_main_keyboard(is_admin)
             )
-            context.user_data.clear()
             return ConversationHandler.END
 
-        if await storage.add_pending_snippet(snippet_name, code, language, author, author_id, tags):
-            is_admin = admin_manager.is_admin(update.effective_user.id)
-            await update_or_send_message(
-                update,
-                context,
-                f"✅ Сниппет '{snippet_name}' отправлен на модерацию!\n"
-                f"{LANGUAGES.get(language, '📜')} Язык: {language}\n"
-                f"🗂️ Теги: {', '.join(tags) if tags else 'Без тегов'}\n"
-                f"👤 Автор: {author}",
-                reply_markup=get_main_keyboard(is_admin)
-            )
+        if code_file:
+            code_size = os.path.getsize(code_file)
             try:
-                await notify_admins(context, snippet_name, storage.pending_snippets[snippet_name])
-            except Exception as e:
-                logger.error(f"Ошибка в notify_admins: {e}", exc_info=True)
+                added = await storage.add_pending_file(
+                    snippet_name, code_file, language, author, author_id, tags,
+                    file_id=context.user_data.get('code_file_id'), file_name=context.user_data.get('code_file_name')
+                )
+            except ValueError as e:
+                is_admin = admin_manager.is_admin(update.effective_user.id)
+                await update_or_send_message(update, context, f"❌ {e}", reply_markup=get_main_keyboard(is_admin))
+                return ConversationHandler.END
+        else:
+            code_size = len(code)
+            added = await storage.add_pending_snippet(snippet_name, code, language, author, author_id, tags)
+        if added:
+            # Заявки с признаками риска — администраторам сразу, остальные — в дайджест
+            admin_digest.add(context, snippet_name, urgent=bool(snippet_risks(storage.pending_snippets[snippet_name])))
 
             # Проверка достижений
             user = user_manager.get_user(author_id)
@@ -1247,28 +1902,37 @@ async def done_adding_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             if (23 <= current_hour or current_hour < 3) and 'night_owl' not in user['achievements']:
                 user['achievements'].append('night_owl')
                 new_achievements.append('night_owl')
-            if len(code) > 1000 and 'code_crafter' not in user['achievements']:
+            if code_size > 1000 and 'code_crafter' not in user['achievements']:
                 user['achievements'].append('code_crafter')
                 new_achievements.append('code_crafter')
 
             if new_achievements:
                 try:
                     await user_manager.save_users()
-                    for achievement in new_achievements:
-                        ach_info = ACHIEVEMENTS.get(achievement, {'emoji': '❓', 'name': 'Неизвестно', 'description': ''})
-                        await update_or_send_message(
-                            update,
-                            context,
-                            f"🎉 Новое достижение!\n{ach_info['emoji']} {ach_info['name']}\n{ach_info['description']}"
-                        )
                 except Exception as e:
-                    logger.error(f"Ошибка при сохранении или отправке достижений: {e}", exc_info=True)
+                    logger.error(f"Ошибка при сохранении достижений: {e}", exc_info=True)
+                for achievement in new_achievements:
+                    add_notice(context, achievement_notice(achievement))
 
             if random.random() < MEME_PROBABILITY:
                 try:
-                    await send_random_meme(update, context, author_id)
+                    await add_random_meme(context, author_id)
                 except Exception as e:
-                    logger.error(f"Ошибка в send_random_meme: {e}", exc_info=True)
+                    logger.error(f"Ошибка в add_random_meme: {e}", exc_info=True)
+
+            # Ответ автору — после проверки достижений, чтобы поздравления вошли в то же сообщение
+            is_admin = admin_manager.is_admin(update.effective_user.id)
+            await update_or_send_message(
+                update,
+                context,
+                f"✅ Сниппет '{snippet_name}' отправлен на модерацию!\n"
+                f"{LANGUAGES.get(language, '📜')} Язык: {language}"
+                f"{' (определён по коду)' if context.user_data.get('language_detected') else ''}\n"
+                f"🗂️ Теги: {', '.join(tags) if tags else 'Без тегов'}\n"
+                f"👤 Автор: {author}"
+                + (f"\n📎 Код файлом: {format_size(code_size)}" if code_file else ""),
+                reply_markup=get_main_keyboard(is_admin)
+            )
         else:
             is_admin = admin_manager.is_admin(update.effective_user.id)
             await update_or_send_message(
@@ -1287,19 +1951,24 @@ async def done_adding_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             reply_markup=get_main_keyboard(is_admin)
         )
     finally:
-        context.user_data.clear()
+        discard_draft(context.user_data)
     return ConversationHandler.END
 
 async def review_snippet(update: Update, context: ContextTypes.DEFAULT_TYPE, snippet_id):
     if not admin_manager.is_admin(update.effective_user.id):
         await update.callback_query.answer("❌ Только администраторы могут выполнять это действие!")
         return
-    snippet_name = context.user_data.get('snippets_map', {}).get(f'pending_snippet_{snippet_id}')
+    snippet_name = storage.moderation_queue.resolve(snippet_id)
     if not snippet_name or snippet_name not in storage.pending_snippets:
         await update.callback_query.answer("❌ Сниппет не найден!")
         return
+    if not storage.moderation_queue.claim(snippet_name, update.effective_user.id):
+        keyboard, _ = get_pending_snippets_keyboard(page=0, moderator_id=update.effective_user.id)
+        await update_or_send_message(update, context, f"🔒 Сниппет '{snippet_name}' уже проверяет другой администратор.", reply_markup=keyboard)
+        return
     snippet = storage.pending_snippets[snippet_name]
     language_emoji = LANGUAGES.get(snippet['language'], '📜')
+    risks = snippet_risks(snippet)
     keyboard = InlineKeyboardMarkup([
         [
             InlineKeyboardButton("✅ Одобрить", callback_data=f"approve_{snippet_id}"),
@@ -1314,18 +1983,24 @@ async def review_snippet(update: Update, context: ContextTypes.DEFAULT_TYPE, sni
         f"{language_emoji} Язык: {snippet['language']}\n"
         f"👤 Автор: {snippet['author']}\n"
         f"🗂️ Теги: {', '.join(snippet['tags']) if snippet['tags'] else 'Без тегов'}\n"
-        f"📜 Код:\n```{snippet['language'].lower()}\n{snippet['code']}\n```",
+        + (f"⚠️ Обратите внимание: {', '.join(risks)}\n" if risks else "")
+        + f"📜 Код:\n{code_block(snippet)}",
         reply_markup=keyboard,
         parse_mode='Markdown'
     )
+    if is_large(snippet):
+        await send_code_document(context, update.effective_chat.id, snippet_name, snippet)
 
 async def approve_snippet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     snippet_id = query.data.replace("approve_", "")
-    snippet_name = context.user_data.get('snippets_map', {}).get(f'pending_snippet_{snippet_id}')
+    snippet_name = storage.moderation_queue.resolve(snippet_id)
     if not snippet_name or not admin_manager.is_admin(update.effective_user.id):
         await query.answer("❌ Ошибка или недостаточно прав!")
         return
+    if not storage.moderation_queue.claim(snippet_name, update.effective_user.id):
+        await update_or_send_message(update, context, f"🔒 Сниппет '{snippet_name}' уже проверяет другой администратор.", reply_markup=get_admin_keyboard())
+        return
     snippet = storage.pending_snippets.get(snippet_name)
     if not snippet:
         await query.answer("❌ Сниппет не найден!")
@@ -1336,64 +2011,34 @@ async def approve_snippet(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"Сниппет '{snippet_name}' одобрен администратором {update.effective_user.id}")
         user_id = snippet['user_id']
         user_author = user_manager.get_user(user_id)
+        # Автору — одно сообщение: одобрение, достижения и новый уровень
+        author_notices = [f"✅ Ваш сниппет '{snippet_name}' одобрен и добавлен в библиотеку!"]
         if 'reliable_coder' not in user_author['achievements']:
             user_author['achievements'].append('reliable_coder')
-            await user_manager.save_users()
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"🎉 Новое достижение!\n{ACHIEVEMENTS['reliable_coder']['emoji']} {ACHIEVEMENTS['reliable_coder']['name']}\n"
-                     f"{ACHIEVEMENTS['reliable_coder']['description']}"
-            )
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"✅ Ваш сниппет '{snippet_name}' одобрен и добавлен в библиотеку!"
-        )
-        await update_or_send_message(update, context, f"✅ Сниппет '{snippet_name}' одобрен!")
+            author_notices.append(achievement_notice('reliable_coder'))
+        # Обновление статистики для swift_moderator
+        if user_manager.count_moderations(update.effective_user.id):
+            add_notice(context, achievement_notice('swift_moderator'))
         snippets_count, uses_count = storage.get_user_snippets_stats(snippet['author'])
         level_up, new_achievements = await user_manager.update_user_stats(user_id, snippets_count, uses_count)
-        if new_achievements:
-            for achievement in new_achievements:
-                ach_info = ACHIEVEMENTS[achievement]
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"🎉 Новое достижение!\n{ach_info['emoji']} {ach_info['name']}\n{ach_info['description']}"
-                )
+        author_notices.extend(achievement_notice(achievement) for achievement in new_achievements)
         if level_up:
-            user_data = user_manager.get_user(user_id)
-            level_info = USER_LEVELS[user_data['level']]
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"🎊 Поздравляем! Вы достигли уровня {level_info['emoji']} {level_info['name']}!"
-            )
-        # Обновление статистики для swift_moderator
-        if 'last_moderation_time' not in user:
-            user['last_moderation_time'] = datetime.now().isoformat()
-            user['moderations_in_hour'] = 0
-        last_time = datetime.fromisoformat(user['last_moderation_time'])
-        current_time = datetime.now()
-        if (current_time - last_time).total_seconds() <= 3600:
-            user['moderations_in_hour'] = user.get('moderations_in_hour', 0) + 1
-        else:
-            user['moderations_in_hour'] = 1
-            user['last_moderation_time'] = current_time.isoformat()
-        if user['moderations_in_hour'] >= 10 and 'swift_moderator' not in user['achievements']:
-            user['achievements'].append('swift_moderator')
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=f"🎉 Новое достижение!\n{ACHIEVEMENTS['swift_moderator']['emoji']} {ACHIEVEMENTS['swift_moderator']['name']}\n"
-                     f"{ACHIEVEMENTS['swift_moderator']['description']}"
-            )
-        await user_manager.save_users()
+            author_notices.append(level_notice(user_author['level']))
+        await send_notices(context, {user_id: "\n\n".join(author_notices)})
+        await update_or_send_message(update, context, f"✅ Сниппет '{snippet_name}' одобрен!")
     else:
         await query.answer("❌ Ошибка при одобрении!")
 
 async def reject_snippet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     snippet_id = query.data.replace("reject_", "")
-    snippet_name = context.user_data.get('snippets_map', {}).get(f'pending_snippet_{snippet_id}')
+    snippet_name = storage.moderation_queue.resolve(snippet_id)
     if not snippet_name or not admin_manager.is_admin(update.effective_user.id):
         await query.answer("❌ Ошибка или недостаточно прав!")
         return
+    if not storage.moderation_queue.claim(snippet_name, update.effective_user.id):
+        await update_or_send_message(update, context, f"🔒 Сниппет '{snippet_name}' уже проверяет другой администратор.", reply_markup=get_admin_keyboard())
+        return
     snippet = storage.pending_snippets.get(snippet_name)
     if not snippet:         
         await query.answer("❌ Сниппет не найден!")
@@ -1419,8 +2064,12 @@ async def handle_reject_reason(update: Update, context: ContextTypes.DEFAULT_TYP
     except TelegramError as e:
         logger.warning(f"Не удалось удалить сообщение: {e}")
     reason = update.message.text
+    if context.user_data.pop('reject_bulk', False):
+        context.user_data.pop('waiting_for_reject_reason', None)
+        await bulk_reject(update, context, reason)
+        return
     snippet_id = context.user_data.get('reject_snippet_id')
-    snippet_name = context.user_data.get('snippets_map', {}).get(f'pending_snippet_{snippet_id}')
+    snippet_name = storage.moderation_queue.resolve(snippet_id)
     if not snippet_name or not storage.pending_snippets.get(snippet_name):
         is_admin = admin_manager.is_admin(update.effective_user.id)
         await update_or_send_message(update, context, "❌ Сниппет не найден!", reply_markup=get_main_keyboard(is_admin))
@@ -1435,45 +2084,183 @@ async def handle_reject_reason(update: Update, context: ContextTypes.DEFAULT_TYP
             chat_id=snippet['user_id'],
             text=f"❌ Ваш сниппет '{snippet_name}' отклонён.\nПричина: {reason}"
         )
-        is_admin = admin_manager.is_admin(update.effective_user.id)
-        await update_or_send_message(update, context, f"✅ Сниппет '{snippet_name}' отклонён по причине: {reason}", reply_markup=get_main_keyboard(is_admin))
         # Обновление статистики для justice_bringer
         if len(reason) > 50:
             user['detailed_rejections'] = user.get('detailed_rejections', 0) + 1
             if user['detailed_rejections'] >= 25 and 'justice_bringer' not in user['achievements']:
                 user['achievements'].append('justice_bringer')
-                await user_manager.save_users()
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=f"🎉 Новое достижение!\n{ACHIEVEMENTS['justice_bringer']['emoji']} {ACHIEVEMENTS['justice_bringer']['name']}\n"
-                         f"{ACHIEVEMENTS['justice_bringer']['description']}"
-                )
+                add_notice(context, achievement_notice('justice_bringer'))
         # Обновление статистики для swift_moderator
-        if 'last_moderation_time' not in user:
-            user['last_moderation_time'] = datetime.now().isoformat()
-            user['moderations_in_hour'] = 0
-        last_time = datetime.fromisoformat(user['last_moderation_time'])
-        current_time = datetime.now()
-        if (current_time - last_time).total_seconds() <= 3600:
-            user['moderations_in_hour'] = user.get('moderations_in_hour', 0) + 1
-        else:
-            user['moderations_in_hour'] = 1
-            user['last_moderation_time'] = current_time.isoformat()
-        if user['moderations_in_hour'] >= 10 and 'swift_moderator' not in user['achievements']:
-            user['achievements'].append('swift_moderator')
-            await user_manager.save_users()
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=f"🎉 Новое достижение!\n{ACHIEVEMENTS['swift_moderator']['emoji']} {ACHIEVEMENTS['swift_moderator']['name']}\n"
-                     f"{ACHIEVEMENTS['swift_moderator']['description']}"
-            )
+        if user_manager.count_moderations(update.effective_user.id):
+            add_notice(context, achievement_notice('swift_moderator'))
         await user_manager.save_users()
+        is_admin = admin_manager.is_admin(update.effective_user.id)
+        await update_or_send_message(update, context, f"✅ Сниппет '{snippet_name}' отклонён по причине: {reason}", reply_markup=get_main_keyboard(is_admin))
     else:
         is_admin = admin_manager.is_admin(update.effective_user.id)
         await update_or_send_message(update, context, "❌ Ошибка при отклонении!", reply_markup=get_main_keyboard(is_admin))
     context.user_data.pop('waiting_for_reject_reason', None)
     context.user_data.pop('reject_snippet_id', None)
 
+def format_notice_names(names):
+    lines = [f"• {name}" for name in names[:BULK_NOTICE_NAMES]]
+    if len(names) > BULK_NOTICE_NAMES:
+        lines.append(f"… и ещё {len(names) - BULK_NOTICE_NAMES}")
+    return "\n".join(lines)
+
+def group_by_author(records):
+    by_author = {}
+    for name, snippet in records.items():
+        by_author.setdefault(snippet['user_id'], []).append(name)
+    return by_author
+
+async def send_notices(context: ContextTypes.DEFAULT_TYPE, notices):
+    # По одному сообщению на автора; недоступный автор не прерывает рассылку остальным
+    async def send(chat_id, text):
+        try:
+            await context.bot.send_message(chat_id=chat_id, text=text)
+        except TelegramError as e:
+            logger.warning(f"Не удалось уведомить пользователя {chat_id}: {e}")
+    await asyncio.gather(*(send(chat_id, text) for chat_id, text in notices.items()))
+
+def claimed_selection(context: ContextTypes.DEFAULT_TYPE, moderator_id):
+    # Выбор, который модератор всё ещё держит: истёкший захват мог забрать другой администратор
+    queue = storage.moderation_queue
+    return sorted(name for name in context.user_data.pop('bulk_selection', set()) if queue.claim(name, moderator_id))
+
+async def show_bulk_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, page=0, notice=None):
+    if not storage.pending_snippets:
+        context.user_data.pop('bulk_selection', None)
+        await update_or_send_message(update, context, "🖋 Очередь модерации пустая.", reply_markup=get_admin_keyboard())
+        return
+    # Сниппеты, которые тем временем обработал другой администратор, из выбора выпадают
+    selected = context.user_data.setdefault('bulk_selection', set())
+    selected.difference_update([name for name in selected if name not in storage.pending_snippets])
+    context.user_data['bulk_page'] = page
+    keyboard, total_pages = get_pending_snippets_keyboard(page, selected, update.effective_user.id)
+    text = f"☑️ Массовая модерация (стр. {page+1}/{total_pages}), выбрано: {len(selected)}"
+    if notice:
+        text += f"\n{notice}"
+    await update_or_send_message(update, context, text, reply_markup=keyboard)
+
+async def handle_bulk_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, data):
+    if not admin_manager.is_admin(update.effective_user.id):
+        await update_or_send_message(update, context, "❌ Только администраторы могут выполнять это действие!", reply_markup=get_main_keyboard())
+        return
+    queue = storage.moderation_queue
+    moderator_id = update.effective_user.id
+    page = context.user_data.get('bulk_page', 0)
+    if data == "bulk_start":
+        queue.release_all(moderator_id)
+        context.user_data['bulk_selection'] = set()
+        await show_bulk_selection(update, context, page=0)
+    elif data.startswith("bulk_page_"):
+        await show_bulk_selection(update, context, page=int(data.replace("bulk_page_", "")))
+    elif data.startswith("bulk_toggle_"):
+        snippet_id = data.replace("bulk_toggle_", "")
+        snippet_name = queue.resolve(snippet_id)
+        selected = context.user_data.setdefault('bulk_selection', set())
+        notice = None
+        if snippet_name in selected:
+            selected.discard(snippet_name)
+            queue.release(snippet_name, moderator_id)
+        elif snippet_name in storage.pending_snippets:
+            if len(selected) >= BULK_MODERATION_LIMIT:
+                notice = f"⚠️ За раз можно выбрать не больше {BULK_MODERATION_LIMIT} сниппетов."
+            elif queue.claim(snippet_name, moderator_id):
+                selected.add(snippet_name)
+            else:
+                notice = f"🔒 Сниппет '{snippet_name}' уже проверяет другой администратор."
+        await show_bulk_selection(update, context, page, notice)
+    elif data.startswith("bulk_all_"):
+        page = int(data.replace("bulk_all_", ""))
+        selected = context.user_data.setdefault('bulk_selection', set())
+        for name in queue.page(page * ITEMS_PER_PAGE, ITEMS_PER_PAGE):
+            if len(selected) >= BULK_MODERATION_LIMIT:
+                break
+            if queue.claim(name, moderator_id):
+                selected.add(name)
+        await show_bulk_selection(update, context, page)
+    elif data == "bulk_approve":
+        await bulk_approve(update, context)
+    elif data == "bulk_reject":
+        selected = context.user_data.get('bulk_selection')
+        if not selected:
+            await show_bulk_selection(update, context, page, "⚠️ Ничего не выбрано.")
+            return
+        context.user_data['reject_bulk'] = True
+        context.user_data['waiting_for_reject_reason'] = True
+        await update_or_send_message(
+            update,
+            context,
+            f"⚠️ Укажите причину отклонения выбранных сниппетов ({len(selected)}):",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Отмена", callback_data="cancel_reject")]])
+        )
+
+async def bulk_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Все выбранные сниппеты — одним пакетом: по одному сохранению библиотеки, очереди
+    # и пользователей, по одному сообщению каждому автору
+    moderator_id = update.effective_user.id
+    approved = await storage.approve_many(claimed_selection(context, moderator_id))
+    if not approved:
+        await update_or_send_message(update, context, "❌ Выбранные сниппеты уже обработаны.", reply_markup=get_admin_keyboard())
+        return
+    logger.info(f"Сниппеты ({len(approved)}) одобрены администратором {moderator_id}: {', '.join(approved)}")
+    by_author = group_by_author(approved)
+    moderator = user_manager.get_user(moderator_id)
+    moderator['approved_snippets'] = moderator.get('approved_snippets', 0) + len(approved)
+    swift = user_manager.count_moderations(moderator_id, len(approved))
+    reliable = set()
+    for user_id in by_author:
+        achievements = user_manager.get_user(user_id)['achievements']
+        if 'reliable_coder' not in achievements:
+            achievements.append('reliable_coder')
+            reliable.add(user_id)
+    results = await user_manager.update_authors_stats(
+        {user_id: approved[names[0]]['author'] for user_id, names in by_author.items()}
+    )
+    notices = {}
+    for user_id, names in by_author.items():
+        level_up, new_achievements = results[user_id]
+        author_notices = [f"✅ Одобрены и добавлены в библиотеку ваши сниппеты ({len(names)}):\n{format_notice_names(names)}"]
+        for achievement in (['reliable_coder'] if user_id in reliable else []) + new_achievements:
+            author_notices.append(achievement_notice(achievement))
+        if level_up:
+            author_notices.append(level_notice(user_manager.get_user(user_id)['level']))
+        notices[user_id] = "\n\n".join(author_notices)
+    await send_notices(context, notices)
+    if swift:
+        add_notice(context, achievement_notice('swift_moderator'))
+    await update_or_send_message(update, context, f"✅ Одобрено сниппетов: {len(approved)}, авторов: {len(by_author)}",
+                                 reply_markup=get_admin_keyboard())
+
+async def bulk_reject(update: Update, context: ContextTypes.DEFAULT_TYPE, reason):
+    moderator_id = update.effective_user.id
+    is_admin = admin_manager.is_admin(moderator_id)
+    rejected = await storage.reject_many(claimed_selection(context, moderator_id))
+    if not rejected:
+        await update_or_send_message(update, context, "❌ Выбранные сниппеты уже обработаны.", reply_markup=get_main_keyboard(is_admin))
+        return
+    logger.info(f"Сниппеты ({len(rejected)}) отклонены администратором {moderator_id} по причине: {reason}")
+    by_author = group_by_author(rejected)
+    await send_notices(context, {
+        user_id: f"❌ Отклонены ваши сниппеты ({len(names)}):\n{format_notice_names(names)}\nПричина: {reason}"
+        for user_id, names in by_author.items()
+    })
+    moderator = user_manager.get_user(moderator_id)
+    moderator['rejected_snippets'] = moderator.get('rejected_snippets', 0) + len(rejected)
+    # Обновление статистики для justice_bringer
+    if len(reason) > 50:
+        moderator['detailed_rejections'] = moderator.get('detailed_rejections', 0) + len(rejected)
+        if moderator['detailed_rejections'] >= 25 and 'justice_bringer' not in moderator['achievements']:
+            moderator['achievements'].append('justice_bringer')
+            add_notice(context, achievement_notice('justice_bringer'))
+    if user_manager.count_moderations(moderator_id, len(rejected)):
+        add_notice(context, achievement_notice('swift_moderator'))
+    await user_manager.save_users()
+    await update_or_send_message(update, context, f"✅ Отклонено сниппетов: {len(rejected)}, авторов: {len(by_author)}\nПричина: {reason}",
+                                 reply_markup=get_main_keyboard(is_admin))
+
 async def search_snippets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     is_admin = admin_manager.is_admin(update.effective_user.id)
     if len(context.args) == 0:
@@ -1504,14 +2291,14 @@ async def search_snippets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['navigation']['current_page'] = 0
     context.user_data['navigation']['search_query'] = query
     keyboard, total_pages = create_snippets_keyboard(results, 0, "show", "_search")
+    if random.random() < MEME_PROBABILITY:
+        await add_random_meme(context, update.effective_user.id)
     await update_or_send_message(
         update,
         context,
         f"🔍 Найдено {len(results)} сниппетов по запросу '{query}':",
         reply_markup=keyboard
     )
-    if random.random() < MEME_PROBABILITY:
-        await send_random_meme(update, context, update.effective_user.id)
 
 async def show_all_snippets(update: Update, context: ContextTypes.DEFAULT_TYPE, page=0):
     is_admin = admin_manager.is_admin(update.effective_user.id)
@@ -1532,12 +2319,99 @@ async def show_all_snippets(update: Update, context: ContextTypes.DEFAULT_TYPE,
     context.user_data['navigation']['current_snippets'] = storage.snippets
     context.user_data['navigation']['current_page'] = page
     keyboard, total_pages = create_snippets_keyboard(storage.snippets, page, "show")
+    keyboard = with_archive_button(keyboard, "archive_all")
     text = f"📖 Все сниппеты (стр. {page+1}/{total_pages}):"
     await update_or_send_message(update, context, text, reply_markup=keyboard)
 
+def is_large(snippet):
+    return 'code_size' in snippet
+
+def code_block(snippet):
+    # Код для сообщения; у большого сниппета — только начало, целиком он уходит файлом
+    if is_large(snippet):
+        preview = storage.code_preview(snippet, LARGE_CODE_PREVIEW)
+        return (f"📎 Код файлом ({format_size(snippet['code_size'])}), начало:\n"
+                f"```{snippet['language'].lower()}\n{preview}\n```")
+    return f"```{snippet['language'].lower()}\n{snippet['code']}\n```"
+
+async def send_code_document(context: ContextTypes.DEFAULT_TYPE, chat_id, name, snippet):
+    # Повторные отправки — по сохранённому file_id, без загрузки файла в Telegram
+    file_id = snippet.get('file_id')
+    if file_id:
+        try:
+            await context.bot.send_document(chat_id=chat_id, document=file_id)
+            return
+        except BadRequest as e:
+            logger.warning(f"file_id сниппета '{name}' недействителен, загружаем заново: {e}")
+    filename = snippet.get('file_name')
+    if not filename:
+        stem = re.sub(r'[^\w.-]+', '_', name)[:60]
+        filename = f"{stem}.{LANGUAGE_EXTENSIONS.get(snippet['language'], 'txt')}"
+    message = await context.bot.send_document(chat_id=chat_id, document=storage.code_bytes(snippet), filename=filename)
+    await storage.remember_file_id(name, message.document.file_id)
+
+def with_archive_button(keyboard, callback_data):
+    return InlineKeyboardMarkup([*keyboard.inline_keyboard, [InlineKeyboardButton(ARCHIVE_BUTTON, callback_data=callback_data)]])
+
+async def send_library_archive(update: Update, context: ContextTypes.DEFAULT_TYPE, language=None, tag=None):
+    # Архив собирается один раз на поколение библиотеки, дальше уходит по file_id первой отправки
+    chat_id = update.effective_chat.id
+    label = language or tag
+    caption_name = f"по {'тегу ' if tag else ''}{label}" if label else "всей библиотеки"
+
+    async def send(entry):
+        caption = f"📦 Архив {caption_name}: {entry['count']} сниппетов"
+        if entry['file_id']:
+            try:
+                await context.bot.send_document(chat_id=chat_id, document=entry['file_id'], caption=caption)
+                return entry['file_id']
+            except BadRequest as e:
+                logger.warning(f"file_id архива {entry['path']} недействителен, загружаем заново: {e}")
+        if entry['size'] > ARCHIVE_MAX_UPLOAD:
+            await update_or_send_message(
+                update, context,
+                f"❌ Архив {caption_name} больше {format_size(ARCHIVE_MAX_UPLOAD)} — выберите язык или тег.",
+                reply_markup=get_main_keyboard(admin_manager.is_admin(update.effective_user.id))
+            )
+            return None
+        filename = "snippets-" + re.sub(r'[^\w-]+', '_', label) + ".zip" if label else "snippets.zip"
+        with open(entry['path'], 'rb') as f:
+            message = await context.bot.send_document(chat_id=chat_id, document=f, filename=filename, caption=caption)
+        return message.document.file_id
+
+    try:
+        entry = await archives.deliver(send, language=language, tag=tag)
+    except (TelegramError, IOError) as e:
+        logger.error(f"Ошибка при отправке архива {caption_name}: {e}")
+        entry = False
+    if not entry:
+        text = "❌ Не удалось отправить архив!" if entry is False else f"❌ Сниппеты {caption_name} не найдены."
+        await update_or_send_message(update, context, text,
+                                     reply_markup=get_main_keyboard(admin_manager.is_admin(update.effective_user.id)))
+
+async def archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /archive — вся библиотека, /archive PHP — язык, /archive WordPress — тег
+    value = ' '.join(context.args)
+    if not value:
+        await send_library_archive(update, context)
+    elif resolve_language(value) in LANGUAGES:
+        await send_library_archive(update, context, language=resolve_language(value))
+    elif value in CATEGORIES:
+        await send_library_archive(update, context, tag=value)
+    else:
+        await update_or_send_message(
+            update, context,
+            f"❌ Используйте: /archive [язык|тег]\nЯзыки: {', '.join(LANGUAGES)}\nТеги: {', '.join(CATEGORIES)}",
+            reply_markup=get_main_keyboard(admin_manager.is_admin(update.effective_user.id))
+        )
+
+def snippet_name_by_id(context: ContextTypes.DEFAULT_TYPE, snippet_id):
+    # Карта id → имя живёт в сессии до её сжатия; кнопки старых списков разрешаются по индексу библиотеки
+    snippet_name = context.user_data.get('snippets_map', {}).get(snippet_id)
+    return snippet_name if snippet_name is not None else storage.resolve_snippet_id(snippet_id)
+
 async def show_snippet(update: Update, context: ContextTypes.DEFAULT_TYPE, snippet_id):
-    snippets_map = context.user_data.get('snippets_map', {})
-    snippet_name = snippets_map.get(snippet_id)
+    snippet_name = snippet_name_by_id(context, snippet_id)
     if not snippet_name:
         await update.callback_query.answer("❌ Сниппет не найден")
         return
@@ -1555,7 +2429,7 @@ async def show_snippet(update: Update, context: ContextTypes.DEFAULT_TYPE, snipp
     )
     if snippet.get('tags'):
         snippet_text += f"🗂️ Теги: {', '.join(snippet['tags'])}\n"
-    snippet_text += f"\n\n```{snippet['language'].lower()}\n{snippet['code']}\n```"
+    snippet_text += f"\n\n{code_block(snippet)}"
     keyboard = get_quick_actions_keyboard(snippet_name, update.effective_user.id, is_author)
     await update_or_send_message(
         update,
@@ -1564,6 +2438,35 @@ async def show_snippet(update: Update, context: ContextTypes.DEFAULT_TYPE, snipp
         reply_markup=keyboard,
         parse_mode='Markdown'
     )
+    if is_large(snippet):
+        await send_code_document(context, update.effective_chat.id, snippet_name, snippet)
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Telegram ждёт ответа на каждое нажатие клавиши: только индекс и код текущей страницы
+    query = update.inline_query.query
+    offset = int(update.inline_query.offset) if update.inline_query.offset.isdigit() else 0
+    page, next_offset = storage.prefix_search_page(query, offset, INLINE_PAGE_SIZE, INLINE_MAX_RESULTS)
+    results = []
+    for name in page:
+        snippet = storage.snippets[name]
+        language = snippet['language']
+        description = f"{LANGUAGES.get(language, '📜')} {language} · 👤 {snippet['author']} · 👍 {snippet.get('uses', 0)}"
+        if is_large(snippet) and snippet.get('file_id'):
+            # Большой сниппет уже загружен в Telegram — вставляется тем же файлом
+            results.append(InlineQueryResultCachedDocument(
+                id=hashlib.md5(name.encode()).hexdigest()[:16],
+                title=name,
+                document_file_id=snippet['file_id'],
+                description=description,
+            ))
+            continue
+        results.append(InlineQueryResultArticle(
+            id=hashlib.md5(name.encode()).hexdigest()[:16],
+            title=name,
+            description=description,
+            input_message_content=InputTextMessageContent(code_block(snippet), parse_mode='Markdown'),
+        ))
+    await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
 
 async def delete_snippet_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     author = update.effective_user.username or update.effective_user.full_name
@@ -1673,25 +2576,25 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     elif text.startswith("🟨 JavaScript"):
         filtered = storage.filter_by_language("JavaScript")
-        await show_filtered_results(update, context, filtered, "JavaScript")
+        await show_filtered_results(update, context, filtered, "JavaScript", archive="archive_language_JavaScript")
     elif text.startswith("🐘 PHP"):
         filtered = storage.filter_by_language("PHP")
-        await show_filtered_results(update, context, filtered, "PHP")
+        await show_filtered_results(update, context, filtered, "PHP", archive="archive_language_PHP")
     elif text.startswith("🎨 CSS"):
         filtered = storage.filter_by_language("CSS")
-        await show_filtered_results(update, context, filtered, "CSS")
+        await show_filtered_results(update, context, filtered, "CSS", archive="archive_language_CSS")
     elif text.startswith("🌐 HTML"):
         filtered = storage.filter_by_language("HTML")
-        await show_filtered_results(update, context, filtered, "HTML")
+        await show_filtered_results(update, context, filtered, "HTML", archive="archive_language_HTML")
     elif text.startswith("🏗️ WordPress"):
         filtered = storage.filter_by_tag("WordPress")
-        await show_filtered_results(update, context, filtered, "тегу WordPress")
+        await show_filtered_results(update, context, filtered, "тегу WordPress", archive="archive_tag_WordPress")
     elif text.startswith("🏗️ Bitrix"):
         filtered = storage.filter_by_tag("Bitrix")
-        await show_filtered_results(update, context, filtered, "тегу Bitrix")
+        await show_filtered_results(update, context, filtered, "тегу Bitrix", archive="archive_tag_Bitrix")
     elif text.startswith("🏗️ Общее"):
         filtered = storage.filter_by_tag("Общее")
-        await show_filtered_results(update, context, filtered, "тегу Общее")
+        await show_filtered_results(update, context, filtered, "тегу Общее", archive="archive_tag_Общее")
     else:
         await update_or_send_message(
             update,
@@ -1700,7 +2603,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_main_keyboard(is_admin)
         )
 
-async def show_filtered_results(update: Update, context: ContextTypes.DEFAULT_TYPE, filtered_snippets, filter_name):
+async def show_filtered_results(update: Update, context: ContextTypes.DEFAULT_TYPE, filtered_snippets, filter_name, archive=None):
     is_admin = admin_manager.is_admin(update.effective_user.id)
     if not filtered_snippets:
         await update_or_send_message(
@@ -1719,7 +2622,10 @@ async def show_filtered_results(update: Update, context: ContextTypes.DEFAULT_TY
     context.user_data['navigation']['current_snippets'] = filtered_snippets
     context.user_data['navigation']['current_page'] = 0
     context.user_data['navigation']['filter_name'] = filter_name
+    context.user_data['navigation']['archive_callback'] = archive
     keyboard, total_pages = create_snippets_keyboard(filtered_snippets, 0, "show", "_filtered")
+    if archive:
+        keyboard = with_archive_button(keyboard, archive)
     await update_or_send_message(
         update,
         context,
@@ -1738,20 +2644,23 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_snippet(update, context, snippet_id)
     elif data.startswith("copy_"):
         snippet_id = data.replace("copy_", "")
-        snippet_name = context.user_data.get('snippets_map', {}).get(snippet_id)
+        snippet_name = snippet_name_by_id(context, snippet_id)
         if snippet_name and snippet_name in storage.snippets:
             snippet = storage.snippets[snippet_name]
             await query.answer("📖 Код скопирован!")
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"```{snippet['language'].lower()}\n{snippet['code']}\n```",
-                parse_mode='Markdown'
-            )
+            if is_large(snippet):
+                await send_code_document(context, query.message.chat_id, snippet_name, snippet)
+            else:
+                await context.bot.send_message(
+                    chat_id=query.message.chat_id,
+                    text=code_block(snippet),
+                    parse_mode='Markdown'
+                )
             if random.random() < 0.3:
-                await send_random_meme(update, context, query.from_user.id)
+                await add_random_meme(context, query.from_user.id)
     elif data.startswith("fav_"):
         snippet_id = data.replace("fav_", "")
-        snippet_name = context.user_data.get('snippets_map', {}).get(snippet_id)
+        snippet_name = snippet_name_by_id(context, snippet_id)
         if snippet_name:
             if await user_manager.add_to_favorites(query.from_user.id, snippet_name):
                 await query.answer("❤️ Добавлено в избранное!")
@@ -1764,7 +2673,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.answer("⚠️ Уже в избранном!")
     elif data.startswith("unfav_"):
         snippet_id = data.replace("unfav_", "")
-        snippet_name = context.user_data.get('snippets_map', {}).get(snippet_id)
+        snippet_name = snippet_name_by_id(context, snippet_id)
         if snippet_name:
             if await user_manager.remove_from_favorites(query.from_user.id, snippet_name):
                 await query.answer("💔 Удалено из избранного!")
@@ -1777,7 +2686,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.answer("⚠️ Не было в избранном!")
     elif data.startswith("delete_"):
         snippet_id = data.replace("delete_", "")
-        snippet_name = context.user_data.get('snippets_map', {}).get(snippet_id)
+        snippet_name = snippet_name_by_id(context, snippet_id)
         if snippet_name:
             snippet = storage.snippets.get(snippet_name)
             if snippet and snippet['author'] == (query.from_user.username or query.from_user.full_name):
@@ -1798,18 +2707,18 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.answer("❌ Вы можете удалять только свои сниппеты!")
     elif data.startswith("confirm_delete_"):
         snippet_id = data.replace("confirm_delete_", "")
-        snippet_name = context.user_data.get('snippets_map', {}).get(snippet_id)
+        snippet_name = snippet_name_by_id(context, snippet_id)
         if snippet_name:
             if await storage.delete_snippet(snippet_name):
                 logger.info(f"Сниппет '{snippet_name}' удалён пользователем {query.from_user.id}")
                 for user_id, user_data in user_manager.users.items():
                     if snippet_name in user_data['favorites']:
                         user_data['favorites'].remove(snippet_name)
+                if random.random() < 0.3:
+                    await add_random_meme(context, query.from_user.id)
                 await user_manager.save_users()
                 await update_or_send_message(update, context, f"✅ Сниппет '{snippet_name}' удалён!")
-                context.user_data['snippets_map'].pop(snippet_id, None)
-                if random.random() < 0.3:
-                    await send_random_meme(update, context, query.from_user.id)
+                context.user_data.get('snippets_map', {}).pop(snippet_id, None)
             else:
                 await query.answer("❌ Ошибка при удалении!")
     elif data == "cancel_delete":
@@ -1824,7 +2733,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await show_favorites(update, context, page)
         elif current_list == 'search':
             search_query = navigation.get('search_query', '')
-            results = navigation.get('current_snippets', {})
+            results = navigation_results(navigation)
             keyboard, total_pages = create_snippets_keyboard(results, page, "show", "_search")
             await update_or_send_message(
                 update,
@@ -1834,7 +2743,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         elif current_list == 'filtered':
             filter_name = navigation.get('filter_name', 'фильтру')
-            results = navigation.get('current_snippets', {})
+            results = navigation_results(navigation)
             keyboard, total_pages = create_snippets_keyboard(results, page, "show", "_filtered")
             await update_or_send_message(
                 update,
@@ -1844,13 +2753,22 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         else:
             await show_all_snippets(update, context, 0)
+    elif data.startswith("page_pending_"):
+        # Очередь модерации листается без списка навигации: страница берётся прямо из очереди
+        page = int(data.replace("page_pending_", ""))
+        keyboard, total_pages = get_pending_snippets_keyboard(page, moderator_id=update.effective_user.id)
+        await update_or_send_message(
+            update,
+            context,
+            f"🖋 Сниппеты на модерации (стр. {page+1}/{total_pages}):",
+            reply_markup=keyboard
+        )
     elif data.startswith("page_"):
         parts = data.split("_")
         if len(parts) >= 3:
-            action = parts[1]
             page = int(parts[2])
             navigation = context.user_data.get('navigation', {})
-            results = navigation.get('current_snippets', {})
+            results = navigation_results(navigation)
             if not results:
                 await update_or_send_message(update, context, "❌ Сниппеты не найдены")
                 return
@@ -1870,23 +2788,22 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 filter_name = navigation.get('filter_name', 'фильтру')
                 navigation['current_page'] = page
                 keyboard, total_pages = create_snippets_keyboard(results, page, "show", "_filtered")
+                if navigation.get('archive_callback'):
+                    keyboard = with_archive_button(keyboard, navigation['archive_callback'])
                 await update_or_send_message(
                     update,
                     context,
                     f"🎯 Найдено {len(results)} сниппетов по {filter_name} (стр. {page+1}/{total_pages}):",
                     reply_markup=keyboard
                 )
-            elif action == "pending":
-                navigation['current_page'] = page
-                keyboard, total_pages = get_pending_snippets_keyboard(page)
-                await update_or_send_message(
-                    update,
-                    context,
-                    f"🖋 Сниппеты на модерации (стр. {page+1}/{total_pages}):",
-                    reply_markup=keyboard
-                )
             else:
                 await show_all_snippets(update, context, page)
+    elif data == "archive_all":
+        await send_library_archive(update, context)
+    elif data.startswith("archive_language_"):
+        await send_library_archive(update, context, language=data.replace("archive_language_", ""))
+    elif data.startswith("archive_tag_"):
+        await send_library_archive(update, context, tag=data.replace("archive_tag_", ""))
     elif data.startswith("review_"):
         snippet_id = data.replace("review_", "")
         await review_snippet(update, context, snippet_id)
@@ -1894,12 +2811,18 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await approve_snippet(update, context)
     elif data.startswith("reject_"):
         await reject_snippet(update, context)
+    elif data.startswith("bulk_"):
+        await handle_bulk_callback(update, context, data)
     elif data == "cancel_reject":
         await update_or_send_message(update, context, "❌ Отклонение отменено")
         context.user_data.pop('waiting_for_reject_reason', None)
         context.user_data.pop('reject_snippet_id', None)
+        context.user_data.pop('reject_bulk', None)
+        storage.moderation_queue.release_all(update.effective_user.id)
     elif data == "back_to_pending":
-        keyboard, total_pages = get_pending_snippets_keyboard(page=0)
+        context.user_data.pop('bulk_selection', None)
+        storage.moderation_queue.release_all(update.effective_user.id)
+        keyboard, total_pages = get_pending_snippets_keyboard(page=0, moderator_id=update.effective_user.id)
         await update_or_send_message(update, context, f"🖋 Сниппеты на модерации (стр. 1/{total_pages}):", reply_markup=keyboard)
     elif data == "admin_pending":
         await pending_snippets(update, context)
@@ -1922,6 +2845,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.pop('last_message_id', None)
     elif data == "admin_users":
         await list_users(update, context)
+    elif data == "admin_slow":
+        await show_slow_handlers(update, context)
     elif data.startswith("page_users_"):
         page = int(data.replace("page_users_", ""))
         await list_users(update, context, page)
@@ -1937,6 +2862,51 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         logger.warning(f"Неизвестный callback_data: {data}")
 
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user:
+        session_sweeper.touch(update.effective_user.id)
+        # Пользователь, снова написавший боту, опять получает рассылки
+        user = user_manager.users.get(str(update.effective_user.id))
+        if user is not None and user.get('inactive'):
+            user['inactive'] = False
+
+def register_gauges(application: Application):
+    savers = (storage._snippets_saver, storage._pending_saver, user_manager._saver)
+    blob_stats = storage.code_blobs.stats
+    metrics.gauge('snippet_bot_snippets', 'Сниппетов в библиотеке', lambda: len(storage.snippets))
+    metrics.gauge('snippet_bot_pending_snippets', 'Сниппетов на модерации', lambda: len(storage.pending_snippets))
+    metrics.gauge('snippet_bot_users', 'Пользователей', lambda: len(user_manager.users))
+    metrics.gauge('snippet_bot_sessions', 'Сессий в памяти', lambda: len(application.user_data))
+    metrics.gauge('snippet_bot_update_queue_depth', 'Апдейтов в очереди', application.update_queue.qsize)
+    metrics.gauge('snippet_bot_saves_in_flight', 'Сохранений в работе и в очереди',
+                  lambda: sum((saver._running is not None) + (saver._pending is not None) for saver in savers))
+    metrics.gauge('snippet_bot_code_cache_reads_total', 'Чтений кода из хранилища',
+                  lambda: blob_stats['reads'], kind='counter')
+    metrics.gauge('snippet_bot_code_cache_hits_total', 'Попаданий в кэш кода',
+                  lambda: blob_stats['cache_hits'], kind='counter')
+    metrics.gauge('snippet_bot_loop_lag_max_seconds', 'Максимальная задержка цикла событий',
+                  lambda: f"{loop_monitor.lag_max:.6f}")
+
+async def on_startup(application: Application):
+    loop_monitor.start()
+    if TRACING:
+        tracer.start(TRACE_FILE, TRACE_SAMPLE_RATE)
+    # Сервер поднимается до загрузки данных: liveness отвечает сразу, readiness — после загрузки
+    await health_server.start()
+    await engine.initialize()
+    register_gauges(application)
+    health_server.ready = True
+    try:
+        await broadcaster.resume(application.bot)
+    except (IOError, OSError, ValueError) as e:
+        logger.error(f"Не удалось продолжить рассылку: {e}", exc_info=True)
+
+async def on_shutdown(application: Application):
+    await broadcaster.shutdown()
+    await health_server.stop()
+    loop_monitor.stop()
+    tracer.stop()
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Update {update} caused error: {context.error}", exc_info=True)
     if update and (update.message or update.callback_query):
@@ -1952,40 +2922,104 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except TelegramError as e:
             logger.error(f"Не удалось отправить сообщение об ошибке: {e}", exc_info=True)
 
-def main():
-    try:
-        application = Application.builder().token(BOT_TOKEN).build()
-
-        conv_handler = ConversationHandler(
-            entry_points=[MessageHandler(filters.Regex("📥 Добавить"), add_snippet_start)],
-            states={
-                GET_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_snippet_name)],
-                GET_LANGUAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_snippet_language)],
-                GET_TAGS: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_snippet_tags)],
-                GET_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_snippet_code)],
-            },
-            fallbacks=[MessageHandler(filters.Regex("↩️ Отмена"), cancel)],
-        )
+def build_application(token=BOT_TOKEN, base_url=None, application_class=TracedApplication):
+    # base_url и application_class переопределяются нагрузочным стендом (benchmarks/bench_load.py).
+    # Каталог данных создаётся здесь, а не при импорте: импорт модуля не трогает файловую систему
+    os.makedirs(DATA_DIR, exist_ok=True)
+    builder = (
+        Application.builder()
+        .application_class(application_class)
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+
+    conv_handler = ConversationHandler(
+        entry_points=[
+            MessageHandler(filters.Regex("📥 Добавить"), add_snippet_start),
+            CommandHandler("add", add_command),
+        ],
+        states={
+            GET_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_snippet_name)],
+            GET_LANGUAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_snippet_language)],
+            GET_TAGS: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_snippet_tags)],
+            GET_CODE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, get_snippet_code),
+                MessageHandler(filters.Document.ALL, get_snippet_document),
+            ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, add_snippet_timeout)],
+        },
+        fallbacks=[
+            MessageHandler(filters.Regex("↩️ Отмена"), cancel),
+            CommandHandler("add", add_command),
+        ],
+        conversation_timeout=ADD_CONVERSATION_TIMEOUT,
+    )
 
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("admin", admin_menu))
-        application.add_handler(CommandHandler("addadmin", add_admin))
-        application.add_handler(CommandHandler("pending", pending_snippets))
-        application.add_handler(CommandHandler("search", search_snippets))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(conv_handler)
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        application.add_handler(CallbackQueryHandler(handle_callback))
-        application.add_error_handler(error_handler)
-
-        # Асинхронная инициализация перед запуском
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(asyncio.gather(
-            storage.initialize(),
-            user_manager.initialize(),
-            admin_manager.initialize()
-        ))
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
+
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("admin", admin_menu))
+    application.add_handler(CommandHandler("addadmin", add_admin))
+    application.add_handler(CommandHandler("pending", pending_snippets))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("memprofile", memprofile_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("search", search_snippets))
+    application.add_handler(CommandHandler("archive", archive_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(conv_handler)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_import_document))
+    application.add_handler(CallbackQueryHandler(handle_callback))
+    application.add_handler(InlineQueryHandler(inline_query))
+    application.add_error_handler(error_handler)
+    instrument_handlers(application, tracer.wrap_handler)
+    instrument_handlers(application, loop_monitor.track)
+    application.add_handler(TypeHandler(Update, profile_update_done), group=1)
+    application.add_handler(TypeHandler(Update, flush_notices), group=2)
+
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            session_sweeper.sweep,
+            interval=SESSION_SWEEP_INTERVAL,
+            first=SESSION_SWEEP_INTERVAL,
+            name="session_sweeper"
+        )
+        application.job_queue.run_repeating(
+            storage.retrain_code_dictionary,
+            interval=CODE_DICT_RETRAIN_INTERVAL,
+            first=CODE_DICT_RETRAIN_INTERVAL,
+            name="code_dictionary_retrain"
+        )
+        application.job_queue.run_repeating(
+            storage.refresh_popularity,
+            interval=POPULARITY_REFRESH_INTERVAL,
+            first=POPULARITY_REFRESH_INTERVAL,
+            name="popularity_refresh"
+        )
+        if ADMIN_DIGEST_INTERVAL:
+            application.job_queue.run_repeating(
+                admin_digest.flush,
+                interval=ADMIN_DIGEST_INTERVAL,
+                first=ADMIN_DIGEST_INTERVAL,
+                name="admin_digest"
+            )
+    else:
+        logger.warning("JobQueue недоступна, очистка сессий, переобучение словаря сжатия "
+                       "и обновление рейтинга для inline-поиска отключены, "
+                       "администраторы получают уведомление о каждой заявке сразу")
+    return application
 
+def main():
+    try:
+        application = build_application()
         print("🚀 Бот запущен!")
         application.run_polling(allowed_updates=Update.ALL_TYPES)
     except Exception as e:
@@ -1993,5 +3027,4 @@ def main():
         raise
 
 if __name__ == '__main__':
-    import asyncio
     main()
\ No newline at end of file
@@ -0,0 +1,2520 @@
+"""Ядро библиотеки сниппетов без Telegram: хранилище, поиск, статистика и достижения.
+
+Импорт не требует BOT_TOKEN и не трогает файловую систему: данные читаются и пишутся
+только после явного создания SnippetEngine(data_dir) и вызова initialize().
+Telegram-слой (snippet_bot.py) — тонкий адаптер поверх движка.
+"""
+import asyncio
+import bisect
+import codecs
+import contextlib
+import contextvars
+import copy
+import functools
+import hashlib
+import heapq
+import json
+import logging
+import logging.handlers
+import marshal
+import mmap
+import operator
+import os
+import queue
+import random
+import re
+import shutil
+import struct
+import sys
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+BINARY_SNAPSHOTS = os.environ.get("BINARY_SNAPSHOTS", "1") != "0"
+MAX_CODE_LENGTH = 4000
+MAX_NAME_LENGTH = 100
+LARGE_CODE_MAX_BYTES = 512 * 1024
+LARGE_CODE_FIELDS = ('code_size', 'file_id', 'file_name')
+CODE_STREAM_CHUNK = 64 * 1024
+CODE_DICT_SIZE = 32 * 1024
+CODE_DICT_SAMPLE_SIZE = 2000
+CODE_DICT_RETRAIN_MIN_NEW = 200
+CODE_CACHE_SIZE = 128
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_ERRORS = 20
+INDEX_KEY_LENGTH = 24
+MODERATION_LEVEL_BOOST = 6 * 60 * 60  # на столько секунд раньше встаёт в очередь автор за каждый уровень
+MODERATION_RISK_DELAY = 24 * 60 * 60  # на столько позже — заявка за каждый подозрительный признак в коде
+MODERATION_CLAIM_TTL = 15 * 60
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 5
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Файлы внутри каталога данных
+DATA_DIR = 'data'
+SNIPPETS_FILENAME = 'shared_snippets.json'
+PENDING_SNIPPETS_FILENAME = 'pending_snippets.json'
+USERS_FILENAME = 'users.json'
+ADMINS_FILENAME = 'admins.json'
+CODE_BLOBS_FILENAME = 'code_blobs.bin'
+CODE_DICTS_DIRNAME = 'code_dicts'
+ARCHIVES_DIRNAME = 'archives'
+ARCHIVE_INDEX_FILENAME = 'index.json'
+
+# Languages and categories
+LANGUAGES = {
+    'JavaScript': '🟨',
+    'PHP': '🐘',
+    'CSS': '🎨',
+    'HTML': '🌐'
+}
+
+CATEGORIES = ['WordPress', 'Bitrix', 'Общее']
+
+LANGUAGE_EXTENSIONS = {'JavaScript': 'js', 'PHP': 'php', 'CSS': 'css', 'HTML': 'html'}
+
+USER_LEVELS = {
+    0: {'name': 'Junior', 'emoji': '🌱', 'min_snippets': 0, 'min_uses': 0},
+    1: {'name': 'Junior+', 'emoji': '🌿', 'min_snippets': 3, 'min_uses': 20},
+    2: {'name': 'Middle', 'emoji': '🌳', 'min_snippets': 10, 'min_uses': 100},
+    3: {'name': 'Middle+', 'emoji': '🌲', 'min_snippets': 25, 'min_uses': 300},
+    4: {'name': 'Senior', 'emoji': '🦅', 'min_snippets': 50, 'min_uses': 1000},
+    5: {'name': 'Кодовый маг', 'emoji': '🧙‍♂️', 'min_snippets': 100, 'min_uses': 2500},
+    6: {'name': 'Архитектор кода', 'emoji': '🏛️', 'min_snippets': 200, 'min_uses': 5000},
+    7: {'name': 'Кодовый титан', 'emoji': '💪⚡️', 'min_snippets': 350, 'min_uses': 10000},
+    8: {'name': 'Легенда кода', 'emoji': '🌟👑', 'min_snippets': 500, 'min_uses': 20000},
+    9: {'name': 'Бог кода', 'emoji': '⚜️🔥', 'min_snippets': 1000, 'min_uses': 50000}
+}
+
+ACHIEVEMENTS = {
+    'first_snippet': {'name': 'Первый сниппет', 'emoji': '🎉', 'description': 'Добавил первый сниппет'},
+    'popular_author': {'name': 'Популярный автор', 'emoji': '⭐', 'description': '100+ использований сниппетов'},
+    'code_master': {'name': 'Мастер кода', 'emoji': '🏆', 'description': '500+ использований сниппетов'},
+    'multilang': {'name': 'Полиглот', 'emoji': '🌍', 'description': 'Сниппеты на всех языках'},
+    'helpful': {'name': 'Помощник', 'emoji': '🤝', 'description': '10+ сниппетов в избранном у других'},
+    'active': {'name': 'Активист', 'emoji': '🔥', 'description': '25+ сниппетов'},
+    'code_comedian': {'name': 'Кодовый комик', 'emoji': '😂', 'description': 'Увидел 10 разных мемов от бота'},
+    'reliable_coder': {'name': 'Надёжный кодер', 'emoji': '✅', 'description': 'Сниппет прошёл модерацию и был одобрен'},
+    'snippet_marathon': {'name': 'Марафон сниппетов', 'emoji': '🏃', 'description': 'Добавил 5 сниппетов за один день'},
+    'code_sensei': {'name': 'Кодовый сенсей', 'emoji': '🥋', 'description': '50+ одобренных сниппетов'},
+    'tag_master': {'name': 'Мастер тегов', 'emoji': '🏷️', 'description': 'Использовал все доступные теги'},
+    'speed_coder': {'name': 'Скоростной кодер', 'emoji': '⚡', 'description': 'Добавил сниппет менее чем за 1 минуту'},
+    'community_star': {'name': 'Звезда сообщества', 'emoji': '🌟', 'description': '25+ пользователей добавили сниппет в избранное'},
+    'code_veteran': {'name': 'Ветеран кода', 'emoji': '🛡️', 'description': '100+ сниппетов'},
+    'bug_hunter': {'name': 'Охотник за багами', 'emoji': '🕵️', 'description': '10+ отклонённых сниппетов (для админов)'},
+    'language_guru': {'name': 'Гуру языка', 'emoji': '📚', 'description': '10+ сниппетов на одном языке'},
+    'snippet_savant': {'name': 'Савант сниппетов', 'emoji': '🧠', 'description': '1000+ просмотров всех сниппетов'},
+    'early_bird': {'name': 'Ранняя пташка', 'emoji': '🌅', 'description': 'Добавил сниппет с 5:00 до 7:00'},
+    'night_owl': {'name': 'Ночной кодер', 'emoji': '🦇', 'description': 'Добавил сниппет с 23:00 до 3:00'},
+    'code_crafter': {'name': 'Мастер кода', 'emoji': '🔨', 'description': 'Сниппет длиннее 1000 символов'},
+    'loyal_coder': {'name': 'Верный кодер', 'emoji': '🤗', 'description': 'Использует бота 30+ дней'},
+    'gatekeeper': {'name': 'Страж кода', 'emoji': '🛑', 'description': 'Модерировал 50+ сниппетов (для админов)'},
+    'justice_bringer': {'name': 'Вершитель правосудия', 'emoji': '⚖️', 'description': 'Отклонил 25+ сниппетов с подробными причинами (для админов)'},
+    'admin_mentor': {'name': 'Наставник админов', 'emoji': '👨‍🏫', 'description': 'Добавил 5+ новых администраторов (для админов)'},
+    'swift_moderator': {'name': 'Быстрый модератор', 'emoji': '🏎️', 'description': 'Модерировал 10+ сниппетов за час (для админов)'},
+    'code_inspector': {'name': 'Инспектор кода', 'emoji': '🔍', 'description': 'Одобрил 25+ сниппетов без жалоб (для админов)'}
+}
+
+CODE_MEMES = [
+    "Твой код настолько чистый, что его можно подавать на CodePen! 😎",
+    "Скопировал код? Не забудь убрать console.log! 😉",
+    "PHP? Это же слонячий код! 🐘",
+    "CSS: когда ты хотел быть дизайнером, но стал кодером! 🎨",
+    "JavaScript: потому что var всё ещё живёт в наших сердцах! 🟨",
+    "HTML: тег <br> — лучший способ сказать 'я сдаюсь'! 🌐",
+    "Код без багов? Это миф, как единорог! 🦄",
+    "Ты только что добавил сниппет? Пора за кофе! ☕",
+    "Сниппет готов? Проверяй, не сломал ли ты продакшен! 🚨",
+    "Код работает? Не трогай, оно само! 😅",
+    "Когда твой код работает с первого раза... Подозрительно! 🤔",
+    "CSS: 99% времени — это борьба с margin! 😤",
+    "JavaScript: async/await или как я перестал бояться и полюбил промисы! 🥳",
+    "PHP: echo 'Я всё ещё здесь!'; 🐘",
+    "Код без комментариев? Это как лабиринт без карты! 🗺️",
+    "HTML: <div> внутри <div> внутри <div>... Погружение началось! 🌊",
+    "Твой сниппет настолько хорош, что его лайкнул даже продакшен! 🚀"
+]
+
+ACHIEVEMENT_BITS = {name: bit for bit, name in enumerate(ACHIEVEMENTS)}
+MEME_BITS = {meme: bit for bit, meme in enumerate(CODE_MEMES)}
+
+# Компактные записи: поля хранятся в __slots__, наружу отдаются как dict-подобный объект
+# Ellipsis не встречается в JSON и сериализуется marshal как есть
+_UNSET = ...
+_EPOCH = datetime(1970, 1, 1)
+
+class _InternCodec:
+    def encode(self, value):
+        return sys.intern(value) if isinstance(value, str) else value
+
+    def decode(self, value):
+        return value
+
+    dump = decode
+
+class _TagsCodec:
+    def encode(self, value):
+        return tuple(sys.intern(tag) if isinstance(tag, str) else tag for tag in value or ())
+
+    def decode(self, value):
+        return value
+
+    def dump(self, value):
+        return list(value)
+
+class _TimestampCodec:
+    # ISO-строка без таймзоны <-> микросекунды от эпохи. Число хранится, только если из него
+    # получается та же строка; с таймзоной, без времени или с нулевой дробной частью — строка как есть
+    def encode(self, value):
+        if isinstance(value, str):
+            try:
+                encoded = (datetime.fromisoformat(value) - _EPOCH) // timedelta(microseconds=1)
+            except (ValueError, TypeError):
+                return value
+            return encoded if self.decode(encoded) == value else value
+        return value
+
+    def decode(self, value):
+        if isinstance(value, int):
+            return (_EPOCH + timedelta(microseconds=value)).isoformat()
+        return value
+
+    dump = decode
+
+class _DateCodec:
+    # Дата YYYY-MM-DD <-> номер дня; другие записи, которые понимает fromisoformat, остаются строкой
+    def encode(self, value):
+        if isinstance(value, str):
+            try:
+                encoded = date.fromisoformat(value).toordinal()
+            except (ValueError, TypeError):
+                return value
+            return encoded if self.decode(encoded) == value else value
+        return value
+
+    def decode(self, value):
+        if isinstance(value, int):
+            return date.fromordinal(value).isoformat()
+        return value
+
+    dump = decode
+
+class _FlagsCodec:
+    # Список имён из фиксированной таблицы <-> битовая маска; неизвестные значения
+    # сохраняются рядом с маской. Маска отдаёт известные имена в порядке таблицы, поэтому
+    # список в другом порядке или с повторами хранится как есть: (0, значения)
+    def __init__(self, bits):
+        self.bits = bits
+        self.names = list(bits)
+
+    def encode(self, values):
+        mask, unknown, last = 0, [], -1
+        values = tuple(values or ())
+        for value in values:
+            bit = self.bits.get(value)
+            if bit is None:
+                unknown.append(value)
+            elif bit <= last or unknown:
+                return (0, values)
+            else:
+                mask |= 1 << bit
+                last = bit
+        return (mask, tuple(unknown)) if unknown else mask
+
+    def is_verbatim(self, value):
+        return isinstance(value, tuple) and any(item in self.bits for item in value[1])
+
+    def split(self, value):
+        return value if isinstance(value, tuple) else (value, ())
+
+    def iter_names(self, value):
+        mask, unknown = self.split(value)
+        while mask:
+            low = mask & -mask
+            yield self.names[low.bit_length() - 1]
+            mask ^= low
+        yield from unknown
+
+    def decode(self, value):
+        return _FlagsView(self)
+
+    def dump(self, value):
+        return list(self.iter_names(value))
+
+class _FlagsView:
+    __slots__ = ('codec', 'record', 'field')
+
+    def __init__(self, codec, record=None, field=None):
+        self.codec = codec
+        self.record = record
+        self.field = field
+
+    def _value(self):
+        return getattr(self.record, self.field)
+
+    def __contains__(self, name):
+        mask, unknown = self.codec.split(self._value())
+        bit = self.codec.bits.get(name)
+        return (bit is not None and bool(mask >> bit & 1)) or name in unknown
+
+    def __iter__(self):
+        return self.codec.iter_names(self._value())
+
+    def __len__(self):
+        mask, unknown = self.codec.split(self._value())
+        return mask.bit_count() + len(unknown)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, name):
+        # Новое известное имя — бит маски, его место в списке определяет таблица
+        if name in self:
+            return
+        value = self._value()
+        mask, unknown = self.codec.split(value)
+        bit = self.codec.bits.get(name)
+        if bit is not None and not self.codec.is_verbatim(value):
+            mask |= 1 << bit
+        else:
+            unknown += (name,)
+        setattr(self.record, self.field, (mask, unknown) if unknown else mask)
+
+    def remove(self, name):
+        if name not in self:
+            raise ValueError(name)
+        setattr(self.record, self.field, self.codec.encode([item for item in self if item != name]))
+
+class _Record:
+    __slots__ = ('extra',)
+    FIELDS = ()
+    FIELD_SET = frozenset()
+    MUTABLE_FIELDS = ()
+    CODECS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELD_SET = frozenset(cls.FIELDS)
+        cls._get_slots = operator.attrgetter(*cls.FIELDS, 'extra')
+        cls._mutable_indexes = tuple(cls.FIELDS.index(field) for field in cls.MUTABLE_FIELDS)
+
+    def __init__(self, values=None):
+        for field in self.FIELDS:
+            setattr(self, field, _UNSET)
+        self.extra = None
+        for key, value in (values or {}).items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values)
+
+    def to_dict(self):
+        result = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is _UNSET:
+                continue
+            codec = self.CODECS.get(field)
+            result[field] = codec.dump(value) if codec else value
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+    def __getitem__(self, key):
+        if key in self.FIELD_SET:
+            value = getattr(self, key)
+            if value is _UNSET:
+                raise KeyError(key)
+            codec = self.CODECS.get(key)
+            if codec is None:
+                return value
+            decoded = codec.decode(value)
+            if isinstance(decoded, _FlagsView):
+                decoded.record, decoded.field = self, key
+            return decoded
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELD_SET:
+            codec = self.CODECS.get(key)
+            setattr(self, key, codec.encode(value) if codec else value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        if key in self.FIELD_SET:
+            return getattr(self, key) is not _UNSET
+        return bool(self.extra) and key in self.extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_meta(self):
+        return self.to_dict()
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def to_slots(self):
+        # Закодированные значения полей для бинарного снимка
+        return self._get_slots(self)
+
+    def frozen_slots(self):
+        # Как to_slots, но изменяемые значения скопированы: строку можно отдать другому потоку
+        row = self._get_slots(self)
+        if not self._mutable_indexes and self.extra is None:
+            return row
+        row = list(row)
+        for index in self._mutable_indexes:
+            if isinstance(row[index], list):
+                row[index] = list(row[index])
+        if self.extra is not None:
+            row[-1] = copy.deepcopy(self.extra)
+        return tuple(row)
+
+    @classmethod
+    def from_slots(cls, row):
+        record = cls.__new__(cls)
+        for field, value in zip(cls.FIELDS, row):
+            setattr(record, field, value)
+        record.extra = row[-1]
+        return record
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+_INTERN = _InternCodec()
+_TIMESTAMP = _TimestampCodec()
+
+class _RefCodec:
+    def encode(self, value):
+        return tuple(value) if value is not None else None
+
+    def decode(self, value):
+        return value
+
+    def dump(self, value):
+        return list(value) if value is not None else None
+
+class _CodeRecord(_Record):
+    # Код хранится в CodeBlobStore, в записи остаются ссылка (offset, length) и само хранилище:
+    # в одном процессе может жить несколько движков со своими каталогами данных
+    __slots__ = ('blob_store',)
+
+    def __init__(self, values=None, blob_store=None):
+        self.blob_store = blob_store
+        super().__init__(values)
+
+    @classmethod
+    def from_dict(cls, values, blob_store=None):
+        return cls(values, blob_store)
+
+    @classmethod
+    def from_slots(cls, row, blob_store=None):
+        record = super().from_slots(row)
+        record.blob_store = blob_store
+        return record
+
+    def __getitem__(self, key):
+        if key == 'code' and self.code is _UNSET and self.code_ref is not _UNSET:
+            return self.blob_store.read(*self.code_ref)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        if key == 'code':
+            return self.code is not _UNSET or self.code_ref is not _UNSET
+        return super().__contains__(key)
+
+    def to_dict(self):
+        # Исходный JSON-формат с кодом внутри записи
+        result = self.to_meta()
+        result.pop('code_ref', None)
+        if 'code' in self:
+            result = {'code': self['code'], **{k: v for k, v in result.items() if k != 'code'}}
+        return result
+
+    def to_meta(self):
+        return super().to_dict()
+
+_CODE_CODECS = {
+    'language': _INTERN,
+    'author': _INTERN,
+    'tags': _TagsCodec(),
+    'created_date': _TIMESTAMP,
+    'code_ref': _RefCodec(),
+}
+
+class SnippetRecord(_CodeRecord):
+    FIELDS = ('code', 'language', 'author', 'uses', 'tags', 'created_date', 'code_ref')
+    __slots__ = FIELDS
+    CODECS = _CODE_CODECS
+
+class PendingSnippetRecord(_CodeRecord):
+    FIELDS = ('code', 'language', 'author', 'tags', 'created_date', 'user_id', 'code_ref')
+    __slots__ = FIELDS
+    CODECS = _CODE_CODECS
+
+class UserRecord(_Record):
+    FIELDS = (
+        'favorites', 'achievements', 'level', 'total_snippets', 'total_uses', 'join_date',
+        'seen_memes', 'username', 'last_submission_date', 'submissions_today',
+        'approved_snippets', 'rejected_snippets', 'detailed_rejections', 'added_admins',
+        'complaints', 'last_moderation_time', 'moderations_in_hour'
+    )
+    __slots__ = FIELDS
+    MUTABLE_FIELDS = ('favorites',)
+    CODECS = {
+        'achievements': _FlagsCodec(ACHIEVEMENT_BITS),
+        'seen_memes': _FlagsCodec(MEME_BITS),
+        'join_date': _TIMESTAMP,
+        'last_submission_date': _DateCodec(),
+        'last_moderation_time': _TIMESTAMP,
+    }
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label_values -> [счётчики по корзинам (+Inf последней), сумма]
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labels + ('le',), label_values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Metrics:
+    # Экспорт в текстовом формате Prometheus. Счётчики и гистограммы обновляются
+    # только из цикла событий, значения gauge вычисляются в момент запроса /metrics
+    def __init__(self):
+        self._metrics = []
+        self._callbacks = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=METRIC_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, read, kind='gauge'):
+        self._callbacks.append((name, help_text, read, kind))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, help_text, read, kind in self._callbacks:
+            try:
+                value = read()
+            except Exception as e:
+                logger.error(f"Ошибка при вычислении метрики {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+SAVE_SECONDS = metrics.histogram('snippet_bot_save_seconds', 'Время записи файла данных', ('file',))
+SAVE_BYTES = metrics.counter('snippet_bot_save_bytes_total', 'Записано байт (JSON и снимок)', ('file',))
+SAVE_ERRORS = metrics.counter('snippet_bot_save_errors_total', 'Неудачные сохранения', ('file',))
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start', 'started', 'attributes')
+
+    def __init__(self, trace_id, parent_id, name, attributes):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.attributes = attributes
+
+class Tracer:
+    # Корневой спан на апдейт и дочерние спаны на обработчики, хранилище, достижения и
+    # вызовы Bot API. Готовые спаны пишутся в ротируемый JSONL фоновым потоком логирования
+    def __init__(self):
+        self.path = None
+        self.sample_rate = 1.0
+        self._logger = logging.getLogger(f"{__name__}.traces")
+        self._logger.propagate = False
+        self._listener = None
+
+    def start(self, path, sample_rate=1.0):
+        if self._listener:
+            return
+        self.path = path
+        self.sample_rate = sample_rate
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            self.path, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, encoding='utf-8'
+        )
+        records = queue.SimpleQueue()
+        self._logger.addHandler(logging.handlers.QueueHandler(records))
+        self._logger.setLevel(logging.INFO)
+        self._listener = logging.handlers.QueueListener(records, handler)
+        self._listener.start()
+
+    def stop(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+            for handler in list(self._logger.handlers):
+                self._logger.removeHandler(handler)
+
+    @contextlib.contextmanager
+    def trace(self, name, **attributes):
+        # Корневой спан: новая трасса, если трассировка включена и апдейт попал в выборку
+        if not self._listener or random.random() >= self.sample_rate:
+            yield None
+            return
+        span = Span(f"{random.getrandbits(128):032x}", None, name, attributes)
+        with self._activate(span):
+            yield span
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        # Дочерний спан создаётся только внутри трассы: фоновые задачи не пишутся
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(parent.trace_id, parent.span_id, name, attributes)
+        with self._activate(span):
+            yield span
+
+    @contextlib.contextmanager
+    def _activate(self, span):
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            self._export(span, error)
+
+    def _export(self, span, error):
+        record = {
+            'trace': span.trace_id,
+            'span': span.span_id,
+            'parent': span.parent_id,
+            'name': span.name,
+            'start': round(span.start, 6),
+            'duration_ms': round((time.perf_counter() - span.started) * 1000, 3),
+            'attrs': span.attributes,
+        }
+        if error:
+            record['error'] = error
+        self._logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def traced(self, name):
+        # Декоратор для методов и функций, синхронных и асинхронных
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+            else:
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def wrap_handler(self, callback):
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            with self.span('handler', handler=name):
+                return await callback(update, context)
+
+        return wrapper
+
+tracer = Tracer()
+
+def train_code_dictionary(samples, size=CODE_DICT_SIZE):
+    # zlib не умеет обучать словари: берём строки, которые дают наибольший выигрыш
+    # (частота * длина), самые ценные кладём в конец — zlib ищет совпадения ближе к концу окна
+    counts = {}
+    for sample in samples:
+        for line in set(sample.splitlines()):
+            line = line.strip()
+            if len(line) >= 4:
+                counts[line] = counts.get(line, 0) + 1
+    ranked = sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True)
+    picked, total = [], 0
+    for line, _ in ranked:
+        encoded = line.encode('utf-8') + b'\n'
+        if total + len(encoded) > size:
+            continue
+        picked.append(encoded)
+        total += len(encoded)
+    return b''.join(reversed(picked))
+
+class CodeBlobStore:
+    # Append-only файл с телами сниппетов, сжатыми zlib со словарём.
+    # Ссылка: (offset, length, dict_id); ссылка из двух элементов — несжатый блок старого формата.
+    def __init__(self, path, dicts_dir=None):
+        self.path = path
+        self.dicts_dir = dicts_dir or os.path.join(os.path.dirname(path), CODE_DICTS_DIRNAME)
+        self.dictionaries = {}
+        self.current_dict_id = 0
+        self.appended_since_training = 0
+        self._map = None
+        self._lock = asyncio.Lock()
+        self._cache = OrderedDict()
+        self.stats = {
+            'raw_bytes': 0,
+            'stored_bytes': 0,
+            'reads': 0,
+            'cache_hits': 0,
+            'decode_seconds': 0.0,
+            'decodes': 0
+        }
+
+    def _dict_path(self, dict_id):
+        return os.path.join(self.dicts_dir, f"{dict_id}.zdict")
+
+    async def load_dictionaries(self):
+        self.dictionaries = {}
+        if os.path.isdir(self.dicts_dir):
+            for filename in os.listdir(self.dicts_dir):
+                stem, ext = os.path.splitext(filename)
+                if ext != '.zdict' or not stem.isdigit():
+                    continue
+                async with aiofiles.open(os.path.join(self.dicts_dir, filename), 'rb') as f:
+                    self.dictionaries[int(stem)] = await f.read()
+        self.current_dict_id = max(self.dictionaries, default=0)
+        if self.dictionaries:
+            logger.info(f"Загружено {len(self.dictionaries)} словарей сжатия, текущий #{self.current_dict_id}")
+
+    async def train(self, samples):
+        dictionary = await asyncio.get_running_loop().run_in_executor(None, train_code_dictionary, samples)
+        if not dictionary:
+            return None
+        dict_id = self.current_dict_id + 1
+        os.makedirs(self.dicts_dir, exist_ok=True)
+        async with aiofiles.open(self._dict_path(dict_id), 'wb') as f:
+            await f.write(dictionary)
+        self.dictionaries[dict_id] = dictionary
+        self.current_dict_id = dict_id
+        self.appended_since_training = 0
+        logger.info(f"Обучен словарь сжатия #{dict_id}: {len(dictionary)} байт на {len(samples)} сниппетах")
+        return dict_id
+
+    def _compressor(self, dict_id):
+        if dict_id:
+            return zlib.compressobj(9, zlib.DEFLATED, -15, zdict=self.dictionaries[dict_id])
+        return zlib.compressobj(9, zlib.DEFLATED, -15)
+
+    def _decompressor(self, dict_id):
+        if dict_id:
+            return zlib.decompressobj(-15, zdict=self.dictionaries[dict_id])
+        return zlib.decompressobj(-15)
+
+    def _compress(self, data, dict_id):
+        compressor = self._compressor(dict_id)
+        return compressor.compress(data) + compressor.flush()
+
+    def _decompress(self, data, dict_id):
+        decompressor = self._decompressor(dict_id)
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @tracer.traced('storage.read_code')
+    def read(self, offset, length, dict_id=None):
+        ref = (offset, length, dict_id)
+        self.stats['reads'] += 1
+        code = self._cache.get(ref)
+        if code is not None:
+            self._cache.move_to_end(ref)
+            self.stats['cache_hits'] += 1
+            return code
+        if self._map is None or offset + length > len(self._map):
+            self._remap()
+        if self._map is None or offset + length > len(self._map):
+            raise IOError(f"Блок кода {offset}:{length} вне файла {self.path}")
+        data = self._map[offset:offset + length]
+        if dict_id is not None:
+            started = time.perf_counter()
+            data = self._decompress(data, dict_id)
+            self.stats['decode_seconds'] += time.perf_counter() - started
+            self.stats['decodes'] += 1
+        code = data.decode('utf-8')
+        self._cache[ref] = code
+        if len(self._cache) > CODE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return code
+
+    @tracer.traced('storage.append_code')
+    async def append_many(self, codes):
+        async with self._lock:
+            dict_id = self.current_dict_id
+            raw = [code.encode('utf-8') for code in codes]
+            chunks = [self._compress(data, dict_id) for data in raw]
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            async with aiofiles.open(self.path, 'ab') as f:
+                offset = await f.tell()
+                refs = []
+                for chunk in chunks:
+                    refs.append((offset, len(chunk), dict_id))
+                    offset += len(chunk)
+                await f.write(b''.join(chunks))
+                await f.flush()
+        self.appended_since_training += len(codes)
+        self.stats['raw_bytes'] += sum(len(data) for data in raw)
+        self.stats['stored_bytes'] += sum(len(chunk) for chunk in chunks)
+        return refs
+
+    async def append(self, code):
+        return (await self.append_many([code]))[0]
+
+    async def append_stream(self, chunks):
+        # Большое тело из асинхронного итератора байтов: куски сжимаются и дописываются по мере
+        # поступления, целиком код в памяти не собирается. Если итератор прервётся ошибкой,
+        # недописанный блок останется мусором в файле — его уберёт compact.
+        # Возвращает (ссылка, размер исходного кода в байтах)
+        async with self._lock:
+            dict_id = self.current_dict_id
+            compressor = self._compressor(dict_id)
+            raw_size = stored = 0
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            async with aiofiles.open(self.path, 'ab') as f:
+                offset = await f.tell()
+                async for chunk in chunks:
+                    raw_size += len(chunk)
+                    data = compressor.compress(chunk)
+                    stored += len(data)
+                    await f.write(data)
+                data = compressor.flush()
+                stored += len(data)
+                await f.write(data)
+                await f.flush()
+        self.appended_since_training += 1
+        self.stats['raw_bytes'] += raw_size
+        self.stats['stored_bytes'] += stored
+        return (offset, stored, dict_id), raw_size
+
+    def iter_bytes(self, offset, length, dict_id=None, limit=None):
+        # Распаковка блока кусками, мимо LRU — для отдачи больших тел файлом; limit — не больше стольких байт
+        block = memoryview(self.read_block(offset, length))
+        if dict_id is None:
+            yield bytes(block[:limit])
+            return
+        decompressor = self._decompressor(dict_id)
+        for start in range(0, length, CODE_STREAM_CHUNK):
+            data = decompressor.decompress(block[start:start + CODE_STREAM_CHUNK])
+            if limit is not None:
+                data = data[:limit]
+                limit -= len(data)
+            if data:
+                yield data
+            if limit == 0:
+                return
+        data = decompressor.flush()
+        yield data[:limit] if limit is not None else data
+
+    def report(self):
+        stats = self.stats
+        ratio = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 0.0
+        decode_us = 1e6 * stats['decode_seconds'] / stats['decodes'] if stats['decodes'] else 0.0
+        hit_rate = 100 * stats['cache_hits'] / stats['reads'] if stats['reads'] else 0.0
+        return {
+            'dict_id': self.current_dict_id,
+            'compression_ratio': round(ratio, 2),
+            'decode_us': round(decode_us, 1),
+            'cache_hit_rate': round(hit_rate, 1)
+        }
+
+    def read_block(self, offset, length):
+        # Блок в сохранённом виде, без распаковки — для офлайн-перепаковки файла
+        if self._map is None or offset + length > len(self._map):
+            self._remap()
+        if self._map is None or offset + length > len(self._map):
+            raise IOError(f"Блок кода {offset}:{length} вне файла {self.path}")
+        return self._map[offset:offset + length]
+
+    def read_detached(self, f, offset, length, dict_id=None):
+        # Чтение через отдельный дескриптор файла, мимо mmap и LRU — для сборки в фоновом потоке
+        f.seek(offset)
+        data = f.read(length)
+        if len(data) < length:
+            raise IOError(f"Блок кода {offset}:{length} вне файла {self.path}")
+        return self._decompress(data, dict_id) if dict_id is not None else data
+
+    def encode(self, code):
+        # Сжатие текущим словарём без записи в файл: (блок, dict_id)
+        return self._compress(code.encode('utf-8'), self.current_dict_id), self.current_dict_id
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+# Бинарный снимок: заголовок (magic, версия, отпечаток схемы, crc32, длина) + marshal-данные
+SNAPSHOT_MAGIC = b'SNPB'
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<4sH8sIQ')
+
+def snapshot_path(json_path):
+    return f"{os.path.splitext(json_path)[0]}.snap"
+
+def _snapshot_fingerprint(record_cls):
+    # Маски достижений и мемов зависят от порядка таблиц, поэтому они входят в отпечаток
+    schema = repr((record_cls.__name__, record_cls.FIELDS, list(ACHIEVEMENT_BITS), list(MEME_BITS)))
+    return hashlib.sha1(schema.encode('utf-8')).digest()[:8]
+
+def encode_snapshot(keys, rows, record_cls):
+    payload = marshal.dumps((keys, rows))
+    header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, _snapshot_fingerprint(record_cls),
+                                   zlib.crc32(payload), len(payload))
+    return header + payload
+
+def decode_snapshot(data, record_cls, **record_args):
+    if len(data) < _SNAPSHOT_HEADER.size:
+        raise ValueError("снимок обрезан")
+    magic, version, fingerprint, checksum, length = _SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"неподдерживаемый формат {magic!r} v{version}")
+    if fingerprint != _snapshot_fingerprint(record_cls):
+        raise ValueError("схема записей изменилась")
+    payload = memoryview(data)[_SNAPSHOT_HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) != checksum:
+        raise ValueError("контрольная сумма не совпадает")
+    keys, rows = marshal.loads(payload)
+    from_slots = functools.partial(record_cls.from_slots, **record_args) if record_args else record_cls.from_slots
+    return dict(zip(keys, map(from_slots, rows)))
+
+def check_snapshot(json_path, record_cls):
+    # Проверка без распаковки marshal-данных: заголовок, отпечаток схемы, crc32 и свежесть
+    path = snapshot_path(json_path)
+    if not os.path.exists(path):
+        return "снимка нет"
+    with open(path, 'rb') as f:
+        header = f.read(_SNAPSHOT_HEADER.size)
+        if len(header) < _SNAPSHOT_HEADER.size:
+            return "снимок обрезан"
+        magic, version, fingerprint, checksum, length = _SNAPSHOT_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            return f"неподдерживаемый формат {magic!r} v{version}"
+        if fingerprint != _snapshot_fingerprint(record_cls):
+            return "схема записей изменилась"
+        crc, size = 0, 0
+        while chunk := f.read(1 << 20):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+    if size != length or crc != checksum:
+        return "контрольная сумма не совпадает"
+    if os.path.exists(json_path) and os.path.getmtime(path) < os.path.getmtime(json_path):
+        return "снимок старше JSON и будет пропущен при загрузке"
+    return None
+
+def freeze_records(records):
+    # Копия данных, которую можно сериализовать в другом потоке, пока обработчики меняют записи
+    return list(records), [record.frozen_slots() for record in records.values()]
+
+def write_data_file(json_path, record_cls, frozen, backup=False):
+    # Выполняется в SAVE_EXECUTOR: JSON + бинарный снимок из замороженной копии
+    keys, rows = frozen
+    os.makedirs(os.path.dirname(json_path) or '.', exist_ok=True)
+    if backup and os.path.exists(json_path):
+        shutil.copy(json_path, f"{json_path}.bak")
+    data = {key: record_cls.from_slots(row).to_meta() for key, row in zip(keys, rows)}
+    content = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+    with open(f"{json_path}.tmp", 'wb') as f:
+        f.write(content)
+    os.replace(f"{json_path}.tmp", json_path)
+    written = len(content)
+    if BINARY_SNAPSHOTS:
+        path = snapshot_path(json_path)
+        try:
+            snapshot = encode_snapshot(keys, rows, record_cls)
+            with open(f"{path}.tmp", 'wb') as f:
+                f.write(snapshot)
+            os.replace(f"{path}.tmp", path)
+            written += len(snapshot)
+        except (IOError, OSError, ValueError) as e:
+            logger.error(f"Ошибка при записи снимка {path}: {e}")
+    return written
+
+def iter_json_object(path, chunk_size=1 << 16):
+    # Потоковый разбор JSON-объекта верхнего уровня: отдаёт пары (ключ, значение) по одной,
+    # в памяти только текущее значение и буфер чтения
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, pos, eof = '', 0, False
+
+        def skip_ws():
+            nonlocal buffer, pos, eof
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return buffer[pos:pos + 1]
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+
+        def decode():
+            # Значение, упёршееся в конец буфера, может быть обрезанным числом — дочитываем
+            nonlocal buffer, pos, eof
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    if end < len(buffer) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+
+        def expect(chars):
+            nonlocal pos
+            char = skip_ws()
+            if not char or char not in chars:
+                raise ValueError(f"{path}: ожидался один из символов {chars!r}, получено {char!r}")
+            pos += 1
+            return char
+
+        if not skip_ws():
+            return  # пустой файл
+        expect('{')
+        if skip_ws() == '}':
+            return
+        while True:
+            skip_ws()
+            key = decode()
+            expect(':')
+            skip_ws()
+            yield key, decode()
+            if expect(',}') == '}':
+                return
+
+class JsonObjectWriter:
+    # Пишет JSON-объект по одной паре в формате json.dumps(indent=2, ensure_ascii=False).
+    # Запись идёт во временный файл, который заменяет исходный при commit()
+    def __init__(self, path, backup=False, defer=False):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.backup = backup
+        self.defer = defer
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+        self._file.write('{')
+        return self
+
+    def write(self, key, value):
+        self._file.write(',\n  ' if self.count else '\n  ')
+        self._file.write(json.dumps(key, ensure_ascii=False))
+        self._file.write(': ')
+        self._file.write(json.dumps(value, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.write('\n}' if self.count else '}')
+        self._file.close()
+        if exc_type is not None:
+            self.discard()
+        elif not self.defer:
+            self.commit()
+
+    def commit(self):
+        if self.backup and os.path.exists(self.path):
+            shutil.copy(self.path, f"{self.path}.bak")
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+def rebuild_snapshot(json_path, record_cls):
+    # Снимок заново из JSON; в памяти — компактные строки записей, как у загруженного бота
+    keys, rows = [], []
+    if os.path.exists(json_path):
+        for key, value in iter_json_object(json_path):
+            keys.append(key)
+            rows.append(record_cls.from_dict(value).to_slots())
+    path = snapshot_path(json_path)
+    snapshot = encode_snapshot(keys, rows, record_cls)
+    with open(f"{path}.tmp", 'wb') as f:
+        f.write(snapshot)
+    os.replace(f"{path}.tmp", path)
+    return len(keys), len(snapshot)
+
+SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snippet-save")
+
+class CoalescingSaver:
+    # Не больше одного сохранения в работе и одного в очереди: все запросы, пришедшие
+    # во время записи, обслуживаются следующим сохранением со свежей копией данных
+    def __init__(self, json_path, record_cls, get_records, backup=False):
+        self.json_path = json_path
+        self.record_cls = record_cls
+        self.get_records = get_records
+        self.backup = backup
+        self._running = None
+        self._pending = None
+
+    async def save(self):
+        with tracer.span('storage.save', file=os.path.basename(self.json_path)):
+            waiter = self._pending
+            if waiter is None:
+                waiter = self._pending = asyncio.get_running_loop().create_future()
+                if self._running is None:
+                    self._start()
+            return await asyncio.shield(waiter)
+
+    def _start(self):
+        waiter, self._pending = self._pending, None
+        frozen = freeze_records(self.get_records())
+        self._running = asyncio.ensure_future(self._write(frozen, waiter))
+
+    async def _write(self, frozen, waiter):
+        loop = asyncio.get_running_loop()
+        name = os.path.basename(self.json_path)
+        started = time.perf_counter()
+        try:
+            written = await loop.run_in_executor(
+                SAVE_EXECUTOR, write_data_file, self.json_path, self.record_cls, frozen, self.backup
+            )
+            SAVE_BYTES.inc(name, amount=written)
+            waiter.set_result(written)
+        except Exception as e:
+            SAVE_ERRORS.inc(name)
+            waiter.set_exception(e)
+        finally:
+            SAVE_SECONDS.observe(time.perf_counter() - started, name)
+            self._running = None
+            if self._pending is not None:
+                self._start()
+
+async def read_snapshot(json_path, record_cls, **record_args):
+    # Снимок используется, только если он не старше JSON (JSON мог быть отредактирован вручную)
+    path = snapshot_path(json_path)
+    if not BINARY_SNAPSHOTS or not os.path.exists(path):
+        return None
+    try:
+        if os.path.exists(json_path) and os.path.getmtime(path) < os.path.getmtime(json_path):
+            logger.info(f"Снимок {path} старше {json_path}, загружаем JSON")
+            return None
+        async with aiofiles.open(path, 'rb') as f:
+            return decode_snapshot(await f.read(), record_cls, **record_args)
+    except (IOError, OSError, ValueError, EOFError, TypeError) as e:
+        logger.warning(f"Снимок {path} не загружен ({e}), загружаем JSON")
+        return None
+
+class AdminManager:
+    def __init__(self, data_dir=DATA_DIR):
+        self.admins_file = os.path.join(data_dir, ADMINS_FILENAME)
+        self.admins = []
+
+    async def initialize(self):
+        await self.load_admins()
+
+    async def load_admins(self):
+        if os.path.exists(self.admins_file):
+            try:
+                async with aiofiles.open(self.admins_file, 'r', encoding='utf-8') as f:
+                    self.admins = json.loads(await f.read())
+                logger.info(f"Загружено {len(self.admins)} администраторов")
+            except (json.JSONDecodeError, IOError) as e:
+                logger.error(f"Ошибка при загрузке админов: {e}")
+                self.admins = []
+        else:
+            logger.warning(f"Файл {self.admins_file} не найден, список админов пуст")
+            self.admins = []
+
+    async def save_admins(self):
+        try:
+            async with aiofiles.open(self.admins_file, 'w', encoding='utf-8') as f:
+                await f.write(json.dumps(self.admins, indent=2, ensure_ascii=False))
+        except IOError as e:
+            logger.error(f"Ошибка при сохранении админов: {e}")
+
+    def is_admin(self, user_id):
+        return str(user_id) in self.admins
+
+    async def add_admin(self, user_id):
+        user_id = str(user_id)
+        if user_id not in self.admins:
+            self.admins.append(user_id)
+            await self.save_admins()
+            return True
+        return False
+
+COMMUNITY_STAR_MIN_USERS = 25
+
+class AuthorStats:
+    # Агрегаты по сниппетам автора, из которых считаются уровень и достижения
+    __slots__ = ('snippets', 'uses', 'languages', 'tags', 'favorites', 'favorited_by')
+
+    def __init__(self):
+        self.snippets = 0
+        self.uses = 0
+        self.languages = {}
+        self.tags = set()
+        self.favorites = 0
+        self.favorited_by = set()
+
+    def add_snippet(self, snippet):
+        self.snippets += 1
+        self.uses += snippet.get('uses', 0)
+        language = snippet['language']
+        self.languages[language] = self.languages.get(language, 0) + 1
+        self.tags.update(snippet.get('tags', []))
+
+    def add_favorite(self, user_id):
+        self.favorites += 1
+        # Для «Звезды сообщества» важно только, набралось ли COMMUNITY_STAR_MIN_USERS разных пользователей
+        if len(self.favorited_by) < COMMUNITY_STAR_MIN_USERS:
+            self.favorited_by.add(user_id)
+
+def apply_user_rules(user, snippets_count, uses_count, author, is_admin):
+    # Уровень и достижения по агрегатам автора. Возвращает (уровень изменился, новые достижения);
+    # достижения только добавляются, условие проверяется, лишь если достижения ещё нет
+    user['total_snippets'] = snippets_count
+    user['total_uses'] = uses_count
+
+    old_level = user['level']
+    for level, data in USER_LEVELS.items():
+        if snippets_count >= data['min_snippets'] and uses_count >= data['min_uses']:
+            user['level'] = level
+
+    rules = (
+        ('first_snippet', lambda: snippets_count >= 1),
+        ('popular_author', lambda: uses_count >= 100),
+        ('code_master', lambda: uses_count >= 500),
+        ('active', lambda: snippets_count >= 25),
+        ('multilang', lambda: snippets_count > 0 and len(author.languages) >= len(LANGUAGES)),
+        ('helpful', lambda: author.favorites >= 10),
+        ('snippet_marathon', lambda: user.get('submissions_today', 0) >= 5),
+        ('code_sensei', lambda: snippets_count >= 50),
+        ('tag_master', lambda: snippets_count > 0 and len(author.tags) >= len(CATEGORIES)),
+        ('community_star', lambda: len(author.favorited_by) >= COMMUNITY_STAR_MIN_USERS),
+        ('code_veteran', lambda: snippets_count >= 100),
+        ('bug_hunter', lambda: is_admin and user.get('rejected_snippets', 0) >= 10),
+        ('language_guru', lambda: snippets_count > 0 and any(n >= 10 for n in author.languages.values())),
+        ('snippet_savant', lambda: uses_count >= 1000),
+        ('loyal_coder', lambda: (datetime.now() - datetime.fromisoformat(user['join_date'])).days >= 30),
+        ('gatekeeper', lambda: is_admin and user.get('approved_snippets', 0) + user.get('rejected_snippets', 0) >= 50),
+        ('code_inspector', lambda: is_admin and user.get('approved_snippets', 0) >= 25
+                                   and user.get('complaints', 0) == 0),
+    )
+    achievements = user['achievements']
+    new_achievements = []
+    for name, condition in rules:
+        if name not in achievements and condition():
+            achievements.append(name)
+            new_achievements.append(name)
+    return old_level != user['level'], new_achievements
+
+class UserManager:
+    def __init__(self, storage, admins, data_dir=DATA_DIR):
+        self.storage = storage
+        self.admins = admins
+        self.users_file = os.path.join(data_dir, USERS_FILENAME)
+        self.users = {}
+        self._saver = CoalescingSaver(self.users_file, UserRecord, lambda: self.users, backup=True)
+
+    async def initialize(self):
+        await self.load_users()
+
+    async def load_users(self):
+        if not os.path.exists(self.users_file):
+            logger.info(f"Файл {self.users_file} не найден, создаём пустой")
+            self.users = {}
+            try:
+                await self.save_users()
+            except Exception as e:
+                logger.error(f"Ошибка при создании {self.users_file}: {e}", exc_info=True)
+            return
+        snapshot = await read_snapshot(self.users_file, UserRecord)
+        if snapshot is not None:
+            self.users = snapshot
+            logger.info(f"Загружено {len(self.users)} пользователей из снимка")
+            return
+        try:
+            async with aiofiles.open(self.users_file, 'r', encoding='utf-8') as f:
+                content = await f.read()
+                if content.strip():
+                    self.users = self._from_json(json.loads(content))
+                    logger.info(f"Загружено {len(self.users)} пользователей")
+                else:
+                    logger.warning(f"Файл {self.users_file} пуст, инициализируем пустым")
+                    self.users = {}
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"Ошибка при загрузке пользователей: {e}", exc_info=True)
+            backup_file = f"{self.users_file}.bak"
+            if os.path.exists(backup_file):
+                logger.info(f"Попытка восстановления из резервной копии {backup_file}")
+                try:
+                    async with aiofiles.open(backup_file, 'r', encoding='utf-8') as f:
+                        self.users = self._from_json(json.loads(await f.read()))
+                        await self.save_users()
+                        logger.info("Пользователи восстановлены из резервной копии")
+                except Exception as e:
+                    logger.error(f"Ошибка восстановления пользователей: {e}", exc_info=True)
+                    self.users = {}
+            else:
+                self.users = {}
+
+    @staticmethod
+    def _from_json(data):
+        return {user_id: UserRecord.from_dict(user) for user_id, user in data.items()}
+
+    async def save_users(self):
+        try:
+            await self._saver.save()
+            logger.info(f"Сохранено {len(self.users)} пользователей")
+        except (IOError, OSError) as e:
+            logger.error(f"Ошибка при сохранении пользователей: {e}", exc_info=True)
+            raise
+
+    def get_user(self, user_id):
+        user_id = str(user_id)
+        if user_id not in self.users:
+            self.users[user_id] = UserRecord({
+                'favorites': [],
+                'achievements': [],
+                'level': 0,
+                'total_snippets': 0,
+                'total_uses': 0,
+                'join_date': datetime.now().isoformat(),
+                'seen_memes': [],
+                'username': None,
+                'last_submission_date': None,
+                'submissions_today': 0
+            })
+        return self.users[user_id]
+
+    def author_stats(self, author):
+        return self.authors_stats([author])[author]
+
+    def authors_stats(self, authors):
+        # Агрегаты сразу для нескольких авторов за один проход по библиотеке и избранному
+        stats = {author: AuthorStats() for author in authors}
+        owners = {}
+        for name, snippet in self.storage.snippets.items():
+            author_stats = stats.get(snippet['author'])
+            if author_stats is not None:
+                author_stats.add_snippet(snippet)
+                owners[name] = author_stats
+        if owners:
+            for user_id, user in self.users.items():
+                for favorite in user['favorites']:
+                    author_stats = owners.get(favorite)
+                    if author_stats is not None:
+                        author_stats.add_favorite(user_id)
+        return stats
+
+    @tracer.traced('achievements.evaluate')
+    async def update_user_stats(self, user_id, snippets_count, uses_count):
+        user = self.get_user(user_id)
+        result = apply_user_rules(user, snippets_count, uses_count, self.author_stats(user.get('username', '')),
+                                  self.admins.is_admin(user_id))
+        await self.save_users()
+        return result
+
+    async def update_authors_stats(self, authors):
+        # authors — {user_id: имя автора}, как у сниппетов из очереди модерации.
+        # Агрегаты считаются одним проходом, пользователи сохраняются один раз
+        stats = self.authors_stats(set(authors.values()) | {self.get_user(user_id).get('username', '')
+                                                             for user_id in authors})
+        results = {}
+        for user_id, author in authors.items():
+            user = self.get_user(user_id)
+            results[user_id] = apply_user_rules(user, stats[author].snippets, stats[author].uses,
+                                                stats[user.get('username', '')], self.admins.is_admin(user_id))
+        if results:
+            await self.save_users()
+        return results
+
+    def count_moderations(self, user_id, count=1):
+        # Решения модератора за скользящий час. True — если только что получено swift_moderator
+        user = self.get_user(user_id)
+        if 'last_moderation_time' not in user:
+            user['last_moderation_time'] = datetime.now().isoformat()
+            user['moderations_in_hour'] = 0
+        last_time = datetime.fromisoformat(user['last_moderation_time'])
+        current_time = datetime.now()
+        if (current_time - last_time).total_seconds() <= 3600:
+            user['moderations_in_hour'] = user.get('moderations_in_hour', 0) + count
+        else:
+            user['moderations_in_hour'] = count
+            user['last_moderation_time'] = current_time.isoformat()
+        if user['moderations_in_hour'] >= 10 and 'swift_moderator' not in user['achievements']:
+            user['achievements'].append('swift_moderator')
+            return True
+        return False
+
+    async def add_to_favorites(self, user_id, snippet_name):
+        user = self.get_user(user_id)
+        if snippet_name not in user['favorites']:
+            user['favorites'].append(snippet_name)
+            await self.save_users()
+            return True
+        return False
+
+    async def remove_from_favorites(self, user_id, snippet_name):
+        user = self.get_user(user_id)
+        if snippet_name in user['favorites']:
+            user['favorites'].remove(snippet_name)
+            await self.save_users()
+            return True
+        return False
+
+    def is_favorite(self, user_id, snippet_name):
+        user = self.get_user(user_id)
+        return snippet_name in user['favorites']
+
+def snippet_id(name):
+    # Короткий id сниппета для callback_data кнопок
+    return hashlib.md5(name.encode()).hexdigest()[:16]
+
+class NamePrefixIndex:
+    # Поиск по началу любого слова в имени. Отсортированные ключи — хвост имени в нижнем регистре
+    # от начала слова (не длиннее INDEX_KEY_LENGTH) — и параллельный список имён: поиск — два bisect
+    def __init__(self, names=()):
+        entries = sorted(entry for name in names for entry in self._entries(name))
+        self.keys = [key for key, _ in entries]
+        self.names = [name for _, name in entries]
+        self._ids = {snippet_id(name): name for name in names}
+
+    @staticmethod
+    def _tails(name):
+        lowered = name.lower()
+        return [lowered[match.start():] for match in re.finditer(r'\w+', lowered)] or [lowered]
+
+    def _entries(self, name):
+        return [(tail[:INDEX_KEY_LENGTH], name) for tail in self._tails(name)]
+
+    def add(self, name):
+        for key, _ in self._entries(name):
+            index = bisect.bisect_right(self.keys, key)
+            self.keys.insert(index, key)
+            self.names.insert(index, name)
+        self._ids[snippet_id(name)] = name
+
+    def remove(self, name):
+        for key, _ in self._entries(name):
+            index = bisect.bisect_left(self.keys, key)
+            while index < len(self.keys) and self.keys[index] == key:
+                if self.names[index] == name:
+                    del self.keys[index]
+                    del self.names[index]
+                    break
+                index += 1
+        self._ids.pop(snippet_id(name), None)
+
+    def resolve(self, snippet_id):
+        return self._ids.get(snippet_id)
+
+    def _range(self, prefix):
+        key = prefix[:INDEX_KEY_LENGTH]
+        start = bisect.bisect_left(self.keys, key)
+        return start, bisect.bisect_left(self.keys, key + '\U0010ffff', start)
+
+    def count(self, prefix):
+        # Число ключей с таким префиксом (имя с несколькими подходящими словами считается несколько раз)
+        start, end = self._range(prefix.lower())
+        return end - start
+
+    def matches(self, name, prefix):
+        prefix = prefix.lower()
+        return prefix in name.lower() and any(tail.startswith(prefix) for tail in self._tails(name))
+
+    def search(self, prefix):
+        prefix = prefix.lower()
+        start, end = self._range(prefix)
+        found = set(self.names[start:end])
+        if len(prefix) > INDEX_KEY_LENGTH:
+            found = {name for name in found if any(tail.startswith(prefix) for tail in self._tails(name))}
+        return found
+
+RISK_PATTERNS = (
+    ('eval', re.compile(r'\beval\s*\(')),
+    ('выполнение команд', re.compile(r'\b(?:exec|shell_exec|system|passthru|popen|proc_open)\s*\(')),
+    ('base64', re.compile(r'base64_decode|\batob\s*\(')),
+    ('внешний скрипт', re.compile(r'<script[^>]+src\s*=|<iframe|document\.write\s*\(', re.IGNORECASE)),
+    ('запись файлов', re.compile(r'\b(?:unlink|file_put_contents|fwrite|move_uploaded_file)\s*\(')),
+    ('ввод в запросе', re.compile(r'\b(?:query|mysqli_query|mysql_query)\s*\([^;]*\$_(?:GET|POST|REQUEST)')),
+    ('секреты', re.compile(r'(?:password|passwd|api_key|secret|token)[\'"]?\s*[=:]>?\s*[\'"][^\'"]{6,}',
+                           re.IGNORECASE)),
+)
+
+def risk_flags(code):
+    # Подозрительные признаки в коде заявки — для приоритета в очереди и подсказки модератору
+    return [label for label, pattern in RISK_PATTERNS if pattern.search(code)]
+
+def snippet_risks(record):
+    # У больших сниппетов признаки найдены при загрузке файла — код заново не читаем
+    if 'risk_flags' in record:
+        return record['risk_flags']
+    return risk_flags(record['code'])
+
+def large_code_fields(record):
+    return {key: record[key] for key in LARGE_CODE_FIELDS if key in record}
+
+# Частотный классификатор языка: код режется на токены одним простым регулярным выражением,
+# каждый токен из словаря добавляет свой вес языку. Словарь и выражение собираются при импорте
+LANGUAGE_TOKENS = {
+    'PHP': {
+        '<?php': 10, '?>': 3, '$': 1, '->': 1, '::': 2, 'echo': 2, 'foreach': 2, 'elseif': 2, 'isset': 2,
+        'empty': 1, 'array': 1, 'require_once': 2, 'include_once': 2, 'add_action': 3, 'add_filter': 3,
+        'register_post_type': 3, 'get_post_meta': 3, 'CModule': 3, 'CIBlockElement': 3,
+        **dict.fromkeys(('$_GET', '$_POST', '$_REQUEST', '$_SERVER', '$_SESSION', '$_COOKIE', '$_FILES'), 5),
+    },
+    'JavaScript': {
+        'document': 4, 'window': 3, 'console': 4, 'localStorage': 4, 'addEventListener': 4, 'querySelector': 4,
+        'querySelectorAll': 4, 'getElementById': 4, 'setTimeout': 3, 'setInterval': 3, 'fetch': 3, 'const': 3,
+        'let': 3, 'var': 2, 'async': 2, 'await': 2, 'Promise': 3, 'resolve': 1, 'reject': 1, 'undefined': 2,
+        'typeof': 2, 'then': 1, 'forEach': 2, 'jQuery': 3, '$(': 3, '=>': 1,
+    },
+    'CSS': {
+        '@media': 5, '@import': 3, '@keyframes': 5, '@font-face': 5, 'px': 1, 'rem': 1, 'vh': 1, 'vw': 1,
+        **dict.fromkeys((
+            'display:', 'margin:', 'padding:', 'color:', 'background:', 'background-color:', 'font-size:',
+            'font-weight:', 'font-family:', 'border:', 'border-radius:', 'width:', 'height:', 'position:',
+            'justify-content:', 'align-items:', 'flex-direction:', 'text-align:', 'z-index:', 'opacity:',
+            'transition:', 'transform:', 'box-shadow:', 'cursor:',
+        ), 3),
+    },
+    'HTML': {
+        '<!DOCTYPE': 10, '</': 1,
+        **dict.fromkeys((
+            '<html', '<head', '<body', '<div', '<span', '<form', '<input', '<label', '<button', '<select', '<option',
+            '<textarea', '<table', '<tr', '<td', '<ul', '<li', '<section', '<header', '<footer', '<nav', '<img',
+            '<meta', '<title', '<link', '<p', '<a', '<h1', '<h2', '<h3',
+        ), 2),
+    },
+}
+_LANGUAGE_TOKEN_WEIGHTS = {
+    token: (language, weight) for language, tokens in LANGUAGE_TOKENS.items() for token, weight in tokens.items()
+}
+_LANGUAGE_TOKEN_RE = re.compile(
+    r'<\?php|\?>|<!DOCTYPE|</|<[A-Za-z]\w*|\$_[A-Z]+|\$\(|\$(?=\w)|@[a-z-]+|[a-z][\w-]*:(?![:/])'
+    r'|[A-Za-z_]\w*|\d+|=>|->|::'
+)
+DETECT_SAMPLE_LENGTH = 2000
+DETECT_MIN_SCORE = 3
+
+def language_scores(code):
+    # Сумма весов найденных признаков по языкам; смотрим только начало кода — этого хватает
+    scores = dict.fromkeys(LANGUAGES, 0)
+    weights = _LANGUAGE_TOKEN_WEIGHTS
+    for token in _LANGUAGE_TOKEN_RE.findall(code, 0, DETECT_SAMPLE_LENGTH):
+        feature = weights.get(token)
+        if feature:
+            scores[feature[0]] += feature[1]
+    return scores
+
+def detect_language(code, min_score=DETECT_MIN_SCORE):
+    # Язык с наибольшей суммой признаков или None, если признаков слишком мало
+    scores = language_scores(code)
+    language = max(scores, key=scores.get)
+    return language if scores[language] >= min_score else None
+
+async def detect_file_language(path):
+    # Для загруженного файла хватает его начала
+    async with aiofiles.open(path, 'rb') as f:
+        head = await f.read(DETECT_SAMPLE_LENGTH * 4)
+    return detect_language(head.decode('utf-8', errors='ignore'))
+
+class ModerationPriority:
+    # Ключ очереди — «виртуальное» время подачи: старые заявки идут первыми, каждый уровень
+    # автора сдвигает заявку вперёд, каждый признак риска — назад. Ключ не зависит от текущего
+    # времени, поэтому порядок не нужно пересчитывать по мере ожидания
+    def __init__(self, level_of=None, level_boost=MODERATION_LEVEL_BOOST, risk_delay=MODERATION_RISK_DELAY):
+        self.level_of = level_of
+        self.level_boost = level_boost
+        self.risk_delay = risk_delay
+
+    def __call__(self, name, record):
+        try:
+            key = datetime.fromisoformat(record['created_date']).timestamp()
+        except (TypeError, ValueError):
+            key = 0.0
+        if self.level_of is not None and self.level_boost:
+            key -= self.level_of(record['user_id']) * self.level_boost
+        if self.risk_delay:
+            key += len(snippet_risks(record)) * self.risk_delay
+        return key
+
+class ModerationQueue:
+    # Отсортированные ключи приоритета и параллельный список имён, как у NamePrefixIndex:
+    # позиция ищется bisect, страница — срез. Захват заявки модератором истекает через ttl
+    def __init__(self, records=None, priority=None, ttl=MODERATION_CLAIM_TTL):
+        self.priority = priority or ModerationPriority()
+        self.ttl = ttl
+        entries = sorted((self.priority(name, record), name) for name, record in (records or {}).items())
+        self.keys = [key for key, _ in entries]
+        self.names = [name for _, name in entries]
+        self._key_of = dict(zip(self.names, self.keys))
+        self._ids = {self.snippet_id(name): name for name in self.names}
+        self._claims = {}
+
+    snippet_id = staticmethod(snippet_id)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._key_of
+
+    def _position(self, name):
+        key = self._key_of[name]
+        index = bisect.bisect_left(self.keys, key)
+        while self.names[index] != name:
+            index += 1
+        return index
+
+    def add(self, name, record):
+        if name in self._key_of:
+            self.remove(name)
+        key = self.priority(name, record)
+        index = bisect.bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.names.insert(index, name)
+        self._key_of[name] = key
+        self._ids[self.snippet_id(name)] = name
+
+    def remove(self, name):
+        if name not in self._key_of:
+            return
+        index = self._position(name)
+        del self.keys[index]
+        del self.names[index]
+        del self._key_of[name]
+        self._ids.pop(self.snippet_id(name), None)
+        self._claims.pop(name, None)
+
+    def page(self, start, count):
+        return self.names[start:start + count]
+
+    def resolve(self, snippet_id):
+        return self._ids.get(snippet_id)
+
+    def claimed_by(self, name):
+        claim = self._claims.get(name)
+        if claim is None:
+            return None
+        if claim[1] <= time.monotonic():
+            del self._claims[name]
+            return None
+        return claim[0]
+
+    def claim(self, name, moderator_id):
+        # False, если заявку уже держит другой модератор; свой захват продлевается
+        moderator_id = str(moderator_id)
+        if name not in self._key_of or self.claimed_by(name) not in (None, moderator_id):
+            return False
+        self._claims[name] = (moderator_id, time.monotonic() + self.ttl)
+        return True
+
+    def release(self, name, moderator_id):
+        if self.claimed_by(name) == str(moderator_id):
+            del self._claims[name]
+
+    def release_all(self, moderator_id):
+        for name in [name for name, (holder, _) in self._claims.items() if holder == str(moderator_id)]:
+            del self._claims[name]
+
+def validate_snippet_item(item):
+    # Строка NDJSON-импорта -> (имя, поля записи); ValueError с причиной, если запись не подходит
+    if not isinstance(item, dict):
+        raise ValueError("ожидается JSON-объект")
+    name, code, author = item.get('name'), item.get('code'), item.get('author')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("нет имени")
+    if len(name) > MAX_NAME_LENGTH:
+        raise ValueError(f"имя длиннее {MAX_NAME_LENGTH} символов")
+    if not isinstance(code, str) or not code.strip():
+        raise ValueError("нет кода")
+    if len(code) > MAX_CODE_LENGTH:
+        raise ValueError(f"код длиннее {MAX_CODE_LENGTH} символов")
+    language = item.get('language')
+    if language not in LANGUAGES:
+        # Нет языка или он не из списка (например, «Другой») — определяем по коду
+        language = detect_language(code)
+        if language is None:
+            raise ValueError(f"неизвестный язык {item.get('language')!r}, по коду определить не удалось")
+    if not isinstance(author, str) or not author:
+        raise ValueError("нет автора")
+    tags = item.get('tags') or []
+    if not isinstance(tags, list) or any(tag not in CATEGORIES for tag in tags):
+        raise ValueError(f"неизвестные теги {tags!r}")
+    uses = item.get('uses', 0)
+    if not isinstance(uses, int) or uses < 0:
+        raise ValueError("uses должно быть неотрицательным целым")
+    fields = {
+        'code': code,
+        'language': language,
+        'author': author,
+        'uses': uses,
+        'tags': tags,
+        'created_date': item.get('created_date') or datetime.now().isoformat(),
+    }
+    if item.get('user_id') is not None:
+        fields['user_id'] = str(item['user_id'])
+    return name, fields
+
+SUBMISSION_KEYS = {
+    'name': 'name', 'название': 'name', 'имя': 'name',
+    'language': 'language', 'lang': 'language', 'язык': 'language',
+    'tags': 'tags', 'tag': 'tags', 'теги': 'tags', 'тег': 'tags',
+}
+LANGUAGE_ALIASES = {'js': 'JavaScript', 'htm': 'HTML'}
+_FENCE_RE = re.compile(r'```([\w+#-]*)[ \t]*\n(.*?)\n?```', re.DOTALL)
+_HEADER_RE = re.compile(r'(\w+)\s*:\s*(.*)$')
+
+def resolve_language(value):
+    value = (value or '').strip().lower()
+    for language in LANGUAGES:
+        if language.lower() == value:
+            return language
+    return LANGUAGE_ALIASES.get(value)
+
+def parse_submission(text, code=None, code_language=None):
+    # Сниппет одним сообщением: заголовок «ключ: значение» (можно между строками ---) и код —
+    # в блоке ``` или просто после заголовка. Если клиент Telegram уже выделил блок кода
+    # в сущность pre, бот передаёт его в code/code_language, а в text остаётся заголовок.
+    # Возвращает поля заявки или ValueError с причиной
+    if code is None:
+        match = _FENCE_RE.search(text)
+        if match:
+            code_language = code_language or match.group(1)
+            code = match.group(2)
+            text = text[:match.start()] + text[match.end():]
+    lines = text.split('\n')
+    fields = {}
+    index = 0
+    while index < len(lines):
+        line = lines[index].strip()
+        if line == '---' or (not line and not fields):
+            index += 1
+            continue
+        match = _HEADER_RE.match(line)
+        if not match or match.group(1).lower() not in SUBMISSION_KEYS:
+            break
+        fields[SUBMISSION_KEYS[match.group(1).lower()]] = match.group(2).strip()
+        index += 1
+    rest = '\n'.join(lines[index:]).strip('\n')
+    if code is None:
+        code = rest
+    elif rest.strip():
+        raise ValueError(f"непонятная строка: {rest.strip().splitlines()[0][:50]!r}")
+
+    name = fields.get('name', '')
+    if not name:
+        raise ValueError("нет названия (name: ...)")
+    if len(name) > MAX_NAME_LENGTH:
+        raise ValueError(f"название длиннее {MAX_NAME_LENGTH} символов")
+    language_value = fields.get('language') or code_language
+    if language_value:
+        language = resolve_language(language_value)
+        if language is None:
+            raise ValueError(f"неизвестный язык {language_value!r}, доступны: {', '.join(LANGUAGES)}")
+    else:
+        language = detect_language(code)
+        if language is None:
+            raise ValueError("не удалось определить язык по коду, укажите его (language: ... или ```язык)")
+    tags = []
+    for value in re.split(r'[,;]', fields.get('tags', '')):
+        value = value.strip().lstrip('#')
+        if not value:
+            continue
+        tag = next((category for category in CATEGORIES if category.lower() == value.lower()), None)
+        if tag is None:
+            raise ValueError(f"неизвестный тег {value!r}, доступны: {', '.join(CATEGORIES)}")
+        if tag not in tags:
+            tags.append(tag)
+    if not code.strip():
+        raise ValueError("нет кода")
+    if len(code) > MAX_CODE_LENGTH:
+        raise ValueError(f"код длиннее {MAX_CODE_LENGTH} символов")
+    return {'name': name, 'language': language, 'tags': tags, 'code': code, 'language_detected': not language_value}
+
+def snippet_to_ndjson(name, data):
+    return json.dumps({'name': name, **data}, ensure_ascii=False) + '\n'
+
+class SharedSnippetStorage:
+    def __init__(self, data_dir=DATA_DIR, priority=None):
+        self.snippets_file = os.path.join(data_dir, SNIPPETS_FILENAME)
+        self.pending_file = os.path.join(data_dir, PENDING_SNIPPETS_FILENAME)
+        self.snippets = {}
+        self.pending_snippets = {}
+        self.code_blobs = CodeBlobStore(os.path.join(data_dir, CODE_BLOBS_FILENAME))
+        self._snippets_saver = CoalescingSaver(self.snippets_file, SnippetRecord, lambda: self.snippets)
+        self._pending_saver = CoalescingSaver(self.pending_file, PendingSnippetRecord,
+                                              lambda: self.pending_snippets, backup=True)
+        self._name_index = None
+        self._name_index_source = None
+        self._popularity = None
+        self.priority = priority
+        self._moderation_queue = None
+        self._moderation_queue_source = None
+        self._generation_base = None
+        self._generation_source = None
+        self._changes = 0
+
+    async def initialize(self):
+        await self.code_blobs.load_dictionaries()
+        await self.load_snippets()
+        await self.load_pending_snippets()
+        # Индекс и рейтинг строятся при старте, чтобы их не ждал первый inline-запрос
+        self._build_name_index()
+        self._popularity = self._rank_by_popularity(list(self.snippets.items()))
+
+    async def load_snippets(self):
+        if os.path.exists(self.snippets_file):
+            snapshot = await read_snapshot(self.snippets_file, SnippetRecord, blob_store=self.code_blobs)
+            if snapshot is not None:
+                self.snippets = snapshot
+                logger.info(f"Загружено {len(self.snippets)} сниппетов из снимка")
+                return
+            try:
+                async with aiofiles.open(self.snippets_file, 'r', encoding='utf-8') as f:
+                    self.snippets = {name: SnippetRecord.from_dict(data, self.code_blobs)
+                                     for name, data in json.loads(await f.read()).items()}
+            except (json.JSONDecodeError, IOError) as e:
+                logger.error(f"Ошибка при загрузке сниппетов: {e}")
+                self.snippets = {}
+            if await self._move_code_to_blobs(self.snippets):
+                await self.save_snippets()
+
+    async def _move_code_to_blobs(self, records):
+        # Миграция старых форматов: код внутри JSON или несжатый блок переносится
+        # в файл блоков в сжатом виде
+        legacy = [record for record in records.values()
+                  if record.code is not _UNSET or (record.code_ref is not _UNSET and len(record.code_ref) == 2)]
+        if not legacy:
+            return False
+        codes = [record['code'] for record in legacy]
+        if not self.code_blobs.current_dict_id:
+            await self.code_blobs.train(codes[:CODE_DICT_SAMPLE_SIZE])
+        refs = await self.code_blobs.append_many(codes)
+        for record, ref in zip(legacy, refs):
+            record.code_ref = ref
+            record.code = _UNSET
+        logger.info(f"Перенесено {len(legacy)} тел сниппетов в {self.code_blobs.path}: {self.code_blobs.report()}")
+        return True
+
+    async def retrain_code_dictionary(self, context=None):
+        blobs = self.code_blobs
+        if blobs.current_dict_id and blobs.appended_since_training < CODE_DICT_RETRAIN_MIN_NEW:
+            logger.info(f"Сжатие кода: {blobs.report()}")
+            return
+        # Большие тела в выборку не берём: словарь учится на типичных сниппетах
+        records = [record for records in (self.snippets, self.pending_snippets) for record in records.values()
+                   if 'code_size' not in record]
+        if not records:
+            return
+        sample = random.sample(records, min(len(records), CODE_DICT_SAMPLE_SIZE))
+        await blobs.train([record['code'] for record in sample])
+        logger.info(f"Сжатие кода: {blobs.report()}")
+
+    async def load_pending_snippets(self):
+        if not os.path.exists(self.pending_file):
+            logger.info(f"Файл {self.pending_file} не найден, создаём пустой")
+            self.pending_snippets = {}
+            try:
+                await self.save_pending_snippets()
+            except Exception as e:
+                logger.error(f"Ошибка при создании {self.pending_file}: {e}", exc_info=True)
+            return
+        snapshot = await read_snapshot(self.pending_file, PendingSnippetRecord, blob_store=self.code_blobs)
+        if snapshot is not None:
+            self.pending_snippets = snapshot
+            logger.info(f"Загружено {len(self.pending_snippets)} ожидающих сниппетов из снимка")
+            return
+        try:
+            async with aiofiles.open(self.pending_file, 'r', encoding='utf-8') as f:
+                content = await f.read()
+                if content.strip():
+                    self.pending_snippets = self._pending_from_json(json.loads(content))
+                    logger.info(f"Загружено {len(self.pending_snippets)} ожидающих сниппетов")
+                    if await self._move_code_to_blobs(self.pending_snippets):
+                        await self.save_pending_snippets()
+                else:
+                    logger.warning(f"Файл {self.pending_file} пуст, инициализируем пустым")
+                    self.pending_snippets = {}
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"Ошибка при загрузке ожидающих сниппетов: {e}", exc_info=True)
+            backup_file = f"{self.pending_file}.bak"
+            if os.path.exists(backup_file):
+                logger.info(f"Попытка восстановления из резервной копии {backup_file}")
+                try:
+                    async with aiofiles.open(backup_file, 'r', encoding='utf-8') as f:
+                        self.pending_snippets = self._pending_from_json(json.loads(await f.read()))
+                        await self._move_code_to_blobs(self.pending_snippets)
+                        await self.save_pending_snippets()
+                        logger.info("Ожидающие сниппеты восстановлены из резервной копии")
+                except Exception as e:
+                    logger.error(f"Ошибка восстановления ожидающих сниппетов: {e}", exc_info=True)
+                    self.pending_snippets = {}
+            else:
+                self.pending_snippets = {}
+
+    def _pending_from_json(self, data):
+        return {name: PendingSnippetRecord.from_dict(snippet, self.code_blobs) for name, snippet in data.items()}
+
+    async def save_pending_snippets(self):
+        try:
+            await self._pending_saver.save()
+            logger.info(f"Сохранено {len(self.pending_snippets)} ожидающих сниппетов")
+        except (IOError, OSError) as e:
+            logger.error(f"Ошибка при сохранении ожидающих сниппетов: {e}", exc_info=True)
+            raise
+
+    async def save_snippets(self):
+        try:
+            await self._snippets_saver.save()
+        except IOError as e:
+            logger.error(f"Ошибка при сохранении сниппетов: {e}")
+
+    async def add_snippet(self, name, code, language, author, tags=None, code_ref=None, extra=None):
+        if name not in self.snippets:
+            if code_ref is None:
+                code_ref = await self.code_blobs.append(code)
+                if name in self.snippets:
+                    return False
+            self.snippets[name] = SnippetRecord({
+                'language': language,
+                'author': author,
+                'uses': 0,
+                'tags': tags or [],
+                'created_date': datetime.now().isoformat(),
+                'code_ref': code_ref,
+                **(extra or {})
+            }, self.code_blobs)
+            self._update_index(name, added=True)
+            await self.save_snippets()
+            return True
+        return False
+
+    async def add_pending_snippet(self, name, code, language, author, author_id, tags=None):
+        if len(name) > MAX_NAME_LENGTH or len(code) > MAX_CODE_LENGTH:
+            return False
+        if name not in self.pending_snippets:
+            code_ref = await self.code_blobs.append(code)
+            if name in self.pending_snippets:
+                return False
+            self.pending_snippets[name] = PendingSnippetRecord({
+                'language': language,
+                'author': author,
+                'tags': tags or [],
+                'created_date': datetime.now().isoformat(),
+                'user_id': str(author_id),
+                'code_ref': code_ref
+            }, self.code_blobs)
+            self._update_queue(name, added=True)
+            await self.save_pending_snippets()
+            return True
+        return False
+
+    async def add_pending_file(self, name, path, language, author, author_id, tags=None, file_id=None, file_name=None):
+        # Большой сниппет из загруженного файла: файл читается кусками и сразу сжимается в файл блоков,
+        # признаки риска ищутся по тем же кускам. ValueError — файл не подходит, False — имя занято
+        if len(name) > MAX_NAME_LENGTH or name in self.pending_snippets:
+            return False
+        size = os.path.getsize(path)
+        if not size:
+            raise ValueError("файл пустой")
+        if size > LARGE_CODE_MAX_BYTES:
+            raise ValueError(f"файл больше {LARGE_CODE_MAX_BYTES // 1024} КБ")
+        risks = set()
+
+        async def chunks():
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            tail = ''
+            async with aiofiles.open(path, 'rb') as f:
+                while chunk := await f.read(CODE_STREAM_CHUNK):
+                    try:
+                        text = decoder.decode(chunk)
+                    except UnicodeDecodeError:
+                        raise ValueError("файл не в кодировке UTF-8") from None
+                    # Хвост прошлого куска — чтобы не пропустить признак на границе
+                    risks.update(risk_flags(tail + text))
+                    tail = text[-200:]
+                    yield chunk
+            try:
+                decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                raise ValueError("файл не в кодировке UTF-8") from None
+
+        code_ref, code_size = await self.code_blobs.append_stream(chunks())
+        if name in self.pending_snippets:
+            return False
+        record = PendingSnippetRecord({
+            'language': language,
+            'author': author,
+            'tags': tags or [],
+            'created_date': datetime.now().isoformat(),
+            'user_id': str(author_id),
+            'code_ref': code_ref,
+            'code_size': code_size,
+            'risk_flags': [label for label, _ in RISK_PATTERNS if label in risks]
+        }, self.code_blobs)
+        # Исходный документ автора отдаётся дальше по file_id — без повторной загрузки в Telegram
+        if file_id:
+            record['file_id'] = file_id
+        if file_name:
+            record['file_name'] = file_name
+        self.pending_snippets[name] = record
+        self._update_queue(name, added=True)
+        await self.save_pending_snippets()
+        return True
+
+    def code_bytes(self, record):
+        return b''.join(self.code_blobs.iter_bytes(*record['code_ref']))
+
+    def code_preview(self, record, limit):
+        # Начало большого сниппета без распаковки всего блока
+        data = b''.join(self.code_blobs.iter_bytes(*record['code_ref'], limit=limit * 4))
+        return data.decode('utf-8', errors='ignore')[:limit]
+
+    async def remember_file_id(self, name, file_id):
+        # file_id первой отправки файлом: следующие отправки идут без загрузки
+        if name in self.snippets:
+            self.snippets[name]['file_id'] = file_id
+            await self.save_snippets()
+        elif name in self.pending_snippets:
+            self.pending_snippets[name]['file_id'] = file_id
+            await self.save_pending_snippets()
+
+    async def approve_snippet(self, name):
+        if name in self.pending_snippets:
+            snippet = self.pending_snippets[name]
+            success = await self.add_snippet(name, None, snippet['language'], snippet['author'], snippet['tags'],
+                                             code_ref=snippet['code_ref'], extra=large_code_fields(snippet))
+            if success:
+                del self.pending_snippets[name]
+                self._update_queue(name, added=False)
+                await self.save_pending_snippets()
+                return True
+        return False
+
+    async def reject_snippet(self, name):
+        if name in self.pending_snippets:
+            del self.pending_snippets[name]
+            self._update_queue(name, added=False)
+            await self.save_pending_snippets()
+            return True
+        return False
+
+    async def approve_many(self, names):
+        # Пакетное одобрение: одно сохранение библиотеки и одно — очереди модерации.
+        # Возвращает {имя: запись из очереди} для одобренных сниппетов
+        approved = {}
+        created_date = datetime.now().isoformat()
+        for name in names:
+            snippet = self.pending_snippets.get(name)
+            if snippet is None or name in self.snippets:
+                continue
+            self.snippets[name] = SnippetRecord({
+                'language': snippet['language'],
+                'author': snippet['author'],
+                'uses': 0,
+                'tags': snippet['tags'],
+                'created_date': created_date,
+                'code_ref': snippet['code_ref'],
+                **large_code_fields(snippet)
+            }, self.code_blobs)
+            self._update_index(name, added=True)
+            approved[name] = self.pending_snippets.pop(name)
+            self._update_queue(name, added=False)
+        if approved:
+            await asyncio.gather(self.save_snippets(), self.save_pending_snippets())
+        return approved
+
+    async def reject_many(self, names):
+        rejected = {name: self.pending_snippets.pop(name) for name in names if name in self.pending_snippets}
+        for name in rejected:
+            self._update_queue(name, added=False)
+        if rejected:
+            await self.save_pending_snippets()
+        return rejected
+
+    async def get_snippet(self, name):
+        if name in self.snippets:
+            self.snippets[name]['uses'] += 1
+            await self.save_snippets()
+            return self.snippets[name]
+        return None
+
+    async def delete_snippet(self, name):
+        if name in self.snippets:
+            del self.snippets[name]
+            self._update_index(name, added=False)
+            await self.save_snippets()
+            return True
+        return False
+
+    async def import_snippets(self, lines, pending=True, user_id=None, batch_size=IMPORT_BATCH_SIZE):
+        # NDJSON по одной записи на строку. На пакет — одна запись в файл блоков и одно сохранение JSON
+        records = self.pending_snippets if pending else self.snippets
+        report = {'imported': 0, 'duplicates': 0, 'errors': 0, 'error_lines': []}
+        batch = {}
+
+        async def flush():
+            items = list(batch.items())
+            batch.clear()
+            refs = await self.code_blobs.append_many([fields.pop('code') for _, fields in items])
+            for (name, fields), ref in zip(items, refs):
+                if name in self.snippets or name in self.pending_snippets:
+                    report['duplicates'] += 1
+                    continue
+                fields['code_ref'] = ref
+                if pending:
+                    fields.pop('uses', None)
+                    records[name] = PendingSnippetRecord(fields, self.code_blobs)
+                    self._update_queue(name, added=True)
+                else:
+                    fields.pop('user_id', None)
+                    records[name] = SnippetRecord(fields, self.code_blobs)
+                    self._update_index(name, added=True)
+                report['imported'] += 1
+            if pending:
+                await self.save_pending_snippets()
+            else:
+                await self.save_snippets()
+
+        def error(line_no, reason):
+            report['errors'] += 1
+            if len(report['error_lines']) < IMPORT_MAX_ERRORS:
+                report['error_lines'].append(f"{line_no}: {reason}")
+
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                name, fields = validate_snippet_item(json.loads(line))
+            except ValueError as e:
+                error(line_no, e)
+                continue
+            if name in batch or name in self.snippets or name in self.pending_snippets:
+                report['duplicates'] += 1
+                continue
+            if pending and 'user_id' not in fields:
+                if user_id is None:
+                    error(line_no, "нет user_id для очереди модерации")
+                    continue
+                fields['user_id'] = str(user_id)
+            batch[name] = fields
+            if len(batch) >= batch_size:
+                await flush()
+        if batch:
+            await flush()
+        logger.info(f"Импорт сниппетов ({'модерация' if pending else 'библиотека'}): {report}")
+        return report
+
+    async def export_snippets(self, path, pending=False, batch_size=IMPORT_BATCH_SIZE):
+        # Потоковая выгрузка в NDJSON: в памяти только список имён и текущий пакет строк,
+        # между пакетами цикл событий обслуживает другие апдейты
+        records = self.pending_snippets if pending else self.snippets
+        names = list(records)
+        count = 0
+        async with aiofiles.open(path, 'w', encoding='utf-8') as f:
+            for start in range(0, len(names), batch_size):
+                lines = []
+                for name in names[start:start + batch_size]:
+                    record = records.get(name)
+                    if record is not None:  # мог быть удалён, пока шла выгрузка
+                        lines.append(snippet_to_ndjson(name, record.to_dict()))
+                await f.write(''.join(lines))
+                count += len(lines)
+        return count
+
+    def _build_name_index(self):
+        self._name_index = NamePrefixIndex(self.snippets)
+        self._name_index_source = self.snippets
+
+    @property
+    def name_index(self):
+        # Пересобирается, если словарь сниппетов подменили целиком
+        if self._name_index_source is not self.snippets:
+            self._build_name_index()
+        return self._name_index
+
+    def resolve_snippet_id(self, snippet_id):
+        # Имя сниппета библиотеки по id из кнопки — когда карта id в сессии уже очищена
+        return self.name_index.resolve(snippet_id)
+
+    @property
+    def generation(self):
+        # Поколение библиотеки: меняется при любом добавлении или удалении сниппета.
+        # База — отпечаток состава библиотеки при загрузке: если между запусками сниппеты
+        # не добавлялись и не удалялись, поколение то же и кэши, привязанные к нему, в силе
+        if self._generation_source is not self.snippets:
+            digest = hashlib.blake2b(digest_size=8)
+            for name, record in self.snippets.items():
+                digest.update(f"{name}\0{record.get('code_ref')}\0{record['language']}\0"
+                              f"{','.join(record.get('tags', []))}\n".encode('utf-8'))
+            self._generation_base = digest.hexdigest()
+            self._generation_source = self.snippets
+            self._changes = 0
+        return f"{self._generation_base}-{self._changes}"
+
+    def _update_index(self, name, added):
+        self._changes += 1
+        if self._name_index_source is self.snippets:
+            if added:
+                self._name_index.add(name)
+            else:
+                self._name_index.remove(name)
+
+    def rebuild_moderation_queue(self):
+        self._moderation_queue = ModerationQueue(self.pending_snippets, self.priority)
+        self._moderation_queue_source = self.pending_snippets
+
+    @property
+    def moderation_queue(self):
+        # Как и индекс имён, пересобирается, если очередь подменили целиком
+        if self._moderation_queue_source is not self.pending_snippets:
+            self.rebuild_moderation_queue()
+        return self._moderation_queue
+
+    def _update_queue(self, name, added):
+        if self._moderation_queue_source is self.pending_snippets:
+            if added:
+                self._moderation_queue.add(name, self.pending_snippets[name])
+            else:
+                self._moderation_queue.remove(name)
+
+    @staticmethod
+    def _rank_by_popularity(items):
+        return [name for name, _ in sorted(items, key=lambda item: item[1].get('uses', 0), reverse=True)]
+
+    async def refresh_popularity(self, context=None):
+        # Сортировка всей библиотеки в пуле потоков; в цикле событий — только копия списка пар
+        items = list(self.snippets.items())
+        self._popularity = await asyncio.get_running_loop().run_in_executor(None, self._rank_by_popularity, items)
+
+    def prefix_search(self, query, limit):
+        # Самые просматриваемые сниппеты, в имени которых есть слово, начинающееся с query.
+        # При m совпадениях из n точная сортировка стоит ~m, а обход рейтинга популярности
+        # до limit подходящих — ~limit·n/m; рейтинг может отставать на интервал обновления
+        query = query.strip()
+        index = self.name_index
+        matches = index.count(query)
+        if self._popularity is not None and matches * matches > limit * len(self.snippets):
+            result = []
+            for name in self._popularity:
+                if name in self.snippets and index.matches(name, query):
+                    result.append(name)
+                    if len(result) == limit:
+                        return result
+        names = index.search(query)
+        return heapq.nlargest(limit, names, key=lambda name: self.snippets[name].get('uses', 0))
+
+    def prefix_search_page(self, query, offset, page_size, limit):
+        # Страница результатов inline-запроса и next_offset для Telegram ('' — страниц больше нет)
+        names = self.prefix_search(query, limit)
+        page = names[offset:offset + page_size]
+        end = offset + len(page)
+        return page, str(end) if end < len(names) else ''
+
+    def search_snippets(self, query):
+        return {name: data for name, data in self.snippets.items() if query.lower() in name.lower()}
+
+    def filter_by_language(self, language):
+        return {name: data for name, data in self.snippets.items() if data['language'] == language}
+
+    def filter_by_tag(self, tag):
+        return {name: data for name, data in self.snippets.items() if tag in data.get('tags', [])}
+
+    def get_user_snippets_stats(self, author):
+        user_snippets = [data for data in self.snippets.values() if data['author'] == author]
+        total_snippets = len(user_snippets)
+        total_uses = sum(snippet['uses'] for snippet in user_snippets)
+        return total_snippets, total_uses
+
+def _archive_entry_path(name, language, used):
+    # Путь внутри архива: {язык}/{имя}.{расширение}, при совпадении имён — с номером
+    stem = re.sub(r'[^\w\-. ]+', '_', name).strip(' ._')[:80] or 'snippet'
+    extension = LANGUAGE_EXTENSIONS.get(language, 'txt')
+    path = f"{language or 'other'}/{stem}.{extension}"
+    number = 2
+    while path in used:
+        path = f"{language or 'other'}/{stem} ({number}).{extension}"
+        number += 1
+    used.add(path)
+    return path
+
+def build_library_archive(blobs, items, path, previous=None):
+    # Выполняется в пуле потоков. items — [(имя, язык, ссылка на блок или код)].
+    # Каждый файл архива пишется по мере распаковки его блока; в комментарии записи — имя
+    # и ссылка сниппета. Если с прошлой сборки сниппеты только добавлялись, копия прошлого
+    # архива дописывается новыми записями вместо пересжатия всей библиотеки.
+    # Возвращает (число записей, дописано ли к прошлому архиву)
+    wanted = {name: (language, source) for name, language, source in items}
+    tmp_path = f"{path}.tmp"
+    appended = False
+    done = set()
+    used = set()
+    if previous and os.path.exists(previous):
+        try:
+            with zipfile.ZipFile(previous) as old:
+                entries = [(info.filename, json.loads(info.comment or b'{}')) for info in old.infolist()]
+            if all(meta.get('name') in wanted and isinstance(wanted[meta['name']][1], tuple)
+                   and list(wanted[meta['name']][1]) == meta.get('ref') for _, meta in entries):
+                shutil.copyfile(previous, tmp_path)
+                used = {filename for filename, _ in entries}
+                done = {meta['name'] for _, meta in entries}
+                appended = True
+        except (zipfile.BadZipFile, ValueError, OSError) as e:
+            logger.warning(f"Прошлый архив {previous} не подходит для дописывания: {e}")
+    with open(blobs.path, 'rb') as code_file, \
+            zipfile.ZipFile(tmp_path, 'a' if appended else 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, (language, source) in wanted.items():
+            if name in done:
+                continue
+            if isinstance(source, tuple):
+                data = blobs.read_detached(code_file, *source)
+                meta = {'name': name, 'ref': list(source)}
+            else:
+                data = source.encode('utf-8')
+                meta = {'name': name}
+            info = zipfile.ZipInfo(_archive_entry_path(name, language, used), time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.comment = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+            archive.writestr(info, data)
+    os.replace(tmp_path, path)
+    return len(wanted), appended
+
+class LibraryArchiveCache:
+    # Архивы библиотеки целиком, по языку или тегу. Собранный архив и file_id его первой
+    # отправки привязаны к поколению библиотеки: пока сниппеты не добавлялись и не удалялись,
+    # повторный запрос отдаёт готовый файл без сборки и загрузки
+    def __init__(self, storage, cache_dir):
+        self.storage = storage
+        self.cache_dir = cache_dir
+        self.index_file = os.path.join(cache_dir, ARCHIVE_INDEX_FILENAME)
+        self.index = {}
+        self._locks = {}
+
+    async def initialize(self):
+        if os.path.exists(self.index_file):
+            try:
+                async with aiofiles.open(self.index_file, 'r', encoding='utf-8') as f:
+                    self.index = json.loads(await f.read())
+            except (json.JSONDecodeError, IOError) as e:
+                logger.error(f"Ошибка при загрузке индекса архивов: {e}")
+                self.index = {}
+
+    async def save_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            async with aiofiles.open(f"{self.index_file}.tmp", 'w', encoding='utf-8') as f:
+                await f.write(json.dumps(self.index, indent=2, ensure_ascii=False))
+            os.replace(f"{self.index_file}.tmp", self.index_file)
+        except IOError as e:
+            logger.error(f"Ошибка при сохранении индекса архивов: {e}")
+
+    @staticmethod
+    def key(language=None, tag=None):
+        if language:
+            return f"language:{language}"
+        if tag:
+            return f"tag:{tag}"
+        return "all"
+
+    def _select(self, language, tag):
+        if language:
+            return self.storage.filter_by_language(language)
+        if tag:
+            return self.storage.filter_by_tag(tag)
+        return self.storage.snippets
+
+    def _fresh(self, key):
+        entry = self.index.get(key)
+        if entry and entry['generation'] == self.storage.generation and os.path.exists(entry['path']):
+            return entry
+        return None
+
+    async def _build(self, key, language, tag):
+        records = self._select(language, tag)
+        if not records:
+            return None
+        generation = self.storage.generation
+        previous = self.index.get(key)
+        # Снимок ссылок берётся в цикле событий, сборка идёт в потоке по этому снимку
+        items = [(name, record['language'],
+                  tuple(record['code_ref']) if record.get('code_ref') is not None else record['code'])
+                 for name, record in records.items()]
+        path = os.path.join(self.cache_dir, re.sub(r'[^\w\-]+', '_', key) + '.zip')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        started = time.perf_counter()
+        count, appended = await asyncio.get_running_loop().run_in_executor(
+            None, build_library_archive, self.storage.code_blobs, items, path, previous and previous['path']
+        )
+        entry = {'generation': generation, 'path': path, 'count': count,
+                 'size': os.path.getsize(path), 'file_id': None}
+        self.index[key] = entry
+        await self.save_index()
+        logger.info(f"Архив {key}: {count} сниппетов, {entry['size']} байт, "
+                    f"{'дописан' if appended else 'собран'} за {time.perf_counter() - started:.2f} с")
+        return entry
+
+    async def deliver(self, send, language=None, tag=None):
+        # send(entry) отправляет архив — по entry['file_id'], если он есть, иначе файлом —
+        # и возвращает file_id отправленного документа. Сборка и первая загрузка идут под
+        # блокировкой ключа: одновременные запросы ждут их и получают уже готовый file_id.
+        # Возвращает запись индекса {generation, path, count, size, file_id}; пустая выборка — None
+        key = self.key(language, tag)
+        entry = self._fresh(key)
+        if entry is not None and entry['file_id']:
+            return await self._send(entry, send)
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            entry = self._fresh(key) or await self._build(key, language, tag)
+            if entry is None:
+                return None
+            return await self._send(entry, send)
+
+    async def _send(self, entry, send):
+        file_id = await send(entry)
+        if file_id and file_id != entry['file_id']:
+            entry['file_id'] = file_id
+            await self.save_index()
+        return entry
+
+class SnippetEngine:
+    # Точка входа для бота, бенчмарков и офлайн-инструментов
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.storage = SharedSnippetStorage(data_dir, ModerationPriority(level_of=self._author_level))
+        self.admins = AdminManager(data_dir)
+        self.users = UserManager(self.storage, self.admins, data_dir)
+        self.archives = LibraryArchiveCache(self.storage, os.path.join(data_dir, ARCHIVES_DIRNAME))
+
+    def _author_level(self, user_id):
+        user = self.users.users.get(str(user_id))
+        return user['level'] if user is not None else 0
+
+    async def initialize(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        await asyncio.gather(
+            self.storage.initialize(),
+            self.users.initialize(),
+            self.admins.initialize(),
+            self.archives.initialize()
+        )
+        # Приоритет зависит от уровня автора — очередь строится, когда пользователи уже загружены
+        self.storage.rebuild_moderation_queue()
+
+    def close(self):
+        self.storage.code_blobs.close()
+
+    def library_stats(self):
+        # Агрегаты для экрана статистики: по языкам, тегам и топ-3 авторов по просмотрам
+        total_uses = 0
+        lang_stats = {}
+        tag_stats = {}
+        author_stats = {}
+        for snippet in self.storage.snippets.values():
+            uses = snippet.get('uses', 0)
+            total_uses += uses
+            lang = lang_stats.setdefault(snippet.get('language'), {'snippets': 0, 'uses': 0})
+            lang['snippets'] += 1
+            lang['uses'] += uses
+            for tag in snippet.get('tags', []):
+                tag_stats[tag] = tag_stats.get(tag, 0) + 1
+            author = author_stats.setdefault(snippet['author'], {'snippets': 0, 'uses': 0})
+            author['snippets'] += 1
+            author['uses'] += uses
+        return {
+            'total_snippets': len(self.storage.snippets),
+            'pending_snippets': len(self.storage.pending_snippets),
+            'total_uses': total_uses,
+            'total_users': len(self.users.users),
+            'languages': lang_stats,
+            'tags': tag_stats,
+            'top_authors': sorted(author_stats.items(), key=lambda x: x[1]['uses'], reverse=True)[:3],
+        }
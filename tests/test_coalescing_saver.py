@@ -0,0 +1,97 @@
+import asyncio
+import threading
+
+import pytest
+
+import snippet_engine as se
+from snippet_engine import CoalescingSaver, SnippetRecord
+
+
+def record(uses=0):
+    return SnippetRecord({'code': "body {}", 'language': 'CSS', 'author': 'anna', 'uses': uses,
+                          'tags': [], 'created_date': "2025-05-01T10:00:00"})
+
+
+@pytest.fixture
+def gate():
+    return threading.Event()
+
+
+@pytest.fixture
+def writes(monkeypatch, gate):
+    # Подмена записи на диск: первая запись ждёт gate, чтобы остальные сохранения пришли во время неё
+    writes = []
+
+    def write_data_file(json_path, record_cls, frozen, backup=False):
+        keys, _ = frozen
+        writes.append(keys)
+        if len(writes) == 1:
+            gate.wait(5)
+        if keys == ['fail']:
+            raise OSError("диск заполнен")
+        return len(writes)
+
+    monkeypatch.setattr(se, 'write_data_file', write_data_file)
+    return writes
+
+
+async def started(writes, count):
+    while len(writes) < count:
+        await asyncio.sleep(0.001)
+
+
+def test_saves_during_write_are_coalesced(writes, gate, tmp_path):
+    async def main():
+        records = {'a': record()}
+        saver = CoalescingSaver(str(tmp_path / 'snippets.json'), SnippetRecord, lambda: records)
+        first = asyncio.ensure_future(saver.save())
+        await started(writes, 1)
+        records['b'] = record()
+        queued = [asyncio.ensure_future(saver.save()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        records['c'] = record()  # попадёт в следующую запись: копия снимается при её старте
+        gate.set()
+        return await asyncio.gather(first, *queued)
+
+    assert asyncio.run(main()) == [1, 2, 2, 2]
+    assert writes == [['a'], ['a', 'b', 'c']]
+
+
+def test_idle_saver_writes_immediately(writes, gate, tmp_path):
+    gate.set()
+
+    async def main():
+        records = {'a': record()}
+        saver = CoalescingSaver(str(tmp_path / 'snippets.json'), SnippetRecord, lambda: records)
+        await saver.save()
+        del records['a']
+        await saver.save()
+
+    asyncio.run(main())
+    assert writes == [['a'], []]
+
+
+def test_error_reaches_waiters_and_next_save_runs(writes, gate, tmp_path):
+    gate.set()
+
+    async def main():
+        records = {'fail': record()}
+        saver = CoalescingSaver(str(tmp_path / 'snippets.json'), SnippetRecord, lambda: records)
+        with pytest.raises(OSError, match="диск заполнен"):
+            await saver.save()
+        records.clear()
+        records['ok'] = record()
+        return await saver.save()
+
+    assert asyncio.run(main()) == 2
+    assert writes == [['fail'], ['ok']]
+
+
+def test_real_write_produces_json(tmp_path):
+    async def main():
+        records = {'a': record(uses=5)}
+        saver = CoalescingSaver(str(tmp_path / 'snippets.json'), SnippetRecord, lambda: records)
+        await asyncio.gather(*(saver.save() for _ in range(5)))
+
+    asyncio.run(main())
+    assert '"uses": 5' in (tmp_path / 'snippets.json').read_text(encoding='utf-8')
@@ -0,0 +1,56 @@
+import pytest
+
+from snippet_engine import DETECT_SAMPLE_LENGTH, detect_language, language_scores, validate_snippet_item
+
+
+@pytest.mark.parametrize("language, code", [
+    ('PHP', "<?php echo 'Привет'; ?>"),
+    ('PHP', "$items = array(1, 2, 3);\nforeach ($items as $item) {\n    echo $item;\n}"),
+    ('PHP', "add_action('init', function () {\n    register_post_type('book');\n});"),
+    ('JavaScript', "const sum = (a, b) => a + b;"),
+    ('JavaScript', "document.querySelector('.btn').addEventListener('click', toggle);"),
+    ('JavaScript', "$('.btn').on('click', function () {\n    $(this).toggleClass('active');\n});"),
+    ('CSS', "body { margin: 0; padding: 0; }"),
+    ('CSS', "@media (max-width: 600px) {\n    .menu { display: none; }\n}"),
+    ('HTML', "<div class=\"card\"><p>Текст</p></div>"),
+    ('HTML', "<!DOCTYPE html>\n<html>\n<body></body>\n</html>"),
+])
+def test_detects_language(language, code):
+    assert detect_language(code) == language
+
+
+@pytest.mark.parametrize("code", ["", "   \n", "просто текст", "x = 1", "foo(bar)"])
+def test_low_evidence_returns_none(code):
+    assert detect_language(code) is None
+
+
+def test_min_score_threshold():
+    code = "let total = 0;"
+    best = max(language_scores(code).values())
+    assert detect_language(code, min_score=best) == 'JavaScript'
+    assert detect_language(code, min_score=best + 1) is None
+
+
+def test_only_sample_prefix_is_scored():
+    # Признаки за пределами DETECT_SAMPLE_LENGTH не учитываются
+    code = " " * DETECT_SAMPLE_LENGTH + "<?php echo 1; ?>"
+    assert detect_language(code) is None
+
+
+def test_php_with_embedded_html_stays_php():
+    code = "<?php if ($_POST['login']) { echo 'ok'; } ?>\n<form method=\"POST\"><input name=\"login\"></form>"
+    assert detect_language(code) == 'PHP'
+
+
+def test_import_detects_missing_and_unknown_language():
+    for language in (None, 'Другой'):
+        item = {'name': 'x', 'code': "console.log(window.location);", 'author': 'a'}
+        if language:
+            item['language'] = language
+        _, fields = validate_snippet_item(item)
+        assert fields['language'] == 'JavaScript'
+
+
+def test_import_rejects_undetectable_code():
+    with pytest.raises(ValueError):
+        validate_snippet_item({'name': 'x', 'code': "просто текст", 'author': 'a'})
@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import pytest
+
+from snippet_engine import IMPORT_MAX_ERRORS, MAX_NAME_LENGTH, SharedSnippetStorage, validate_snippet_item
+
+
+def item(name, **fields):
+    return {'name': name, 'code': "<?php echo 1;", 'language': 'PHP', 'author': 'ivan',
+            'created_date': "2025-05-01T10:00:00", **fields}
+
+
+def lines(*items):
+    return [json.dumps(entry, ensure_ascii=False) for entry in items]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SharedSnippetStorage(str(tmp_path))
+    yield storage
+    storage.code_blobs.close()
+
+
+@pytest.mark.parametrize('entry, reason', [
+    ([1, 2], "ожидается JSON-объект"),
+    (item(' '), "нет имени"),
+    (item('x' * (MAX_NAME_LENGTH + 1)), "имя длиннее"),
+    (item('a', code=''), "нет кода"),
+    (item('a', language='Другой', code="просто текст"), "неизвестный язык"),
+    (item('a', author=''), "нет автора"),
+    (item('a', tags=['Drupal']), "неизвестные теги"),
+    (item('a', uses=-1), "uses"),
+])
+def test_validate_rejects(entry, reason):
+    with pytest.raises(ValueError, match=reason):
+        validate_snippet_item(entry)
+
+
+def test_validate_detects_language_and_normalizes_user_id():
+    name, fields = validate_snippet_item(item('a', language=None, code="<?php echo 1;", user_id=42))
+    assert name == 'a'
+    assert fields['language'] == 'PHP' and fields['user_id'] == '42' and fields['uses'] == 0
+
+
+def test_import_into_library_in_batches(storage, monkeypatch):
+    calls = []
+    append_many = storage.code_blobs.append_many
+
+    async def counting_append_many(codes):
+        calls.append(len(codes))
+        return await append_many(codes)
+
+    monkeypatch.setattr(storage.code_blobs, 'append_many', counting_append_many)
+    source = lines(*(item(f"s{n}", code=f"<?php echo {n};", uses=n, user_id=1) for n in range(5)))
+    report = asyncio.run(storage.import_snippets(source, pending=False, batch_size=2))
+    assert report == {'imported': 5, 'duplicates': 0, 'errors': 0, 'error_lines': []}
+    assert calls == [2, 2, 1]
+    assert storage.snippets['s3']['code'] == "<?php echo 3;"
+    assert storage.snippets['s3']['uses'] == 3 and 'user_id' not in storage.snippets['s3']
+    assert storage.prefix_search('s4', 5) == ['s4']
+
+
+def test_import_reports_duplicates_and_errors(storage):
+    asyncio.run(storage.import_snippets(lines(item('old')), pending=False))
+    source = ['', 'не json', *lines(item('old'), item('new'), item('new'), item('bad', tags='WordPress'))]
+    report = asyncio.run(storage.import_snippets(source, pending=False))
+    assert report['imported'] == 1 and report['duplicates'] == 2 and report['errors'] == 2
+    assert [line.split(':')[0] for line in report['error_lines']] == ['2', '6']
+    assert sorted(storage.snippets) == ['new', 'old']
+
+
+def test_error_lines_are_capped(storage):
+    report = asyncio.run(storage.import_snippets(['[]'] * (IMPORT_MAX_ERRORS + 5), pending=False))
+    assert report['errors'] == IMPORT_MAX_ERRORS + 5
+    assert len(report['error_lines']) == IMPORT_MAX_ERRORS
+
+
+def test_import_into_moderation_needs_user_id(storage):
+    source = lines(item('with owner', user_id=7, uses=9), item('no owner'))
+    report = asyncio.run(storage.import_snippets(source))
+    assert report['imported'] == 1 and report['errors'] == 1
+    record = storage.pending_snippets['with owner']
+    assert record['user_id'] == '7' and 'uses' not in record
+    assert storage.moderation_queue.page(0, 5) == ['with owner']
+    report = asyncio.run(storage.import_snippets(lines(item('no owner')), user_id=3))
+    assert report['imported'] == 1 and storage.pending_snippets['no owner']['user_id'] == '3'
+
+
+def test_import_then_export_round_trip(storage, tmp_path):
+    source = lines(item('a', tags=['WordPress'], uses=2), item('b', code="body { color: red; }", language='CSS'))
+    asyncio.run(storage.import_snippets(source, pending=False))
+    path = tmp_path / 'export.ndjson'
+    assert asyncio.run(storage.export_snippets(str(path), batch_size=1)) == 2
+    exported = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert exported == [{**item('a', tags=['WordPress'], uses=2)},
+                        {**item('b', code="body { color: red; }", language='CSS'), 'uses': 0, 'tags': []}]
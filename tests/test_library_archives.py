@@ -0,0 +1,134 @@
+import asyncio
+import zipfile
+
+import pytest
+
+import snippet_engine as se
+from snippet_engine import SnippetEngine
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    builds = []
+    build_library_archive = se.build_library_archive
+
+    def counting_build(blobs, items, path, previous=None):
+        result = build_library_archive(blobs, items, path, previous)
+        builds.append(result)
+        return result
+
+    monkeypatch.setattr(se, 'build_library_archive', counting_build)
+    return builds
+
+
+class Sender:
+    # Имитация отправки документа: новый file_id при загрузке файла, тот же — при пересылке по file_id
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, entry):
+        self.sent.append(entry['file_id'])
+        return entry['file_id'] or f"file-{len(self.sent)}"
+
+
+async def make_engine(data_dir):
+    engine = SnippetEngine(str(data_dir))
+    await engine.initialize()
+    await engine.storage.add_snippet('Форма', "<?php echo 1;", 'PHP', 'ivan', ['WordPress'])
+    await engine.storage.add_snippet('Стили', "body {}", 'CSS', 'anna')
+    return engine
+
+
+def archive_contents(entry):
+    with zipfile.ZipFile(entry['path']) as archive:
+        return sorted(archive.read(name).decode('utf-8') for name in archive.namelist())
+
+
+def test_same_generation_reuses_archive_and_file_id(tmp_path, builds):
+    async def main():
+        engine = await make_engine(tmp_path)
+        send = Sender()
+        first = await engine.archives.deliver(send)
+        second = await engine.archives.deliver(send)
+        engine.close()
+        return first, second, send.sent
+
+    first, second, sent = asyncio.run(main())
+    assert len(builds) == 1
+    assert sent == [None, 'file-1']
+    assert second is first and first['file_id'] == 'file-1' and first['count'] == 2
+    assert archive_contents(first) == ["<?php echo 1;", "body {}"]
+
+
+def test_add_and_delete_start_new_generation(tmp_path, builds):
+    async def main():
+        engine = await make_engine(tmp_path)
+        send = Sender()
+        # Архив ключа пересобирается по тому же пути — содержимое читается сразу после отправки
+        entries = [dict(await engine.archives.deliver(send))]
+        contents = [archive_contents(entries[-1])]
+        await engine.storage.add_snippet('Слайдер', "const slider = 1;", 'JavaScript', 'ivan')
+        entries.append(dict(await engine.archives.deliver(send)))
+        contents.append(archive_contents(entries[-1]))
+        await engine.storage.delete_snippet('Форма')
+        entries.append(dict(await engine.archives.deliver(send)))
+        contents.append(archive_contents(entries[-1]))
+        engine.close()
+        return entries, contents, send.sent
+
+    entries, contents, sent = asyncio.run(main())
+    assert sent == [None, None, None]
+    assert len({entry['generation'] for entry in entries}) == 3
+    assert [appended for _, appended in builds] == [False, True, False]
+    assert contents == [["<?php echo 1;", "body {}"],
+                        ["<?php echo 1;", "body {}", "const slider = 1;"],
+                        ["body {}", "const slider = 1;"]]
+
+
+def test_filtered_archives_and_empty_selection(tmp_path, builds):
+    async def main():
+        engine = await make_engine(tmp_path)
+        send = Sender()
+        php = await engine.archives.deliver(send, language='PHP')
+        tagged = await engine.archives.deliver(send, tag='WordPress')
+        empty = await engine.archives.deliver(send, tag='Bitrix')
+        engine.close()
+        return php, tagged, empty, engine.archives.index
+
+    php, tagged, empty, index = asyncio.run(main())
+    assert php['count'] == 1 and tagged['count'] == 1 and empty is None
+    assert sorted(index) == ['language:PHP', 'tag:WordPress']
+
+
+def test_concurrent_requests_build_and_upload_once(tmp_path, builds):
+    async def main():
+        engine = await make_engine(tmp_path)
+        send = Sender()
+        entries = await asyncio.gather(*(engine.archives.deliver(send) for _ in range(5)))
+        engine.close()
+        return entries, send.sent
+
+    entries, sent = asyncio.run(main())
+    assert len(builds) == 1
+    assert sent == [None] + ['file-1'] * 4
+    assert all(entry['file_id'] == 'file-1' for entry in entries)
+
+
+def test_restart_keeps_file_id_for_unchanged_library(tmp_path, builds):
+    async def first_run():
+        engine = await make_engine(tmp_path)
+        await engine.archives.deliver(Sender())
+        engine.close()
+
+    async def second_run():
+        engine = SnippetEngine(str(tmp_path))
+        await engine.initialize()
+        send = Sender()
+        entry = await engine.archives.deliver(send)
+        engine.close()
+        return entry, send.sent
+
+    asyncio.run(first_run())
+    entry, sent = asyncio.run(second_run())
+    assert len(builds) == 1
+    assert sent == ['file-1'] and entry['file_id'] == 'file-1'
@@ -0,0 +1,86 @@
+import pytest
+
+import snippet_engine as se
+from snippet_engine import ModerationPriority, ModerationQueue
+
+
+def pending(hour, user_id='1', code="<?php echo 1;"):
+    return {'created_date': f"2025-05-01T{hour:02d}:00:00", 'user_id': user_id, 'code': code}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(se.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_oldest_first_with_level_boost_and_risk_delay():
+    records = {'old': pending(1), 'new': pending(5), 'senior': pending(6, user_id='9'),
+               'risky': pending(0, code="eval($_GET['x']);")}
+    priority = ModerationPriority(level_of=lambda user_id: 2 if user_id == '9' else 0,
+                                  level_boost=3 * 60 * 60, risk_delay=24 * 60 * 60)
+    queue = ModerationQueue(records, priority)
+    assert queue.page(0, 10) == ['senior', 'old', 'new', 'risky']
+
+
+def test_paging_follows_order_after_add_and_remove():
+    queue = ModerationQueue({f"s{hour}": pending(hour) for hour in range(0, 10, 2)}, ModerationPriority(risk_delay=0))
+    assert queue.page(0, 2) == ['s0', 's2']
+    queue.add('s3', pending(3))
+    queue.add('s-first', pending(0))  # равный ключ встаёт после уже стоящих
+    queue.remove('s2')
+    queue.remove('missing')
+    assert queue.page(0, 3) == ['s0', 's-first', 's3']
+    assert queue.page(3, 3) == ['s4', 's6', 's8']
+    assert queue.page(6, 3) == []
+    assert len(queue) == 6 and 's2' not in queue
+
+
+def test_readd_moves_to_new_position():
+    queue = ModerationQueue({'a': pending(1), 'b': pending(2)}, ModerationPriority(risk_delay=0))
+    queue.add('a', pending(3))
+    assert queue.page(0, 10) == ['b', 'a']
+    assert len(queue) == 2
+
+
+def test_resolve_by_snippet_id():
+    queue = ModerationQueue({'a': pending(1)})
+    assert queue.resolve(queue.snippet_id('a')) == 'a'
+    queue.remove('a')
+    assert queue.resolve(queue.snippet_id('a')) is None
+
+
+def test_claim_conflict_and_renewal(clock):
+    queue = ModerationQueue({'a': pending(1)}, ttl=60)
+    assert queue.claim('a', 1)
+    assert not queue.claim('a', 2)
+    assert queue.claimed_by('a') == '1'
+    clock[0] += 50
+    assert queue.claim('a', '1')  # свой захват продлевается
+    clock[0] += 50
+    assert not queue.claim('a', 2)
+    assert not queue.claim('missing', 1)
+
+
+def test_claim_expires(clock):
+    queue = ModerationQueue({'a': pending(1)}, ttl=60)
+    queue.claim('a', 1)
+    clock[0] += 60
+    assert queue.claimed_by('a') is None
+    assert queue.claim('a', 2)
+    assert queue.claimed_by('a') == '2'
+
+
+def test_release_and_remove_drop_claims(clock):
+    queue = ModerationQueue({'a': pending(1), 'b': pending(2), 'c': pending(3)}, ttl=60)
+    queue.claim('a', 1)
+    queue.claim('b', 1)
+    queue.claim('c', 2)
+    queue.release('c', 1)  # чужой захват не снимается
+    assert queue.claimed_by('c') == '2'
+    queue.release_all(1)
+    assert queue.claimed_by('a') is None and queue.claimed_by('b') is None
+    queue.remove('c')
+    queue.add('c', pending(3))
+    assert queue.claimed_by('c') is None
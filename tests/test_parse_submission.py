@@ -0,0 +1,86 @@
+import pytest
+
+from snippet_engine import MAX_CODE_LENGTH, MAX_NAME_LENGTH, parse_submission
+
+
+def test_header_and_fenced_code():
+    fields = parse_submission(
+        "name: Форма обратной связи\n"
+        "language: PHP\n"
+        "tags: WordPress, #общее\n"
+        "```php\n<?php echo 'Привет'; ?>\n```"
+    )
+    assert fields == {
+        'name': 'Форма обратной связи',
+        'language': 'PHP',
+        'tags': ['WordPress', 'Общее'],
+        'code': "<?php echo 'Привет'; ?>",
+        'language_detected': False,
+    }
+
+
+def test_russian_keys_separator_and_alias():
+    fields = parse_submission("---\nназвание: Кнопка\nязык: js\n---\nconst a = 1;")
+    assert fields['name'] == 'Кнопка'
+    assert fields['language'] == 'JavaScript'
+    assert fields['code'] == 'const a = 1;'
+
+
+def test_fence_language_used_when_header_has_none():
+    fields = parse_submission("name: Стили\n```css\nbody { margin: 0; }\n```")
+    assert fields['language'] == 'CSS'
+    assert not fields['language_detected']
+
+
+def test_header_language_wins_over_fence():
+    fields = parse_submission("name: x\nlanguage: HTML\n```js\n<div></div>\n```")
+    assert fields['language'] == 'HTML'
+
+
+def test_pre_entity_code_is_taken_as_is():
+    # Сущность pre: код и язык уже вынуты из текста, в text остался только заголовок
+    fields = parse_submission("name: Меню\n", code="$('.menu').toggle();", code_language='javascript')
+    assert fields['code'] == "$('.menu').toggle();"
+    assert fields['language'] == 'JavaScript'
+
+
+def test_text_left_next_to_pre_entity_is_rejected():
+    with pytest.raises(ValueError, match="непонятная строка"):
+        parse_submission("name: Меню\nлишний текст", code="let a = 1;", code_language='js')
+
+
+def test_code_line_that_looks_like_header_ends_header():
+    # «display: none;» похоже на «ключ: значение», но ключ не из заголовка — это уже код
+    fields = parse_submission("name: Скрыть\nlanguage: CSS\ndisplay: none;\ncolor: red;")
+    assert fields['name'] == 'Скрыть'
+    assert fields['code'] == "display: none;\ncolor: red;"
+
+
+def test_language_detected_from_code():
+    fields = parse_submission("name: Лог\n```\nconsole.log(document.title);\n```")
+    assert fields['language'] == 'JavaScript'
+    assert fields['language_detected']
+
+
+def test_duplicate_tags_are_merged():
+    assert parse_submission("name: x\nlanguage: CSS\ntags: bitrix; Bitrix\na { }")['tags'] == ['Bitrix']
+
+
+@pytest.mark.parametrize("text, reason", [
+    ("language: PHP\n<?php echo 1;", "нет названия"),
+    (f"name: {'x' * (MAX_NAME_LENGTH + 1)}\nlanguage: PHP\n<?php echo 1;", "название длиннее"),
+    ("name: x\nlanguage: Ruby\nputs 1", "неизвестный язык"),
+    ("name: x\nlanguage: PHP\ntags: Django\n<?php echo 1;", "неизвестный тег"),
+    ("name: x\nlanguage: PHP\n```php\n\n```", "нет кода"),
+    ("name: x\nlanguage: PHP\n", "нет кода"),
+    ("name: x\nпросто текст без признаков языка", "не удалось определить язык"),
+])
+def test_rejected(text, reason):
+    with pytest.raises(ValueError, match=reason):
+        parse_submission(text)
+
+
+def test_oversize_code_is_rejected():
+    code = "<?php\n" + "echo 1;\n" * (MAX_CODE_LENGTH // 8 + 1)
+    with pytest.raises(ValueError, match="код длиннее"):
+        parse_submission(f"name: x\nlanguage: PHP\n```php\n{code}\n```")
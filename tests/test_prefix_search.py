@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from snippet_engine import INDEX_KEY_LENGTH, NamePrefixIndex, SharedSnippetStorage, snippet_id
+
+
+def test_matches_start_of_any_word_case_insensitive():
+    index = NamePrefixIndex(['Форма обратной связи', 'WP: вывод записей', 'Slider'])
+    assert index.search('обр') == {'Форма обратной связи'}
+    assert index.search('ЗАП') == {'WP: вывод записей'}
+    assert index.search('wp') == {'WP: вывод записей'}
+    assert index.search('ратн') == set()  # середина слова не считается началом
+    assert index.count('с') == 1 and index.count('s') == 1
+
+
+def test_long_prefix_is_checked_beyond_key_length():
+    long_word = 'a' * INDEX_KEY_LENGTH
+    index = NamePrefixIndex([long_word + 'bc', long_word + 'xy'])
+    assert index.search(long_word + 'b') == {long_word + 'bc'}
+
+
+def test_add_remove_and_resolve():
+    index = NamePrefixIndex(['alpha beta'])
+    index.add('beta gamma')
+    assert index.search('beta') == {'alpha beta', 'beta gamma'}
+    assert index.resolve(snippet_id('beta gamma')) == 'beta gamma'
+    index.remove('alpha beta')
+    assert index.search('beta') == {'beta gamma'}
+    assert index.search('alpha') == set()
+    assert index.resolve(snippet_id('alpha beta')) is None
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SharedSnippetStorage(str(tmp_path))
+    storage.snippets = {f"form {uses}": {'uses': uses} for uses in (5, 40, 0, 12, 7)}
+    storage.snippets['slider'] = {'uses': 100}
+    yield storage
+    storage.code_blobs.close()
+
+
+def test_exact_popularity_order(storage):
+    assert storage.prefix_search('FORM', 10) == ['form 40', 'form 12', 'form 7', 'form 5', 'form 0']
+    assert storage.prefix_search(' form ', 2) == ['form 40', 'form 12']
+
+
+def test_popularity_ranking_for_frequent_prefix(storage):
+    asyncio.run(storage.refresh_popularity())
+    # совпадений много относительно limit — обход рейтинга, порядок тот же
+    assert storage.prefix_search('form', 2) == ['form 40', 'form 12']
+    del storage.snippets['form 40']
+    storage.name_index.remove('form 40')
+    assert storage.prefix_search('form', 2) == ['form 12', 'form 7']
+
+
+def test_page_next_offset(storage):
+    pages, offset = [], 0
+    while True:
+        page, next_offset = storage.prefix_search_page('form', offset, 2, 10)
+        pages.append(page)
+        if not next_offset:
+            break
+        offset = int(next_offset)
+    assert pages == [['form 40', 'form 12'], ['form 7', 'form 5'], ['form 0']]
+    assert storage.prefix_search_page('form', 0, 5, 10) == (
+        ['form 40', 'form 12', 'form 7', 'form 5', 'form 0'], '')
+    assert storage.prefix_search_page('form', 0, 2, 3) == (['form 40', 'form 12'], '2')
+    assert storage.prefix_search_page('form', 2, 2, 3) == (['form 7'], '')
+    assert storage.prefix_search_page('nothing', 0, 2, 10) == ([], '')
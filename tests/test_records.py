@@ -0,0 +1,101 @@
+import json
+import sys
+
+import pytest
+
+from snippet_engine import (
+    ACHIEVEMENTS,
+    CODE_MEMES,
+    PendingSnippetRecord,
+    SnippetRecord,
+    UserRecord,
+)
+
+KNOWN = list(ACHIEVEMENTS)
+MEMES = list(CODE_MEMES)
+
+
+def round_trip(record_cls, data):
+    # JSON -> запись -> JSON и запись -> строка снимка -> запись -> JSON
+    record = record_cls.from_dict(json.loads(json.dumps(data)))
+    assert record.to_meta() == data
+    assert record_cls.from_slots(record.to_slots()).to_meta() == data
+    return record
+
+
+@pytest.mark.parametrize("created_date", [
+    "2024-01-01T10:11:12",
+    "2024-01-01T10:11:12.123456",
+    "2024-01-01T00:00:00+00:00",
+    "2024-01-01T00:00:00.000000",
+    "2024-01-01",
+    "вчера",
+])
+def test_snippet_timestamp_round_trip(created_date):
+    data = {'language': 'PHP', 'author': 'a', 'uses': 3, 'tags': ['WordPress'],
+            'created_date': created_date, 'code_ref': [0, 10, 1]}
+    round_trip(SnippetRecord, data)
+
+
+def test_timestamp_stored_compactly_only_when_lossless():
+    record = SnippetRecord.from_dict({'created_date': "2024-01-01T10:11:12"})
+    assert isinstance(record.created_date, int)
+    record = SnippetRecord.from_dict({'created_date': "2024-01-01T00:00:00+00:00"})
+    assert record.created_date == "2024-01-01T00:00:00+00:00"
+
+
+def test_pending_round_trip_keeps_extra_fields():
+    data = {'language': 'JavaScript', 'author': 'b', 'tags': [], 'created_date': "2025-05-01T08:00:00.5",
+            'user_id': '42', 'code_ref': [10, 5, 0], 'code_size': 700000, 'file_id': 'F1'}
+    round_trip(PendingSnippetRecord, data)
+
+
+def test_tags_are_interned():
+    tag = ''.join(['Word', 'Press'])
+    record = SnippetRecord.from_dict({'tags': [tag]})
+    assert record['tags'][0] is sys.intern('WordPress')
+
+
+@pytest.mark.parametrize("achievements", [
+    [],
+    KNOWN[:3],
+    [KNOWN[2], KNOWN[0]],
+    [KNOWN[0], KNOWN[0]],
+    [KNOWN[1], "старое достижение"],
+    ["старое достижение", KNOWN[1]],
+    ["x", "x"],
+])
+def test_user_flags_round_trip(achievements):
+    data = {'favorites': ['a', 'b'], 'achievements': achievements, 'level': 2, 'join_date': "2024-02-03T04:05:06",
+            'seen_memes': [MEMES[-1], "удалённый мем"], 'last_submission_date': "2025-05-01",
+            'last_moderation_time': "2025-05-01T00:00:00+03:00"}
+    record = round_trip(UserRecord, data)
+    assert list(record['achievements']) == achievements
+    assert len(record['achievements']) == len(achievements)
+
+
+def test_user_date_round_trip():
+    for value in ("2025-05-01", "20250501", "2025-W18-4"):
+        round_trip(UserRecord, {'last_submission_date': value})
+
+
+def test_flags_view_append_and_remove():
+    record = UserRecord.from_dict({'achievements': [KNOWN[2]], 'seen_memes': []})
+    achievements = record['achievements']
+    achievements.append(KNOWN[0])
+    achievements.append(KNOWN[0])
+    achievements.append("новое")
+    assert isinstance(record.achievements, tuple) and record.achievements[1] == ("новое",)
+    assert set(achievements) == {KNOWN[0], KNOWN[2], "новое"}
+    achievements.remove(KNOWN[2])
+    assert list(achievements) == [KNOWN[0], "новое"]
+    with pytest.raises(ValueError):
+        achievements.remove(KNOWN[2])
+
+
+def test_flags_view_on_verbatim_list():
+    record = UserRecord.from_dict({'achievements': [KNOWN[2], KNOWN[0]]})
+    achievements = record['achievements']
+    assert KNOWN[0] in achievements and KNOWN[1] not in achievements
+    achievements.append(KNOWN[1])
+    assert list(achievements) == [KNOWN[2], KNOWN[0], KNOWN[1]]
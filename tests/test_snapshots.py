@@ -0,0 +1,103 @@
+import asyncio
+import os
+import struct
+
+import pytest
+
+from snippet_engine import (
+    SNAPSHOT_VERSION, SharedSnippetStorage, SnippetRecord, UserRecord, check_snapshot, decode_snapshot,
+    encode_snapshot, freeze_records, read_snapshot, snapshot_path, write_data_file,
+)
+
+RECORDS = {
+    'Форма': SnippetRecord({'code': "<?php echo 1;", 'language': 'PHP', 'author': 'ivan', 'uses': 3,
+                            'tags': ['WordPress'], 'created_date': "2025-05-01T10:00:00"}),
+    'Стили': SnippetRecord({'code': "body {}", 'language': 'CSS', 'author': 'anna', 'uses': 0,
+                            'tags': [], 'created_date': "2025-05-02T10:00:00"}),
+}
+
+
+def snapshot_bytes():
+    return encode_snapshot(*freeze_records(RECORDS), SnippetRecord)
+
+
+def as_dicts(records):
+    return {name: record.to_dict() for name, record in records.items()}
+
+
+def test_round_trip():
+    assert as_dicts(decode_snapshot(snapshot_bytes(), SnippetRecord)) == as_dicts(RECORDS)
+
+
+@pytest.mark.parametrize('corrupt, reason', [
+    (lambda data: data[:10], "обрезан"),
+    (lambda data: b'JUNK' + data[4:], "неподдерживаемый формат"),
+    (lambda data: data[:4] + struct.pack('<H', SNAPSHOT_VERSION + 1) + data[6:], "неподдерживаемый формат"),
+    (lambda data: data[:-1] + bytes([data[-1] ^ 1]), "контрольная сумма"),
+    (lambda data: data[:-1], "контрольная сумма"),
+])
+def test_decode_rejects_damaged(corrupt, reason):
+    with pytest.raises(ValueError, match=reason):
+        decode_snapshot(corrupt(snapshot_bytes()), SnippetRecord)
+
+
+def test_decode_rejects_other_schema():
+    with pytest.raises(ValueError, match="схема"):
+        decode_snapshot(snapshot_bytes(), UserRecord)
+
+
+@pytest.fixture
+def saved(tmp_path):
+    json_path = str(tmp_path / 'snippets.json')
+    write_data_file(json_path, SnippetRecord, freeze_records(RECORDS))
+    return json_path
+
+
+def test_written_snapshot_is_loaded(saved):
+    assert check_snapshot(saved, SnippetRecord) is None
+    assert as_dicts(asyncio.run(read_snapshot(saved, SnippetRecord))) == as_dicts(RECORDS)
+
+
+def test_damaged_snapshot_falls_back_to_json(saved):
+    path = snapshot_path(saved)
+    with open(path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 1]))
+    assert check_snapshot(saved, SnippetRecord) == "контрольная сумма не совпадает"
+    assert asyncio.run(read_snapshot(saved, SnippetRecord)) is None
+
+
+def test_other_version_falls_back_to_json(saved):
+    path = snapshot_path(saved)
+    with open(path, 'r+b') as f:
+        f.seek(4)
+        f.write(struct.pack('<H', SNAPSHOT_VERSION + 1))
+    assert check_snapshot(saved, SnippetRecord).startswith("неподдерживаемый формат")
+    assert asyncio.run(read_snapshot(saved, SnippetRecord)) is None
+
+
+def test_snapshot_older_than_json_is_skipped(saved):
+    stat = os.stat(saved)
+    os.utime(snapshot_path(saved), (stat.st_atime, stat.st_mtime - 10))
+    assert check_snapshot(saved, SnippetRecord).startswith("снимок старше JSON")
+    assert asyncio.run(read_snapshot(saved, SnippetRecord)) is None
+
+
+def test_missing_snapshot(tmp_path):
+    json_path = str(tmp_path / 'snippets.json')
+    assert check_snapshot(json_path, SnippetRecord) == "снимка нет"
+    assert asyncio.run(read_snapshot(json_path, SnippetRecord)) is None
+
+
+def test_storage_loads_json_when_snapshot_is_damaged(tmp_path):
+    storage = SharedSnippetStorage(str(tmp_path))
+    write_data_file(storage.snippets_file, SnippetRecord, freeze_records(RECORDS))
+    with open(snapshot_path(storage.snippets_file), 'wb') as f:
+        f.write(b'SNPB')
+    try:
+        asyncio.run(storage.load_snippets())
+        assert as_dicts(storage.snippets) == as_dicts(RECORDS)
+    finally:
+        storage.code_blobs.close()
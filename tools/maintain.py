@@ -0,0 +1,456 @@
+"""Офлайн-обслуживание каталога данных бота.
+
+Все операции читают JSON потоково (по одной записи), поэтому работают и на библиотеках,
+которые не помещаются в память целиком. Только чтение: verify, stats — их можно запускать
+рядом с работающим ботом. Остальные операции перезаписывают файлы, бот должен быть остановлен.
+
+    python tools/maintain.py verify
+    python tools/maintain.py rebuild              # бинарные снимки заново из JSON
+    python tools/maintain.py compact              # убрать из code_blobs.bin блоки удалённых сниппетов
+    python tools/maintain.py purge-favorites      # избранное, указывающее на удалённые сниппеты
+    python tools/maintain.py recompute            # уровни и достижения всех пользователей за один проход
+    python tools/maintain.py relabel [--all] [--dry-run]   # язык по коду для записей с неизвестным языком
+    python tools/maintain.py stats --json
+    python tools/maintain.py export library.ndjson [--pending]
+    python tools/maintain.py import library.ndjson [--to library] [--user-id ID]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import zlib
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snippet_engine import (  # noqa: E402
+    ADMINS_FILENAME,
+    CODE_BLOBS_FILENAME,
+    MAX_CODE_LENGTH,
+    IMPORT_BATCH_SIZE,
+    LANGUAGES,
+    LARGE_CODE_MAX_BYTES,
+    MAX_NAME_LENGTH,
+    PENDING_SNIPPETS_FILENAME,
+    SNIPPETS_FILENAME,
+    USERS_FILENAME,
+    AuthorStats,
+    CodeBlobStore,
+    JsonObjectWriter,
+    PendingSnippetRecord,
+    SnippetEngine,
+    SnippetRecord,
+    UserRecord,
+    apply_user_rules,
+    check_snapshot,
+    detect_language,
+    iter_json_object,
+    language_scores,
+    rebuild_snapshot,
+    snapshot_path,
+    snippet_to_ndjson,
+)
+
+MAX_PROBLEMS = 50
+RELABEL_MARGIN = 2  # --all: метка меняется, только если другой язык набрал в столько раз больше
+
+
+class DataDir:
+    def __init__(self, path):
+        # Без SnippetEngine: он загрузил бы все данные в память
+        self.path = path
+        self.snippets_file = os.path.join(path, SNIPPETS_FILENAME)
+        self.pending_file = os.path.join(path, PENDING_SNIPPETS_FILENAME)
+        self.users_file = os.path.join(path, USERS_FILENAME)
+        self.admins_file = os.path.join(path, ADMINS_FILENAME)
+        self.blobs_file = os.path.join(path, CODE_BLOBS_FILENAME)
+
+    def records(self, json_path):
+        if not os.path.exists(json_path):
+            return iter(())
+        return iter_json_object(json_path)
+
+    def code_files(self):
+        return ((self.snippets_file, SnippetRecord), (self.pending_file, PendingSnippetRecord))
+
+    def data_files(self):
+        return (*self.code_files(), (self.users_file, UserRecord))
+
+    def admins(self):
+        if not os.path.exists(self.admins_file):
+            return set()
+        with open(self.admins_file, encoding='utf-8') as f:
+            return set(json.load(f))
+
+    def snippet_names(self):
+        return {name for name, _ in self.records(self.snippets_file)}
+
+    def open_blobs(self):
+        blobs = CodeBlobStore(self.blobs_file)
+        asyncio.run(blobs.load_dictionaries())
+        return blobs
+
+
+def verify(data, args):
+    # Каждая запись разбирается, код каждого сниппета читается и распаковывается
+    problems = []
+    report = {'problems': problems}
+
+    def problem(text):
+        if len(problems) < MAX_PROBLEMS:
+            problems.append(text)
+        report['problem_count'] = report.get('problem_count', 0) + 1
+
+    blobs = data.open_blobs()
+    names = set()
+    try:
+        for json_path, record_cls in data.code_files():
+            label = os.path.basename(json_path)
+            count = 0
+            for name, value in data.records(json_path):
+                count += 1
+                if json_path == data.snippets_file:
+                    names.add(name)
+                if len(name) > MAX_NAME_LENGTH:
+                    problem(f"{label}: имя длиннее {MAX_NAME_LENGTH}: {name[:40]!r}…")
+                missing = [field for field in ('language', 'author') if field not in value]
+                if missing:
+                    problem(f"{label}: {name!r} без полей {', '.join(missing)}")
+                if 'code' in value:
+                    code = value['code']
+                elif value.get('code_ref'):
+                    try:
+                        code = blobs.read(*value['code_ref'])
+                    except (IOError, KeyError, zlib.error, UnicodeDecodeError) as e:
+                        problem(f"{label}: {name!r}: код не читается ({e})")
+                        continue
+                else:
+                    problem(f"{label}: {name!r} без кода")
+                    continue
+                if 'code_size' in value:
+                    if len(code.encode('utf-8')) != value['code_size'] or value['code_size'] > LARGE_CODE_MAX_BYTES:
+                        problem(f"{label}: {name!r}: размер файла не совпадает или больше {LARGE_CODE_MAX_BYTES}")
+                elif len(code) > MAX_CODE_LENGTH:
+                    problem(f"{label}: {name!r}: код длиннее {MAX_CODE_LENGTH}")
+            report[label] = count
+        dangling = 0
+        users = 0
+        for user_id, value in data.records(data.users_file):
+            users += 1
+            dangling += sum(1 for name in value.get('favorites', ()) if name not in names)
+            if 'join_date' not in value:
+                problem(f"users.json: {user_id} без join_date")
+        report[os.path.basename(data.users_file)] = users
+        if dangling:
+            problem(f"users.json: {dangling} записей избранного указывают на удалённые сниппеты")
+    except ValueError as e:
+        problem(f"повреждённый JSON: {e}")
+    finally:
+        blobs.close()
+    for json_path, record_cls in data.data_files():
+        error = check_snapshot(json_path, record_cls)
+        if error:
+            problem(f"{os.path.basename(snapshot_path(json_path))}: {error}")
+    report['ok'] = not report.get('problem_count')
+    return report
+
+
+def rebuild(data, args):
+    report = {}
+    for json_path, record_cls in data.data_files():
+        if os.path.exists(json_path):
+            count, size = rebuild_snapshot(json_path, record_cls)
+            report[os.path.basename(snapshot_path(json_path))] = {'records': count, 'bytes': size}
+    return report
+
+
+def compact(data, args):
+    # Новый файл блоков только с используемыми блоками; блоки переносятся как есть,
+    # код старых форматов (внутри JSON или без сжатия) сжимается текущим словарём
+    blobs = data.open_blobs()
+    new_path = f"{data.blobs_file}.compact"
+    moved = {}
+    writers = []
+    offset = 0
+    try:
+        with open(new_path, 'wb') as out:
+            for json_path, _ in data.code_files():
+                if not os.path.exists(json_path):
+                    continue
+                writer = JsonObjectWriter(json_path, backup=True, defer=True)
+                writers.append(writer)
+                with writer:
+                    for name, value in iter_json_object(json_path):
+                        ref = tuple(value['code_ref']) if value.get('code_ref') else None
+                        if ref is None and 'code' not in value:
+                            raise ValueError(f"{os.path.basename(json_path)}: {name!r} без кода, compact прерван")
+                        if ref is not None and ref in moved:
+                            new_ref = moved[ref]
+                        else:
+                            if 'code' in value:
+                                chunk, dict_id = blobs.encode(value['code'])
+                            elif len(ref) == 2:
+                                chunk, dict_id = blobs.encode(blobs.read(*ref))
+                            else:
+                                chunk, dict_id = blobs.read_block(*ref[:2]), ref[2]
+                            out.write(chunk)
+                            new_ref = (offset, len(chunk), dict_id)
+                            offset += len(chunk)
+                            if ref is not None:
+                                moved[ref] = new_ref
+                        value.pop('code', None)
+                        value['code_ref'] = list(new_ref)
+                        writer.write(name, value)
+    except BaseException:
+        for writer in writers:
+            writer.discard()
+        if os.path.exists(new_path):
+            os.remove(new_path)
+        raise
+    finally:
+        blobs.close()
+    old_size = os.path.getsize(data.blobs_file) if os.path.exists(data.blobs_file) else 0
+    # Старый файл блоков остаётся в .bak вместе с .bak JSON-файлов на случай сбоя между заменами
+    if os.path.exists(data.blobs_file):
+        os.replace(data.blobs_file, f"{data.blobs_file}.bak")
+    os.replace(new_path, data.blobs_file)
+    for writer in writers:
+        writer.commit()
+    for json_path, record_cls in data.code_files():
+        if os.path.exists(json_path):
+            rebuild_snapshot(json_path, record_cls)
+    return {'bytes_before': old_size, 'bytes_after': offset, 'freed': old_size - offset}
+
+
+def purge_favorites(data, args):
+    names = data.snippet_names()
+    removed = 0
+    users = 0
+    if not os.path.exists(data.users_file):
+        return {'users': 0, 'removed': 0}
+    writer = JsonObjectWriter(data.users_file, backup=True, defer=True)
+    with writer:
+        for user_id, value in iter_json_object(data.users_file):
+            favorites = value.get('favorites', [])
+            kept = [name for name in favorites if name in names]
+            if len(kept) != len(favorites):
+                removed += len(favorites) - len(kept)
+                users += 1
+                value['favorites'] = kept
+            writer.write(user_id, value)
+    if removed:
+        writer.commit()
+        rebuild_snapshot(data.users_file, UserRecord)
+    else:
+        writer.discard()
+    return {'users': users, 'removed': removed}
+
+
+def relabel(data, args):
+    # Записи с языком не из LANGUAGES (например, «Другой») получают язык, определённый по коду;
+    # с --all пересматриваются и остальные, если классификатор уверенно не согласен с меткой
+    blobs = data.open_blobs()
+    report = {'checked': 0, 'relabeled': Counter(), 'undetected': []}
+    try:
+        for json_path, record_cls in data.code_files():
+            if not os.path.exists(json_path):
+                continue
+            changed = 0
+            writer = JsonObjectWriter(json_path, backup=True, defer=True)
+            with writer:
+                for name, value in iter_json_object(json_path):
+                    language = value.get('language')
+                    if language not in LANGUAGES or args.all:
+                        report['checked'] += 1
+                        ref = value.get('code_ref')
+                        code = value['code'] if 'code' in value else blobs.read(*ref)
+                        detected = detect_language(code)
+                        if detected is None:
+                            if language not in LANGUAGES and len(report['undetected']) < MAX_PROBLEMS:
+                                report['undetected'].append(f"{os.path.basename(json_path)}: {name!r}")
+                        elif detected != language:
+                            scores = language_scores(code)
+                            if language not in LANGUAGES or scores[detected] >= RELABEL_MARGIN * max(1, scores[language]):
+                                report['relabeled'][f"{language} → {detected}"] += 1
+                                value['language'] = detected
+                                changed += 1
+                    writer.write(name, value)
+            if changed and not args.dry_run:
+                writer.commit()
+                rebuild_snapshot(json_path, record_cls)
+            else:
+                writer.discard()
+    finally:
+        blobs.close()
+    return report
+
+
+def collect_author_stats(data):
+    # Проход 1: агрегаты по авторам из библиотеки; проход 2: избранное всех пользователей
+    authors = {}
+    author_of = {}
+    for name, value in data.records(data.snippets_file):
+        author = value.get('author')
+        authors.setdefault(author, AuthorStats()).add_snippet(value)
+        author_of[name] = author
+    for user_id, value in data.records(data.users_file):
+        for name in value.get('favorites', ()):
+            if name in author_of:
+                authors[author_of[name]].add_favorite(user_id)
+    return authors
+
+
+def recompute(data, args):
+    authors = collect_author_stats(data)
+    admins = data.admins()
+    empty = AuthorStats()
+    report = {'users': 0, 'level_changes': 0, 'new_achievements': Counter()}
+    if not os.path.exists(data.users_file):
+        return report
+    writer = JsonObjectWriter(data.users_file, backup=True)
+    with writer:
+        for user_id, value in iter_json_object(data.users_file):
+            user = UserRecord.from_dict(value)
+            stats = authors.get(user.get('username', ''), empty)
+            level_up, new_achievements = apply_user_rules(user, stats.snippets, stats.uses, stats, user_id in admins)
+            report['users'] += 1
+            report['level_changes'] += level_up
+            report['new_achievements'].update(new_achievements)
+            writer.write(user_id, user.to_dict())
+    rebuild_snapshot(data.users_file, UserRecord)
+    return report
+
+
+def stats(data, args):
+    report = {}
+    languages = Counter()
+    tags = Counter()
+    uses = 0
+    referenced = 0
+    count = 0
+    for _, value in data.records(data.snippets_file):
+        count += 1
+        uses += value.get('uses', 0)
+        languages[value.get('language')] += 1
+        tags.update(value.get('tags', ()))
+        if value.get('code_ref'):
+            referenced += value['code_ref'][1]
+    report['snippets'] = {'count': count, 'uses': uses, 'languages': languages, 'tags': tags}
+    pending = 0
+    for _, value in data.records(data.pending_file):
+        pending += 1
+        if value.get('code_ref'):
+            referenced += value['code_ref'][1]
+    report['pending'] = pending
+    levels = Counter()
+    achievements = Counter()
+    users = 0
+    favorites = 0
+    for _, value in data.records(data.users_file):
+        users += 1
+        levels[value.get('level', 0)] += 1
+        achievements.update(value.get('achievements', ()))
+        favorites += len(value.get('favorites', ()))
+    report['users'] = {'count': users, 'favorites': favorites, 'levels': levels, 'achievements': achievements}
+    blobs_size = os.path.getsize(data.blobs_file) if os.path.exists(data.blobs_file) else 0
+    report['code_blobs'] = {'bytes': blobs_size, 'referenced_bytes': referenced,
+                            'garbage_bytes': max(0, blobs_size - referenced)}
+    report['files'] = {
+        name: os.path.getsize(os.path.join(data.path, name))
+        for name in sorted(os.listdir(data.path)) if os.path.isfile(os.path.join(data.path, name))
+    }
+    return report
+
+
+def export_ndjson(data, args):
+    # Из JSON по одной записи, код читается из файла блоков
+    json_path = data.pending_file if args.pending else data.snippets_file
+    blobs = data.open_blobs()
+    count = 0
+    try:
+        with open(args.path, 'w', encoding='utf-8') as out:
+            for name, value in data.records(json_path):
+                ref = value.pop('code_ref', None)
+                if 'code' not in value and ref:
+                    value = {'code': blobs.read(*ref), **value}
+                out.write(snippet_to_ndjson(name, value))
+                count += 1
+    finally:
+        blobs.close()
+    return {'exported': count, 'path': args.path}
+
+
+def import_ndjson(data, args):
+    # Через SnippetEngine: записи добавляются пакетами, как при загрузке файла администратором
+    async def run():
+        engine = SnippetEngine(data.path)
+        await engine.initialize()
+        try:
+            with open(args.path, encoding='utf-8') as f:
+                return await engine.storage.import_snippets(
+                    f, pending=args.to == 'pending', user_id=args.user_id, batch_size=args.batch_size
+                )
+        finally:
+            engine.close()
+    return asyncio.run(run())
+
+
+COMMANDS = {
+    'verify': (verify, "проверить записи, код и снимки"),
+    'rebuild': (rebuild, "пересобрать бинарные снимки из JSON"),
+    'compact': (compact, "убрать неиспользуемые блоки из файла кода"),
+    'purge-favorites': (purge_favorites, "удалить избранное на удалённые сниппеты"),
+    'recompute': (recompute, "пересчитать уровни и достижения всех пользователей"),
+    'relabel': (relabel, "определить язык по коду для записей с неизвестным языком"),
+    'stats': (stats, "сводная статистика"),
+    'export': (export_ndjson, "выгрузить сниппеты в NDJSON"),
+    'import': (import_ndjson, "загрузить сниппеты из NDJSON"),
+}
+
+
+def print_report(report, indent=''):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{indent}{key}:")
+            print_report(value, indent + '  ')
+        elif isinstance(value, list):
+            print(f"{indent}{key}:")
+            for item in value:
+                print(f"{indent}  - {item}")
+        else:
+            print(f"{indent}{key}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default='data', help="каталог данных бота")
+    parser.add_argument('--json', action='store_true', help="вывести отчёт в JSON")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, (func, help_text) in COMMANDS.items():
+        commands.add_parser(name, help=help_text).set_defaults(func=func)
+    commands.choices['relabel'].add_argument('--all', action='store_true',
+                                             help="пересмотреть и записи с известным языком")
+    commands.choices['relabel'].add_argument('--dry-run', action='store_true', help="только отчёт, без записи")
+    commands.choices['export'].add_argument('path', help="NDJSON-файл")
+    commands.choices['export'].add_argument('--pending', action='store_true', help="очередь модерации вместо библиотеки")
+    commands.choices['import'].add_argument('path', help="NDJSON-файл: по объекту {name, code, language, author, ...} на строку")
+    commands.choices['import'].add_argument('--to', choices=('pending', 'library'), default='pending',
+                                            help="куда добавить сниппеты (по умолчанию — на модерацию)")
+    commands.choices['import'].add_argument('--user-id', help="user_id автора для записей без него (очередь модерации)")
+    commands.choices['import'].add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    if not os.path.isdir(args.data_dir):
+        sys.exit(f"Каталог {args.data_dir} не найден")
+    report = args.func(DataDir(args.data_dir), args)
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(report)
+    if args.command == 'verify' and not report['ok']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
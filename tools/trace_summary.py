@@ -0,0 +1,151 @@
+"""Сводка по трассам бота (data/traces/spans.jsonl*).
+
+Для каждого типа взаимодействия (тип апдейта + команда/префикс callback + обработчик)
+считает перцентили длительности, среднее число вызовов Bot API, сохранений и чтений кода
+на апдейт, а также долю критического пути, приходящуюся на API, хранилище и код бота.
+
+    python tools/trace_summary.py data/traces/spans.jsonl*
+"""
+import argparse
+import glob
+import json
+import sys
+from collections import Counter, defaultdict
+
+CATEGORIES = (
+    ('api.', 'API'),
+    ('storage.', 'хранилище'),
+    ('achievements.', 'достижения'),
+)
+
+
+def load_traces(paths):
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue  # строка, оборванная при ротации
+                span['end'] = span['start'] + span['duration_ms'] / 1000
+                traces[span['trace']].append(span)
+    return traces
+
+
+def category(span):
+    for prefix, name in CATEGORIES:
+        if span['name'].startswith(prefix):
+            return name
+    return 'бот'
+
+
+def critical_path(span, children, totals):
+    # Идём от конца спана назад: на каждом шаге берём дочерний спан, завершившийся последним
+    # до текущей точки; время, не покрытое детьми, — собственное время спана
+    cursor = span['end']
+    covered = 0.0
+    for child in sorted(children.get(span['span'], ()), key=lambda s: s['end'], reverse=True):
+        if child['end'] > cursor + 1e-6:
+            continue
+        critical_path(child, children, totals)
+        covered += child['duration_ms']
+        cursor = child['start']
+    totals[category(span)] += max(0.0, span['duration_ms'] - covered)
+
+
+def interaction(root, spans):
+    attrs = root.get('attrs', {})
+    key = attrs.get('update_type', root['name'])
+    if 'command' in attrs:
+        key = f"{key} {attrs['command']}"
+    handlers = [s['attrs'].get('handler') for s in spans if s['name'] == 'handler']
+    if handlers:
+        key = f"{key} → {handlers[0]}"
+    return key
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(traces):
+    groups = defaultdict(lambda: {'durations': [], 'counts': Counter(), 'path': Counter(), 'errors': 0})
+    for spans in traces.values():
+        roots = [s for s in spans if s['parent'] is None]
+        if len(roots) != 1:
+            continue  # трасса не дописана (ротация или остановка бота)
+        root = roots[0]
+        children = defaultdict(list)
+        for span in spans:
+            if span['parent'] is not None:
+                children[span['parent']].append(span)
+        group = groups[interaction(root, spans)]
+        group['durations'].append(root['duration_ms'])
+        group['errors'] += any('error' in s for s in spans)
+        for span in spans:
+            if span['parent'] is not None and span['name'] != 'handler':
+                group['counts'][span['name']] += 1
+        critical_path(root, children, group['path'])
+    return groups
+
+
+def describe_counts(counts, n):
+    api = sum(v for k, v in counts.items() if k.startswith('api.'))
+    parts = [f"{api / n:.1f} API"]
+    methods = ', '.join(f"{k[4:]}×{v / n:.1f}" for k, v in counts.most_common() if k.startswith('api.'))
+    if methods:
+        parts[0] += f" ({methods})"
+    for name, label in (('storage.save', 'сохр.'), ('storage.read_code', 'чтен. кода'),
+                        ('storage.append_code', 'запис. кода'), ('achievements.evaluate', 'пересчёт достижений')):
+        if counts[name]:
+            parts.append(f"{counts[name] / n:.1f} {label}")
+    return ' + '.join(parts)
+
+
+def report(groups, limit):
+    rows = sorted(groups.items(), key=lambda item: sum(item[1]['durations']), reverse=True)[:limit]
+    for key, group in rows:
+        durations = group['durations']
+        n = len(durations)
+        print(f"{key}: n={n}, p50 {percentile(durations, 0.5):.0f} мс, "
+              f"p95 {percentile(durations, 0.95):.0f} мс, max {max(durations):.0f} мс"
+              + (f", с ошибками {group['errors']}" if group['errors'] else ""))
+        print(f"  = {describe_counts(group['counts'], n)}")
+        total = sum(group['path'].values()) or 1.0
+        path = ' · '.join(f"{name} {value / n:.0f} мс ({value / total:.0%})"
+                          for name, value in group['path'].most_common())
+        print(f"  критический путь: {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help="JSONL-файлы спанов (по умолчанию data/traces/spans.jsonl*)")
+    parser.add_argument('--limit', type=int, default=30, help="сколько взаимодействий показать")
+    parser.add_argument('--json', action='store_true', help="вывести сводку в JSON")
+    args = parser.parse_args()
+    paths = args.paths or sorted(glob.glob('data/traces/spans.jsonl*'))
+    if not paths:
+        sys.exit("Файлы трасс не найдены")
+    groups = summarize(load_traces(paths))
+    if args.json:
+        json.dump({
+            key: {
+                'count': len(group['durations']),
+                'p50_ms': percentile(group['durations'], 0.5),
+                'p95_ms': percentile(group['durations'], 0.95),
+                'max_ms': max(group['durations']),
+                'errors': group['errors'],
+                'spans_per_update': {k: v / len(group['durations']) for k, v in group['counts'].items()},
+                'critical_path_ms': {k: v / len(group['durations']) for k, v in group['path'].items()},
+            }
+            for key, group in groups.items()
+        }, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        report(groups, args.limit)
+
+
+if __name__ == '__main__':
+    main()